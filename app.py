@@ -17,6 +17,18 @@ app.layout = create_layout()
 from callbacks import register_callbacks
 register_callbacks(app)
 
+# ---- Boundary GeoJSON as cached static files (/geojson/<layer>-<level>.json) ----
+from geo_assets import register_geojson_routes
+register_geojson_routes(app)
+
+# ---- Pre-clustered point tiles (/tiles/<layer>/<z>/<x>/<y>.json, see tiles.py) ----
+from tiles import register_tile_routes
+register_tile_routes(app)
+
+# ---- Pick up new files dropped into data/ without a restart ----
+import data_manager
+data_manager.start_reloader()
+
 # Local-only execution
 if __name__ == "__main__":
     app.run_server(debug=True)
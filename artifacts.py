@@ -0,0 +1,249 @@
+# this file handles the on-disk cache of cleaned / joined tables
+# data_manager builds each table once, we save it as an Arrow file and every
+# later start just memory-maps it back (until one of its inputs changes)
+#
+# build / refresh everything ahead of time with:
+#     python artifacts.py            (rebuild only stale artifacts)
+#     python artifacts.py --force    (throw away all artifacts first)
+
+import hashlib
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # no pyarrow -> tables are simply rebuilt on every start
+    pa = None
+    feather = None
+
+ARTIFACT_DIR = os.path.join("data", "artifacts")
+FILE_HASHES = os.path.join(ARTIFACT_DIR, "file_hashes.json")
+
+# bump when the artifact file format itself changes (code changes in the
+# build steps and their helpers are picked up by code_hash)
+ARTIFACT_VERSION = 1
+
+# modules in this directory count as project code for code_hash
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# get("name") calls (not dict.get): the datasets a build step is derived from
+_GET_CALL = re.compile(r"""(?<![.\w])get\(\s*["'](\w+)["']\s*\)""")
+
+_hash_lock = threading.Lock()
+
+
+def _load_hash_manifest():
+    try:
+        with open(FILE_HASHES, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def file_hash(path):
+    """
+    Return the sha256 of a file's contents. Hashes are remembered by
+    (size, mtime) in file_hashes.json so unchanged files are not re-read.
+    """
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+
+    with _hash_lock:
+        manifest = _load_hash_manifest()
+        entry = manifest.get(path)
+        if entry and entry[:2] == stamp:
+            return entry[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+
+        manifest[path] = stamp + [digest.hexdigest()]
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        tmp = f"{FILE_HASHES}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, FILE_HASHES)
+
+    return digest.hexdigest()
+
+
+def _is_project(obj):
+    module = sys.modules.get(getattr(obj, "__module__", None))
+    path = getattr(module, "__file__", None)
+    return path is not None and os.path.dirname(os.path.abspath(path)) == PROJECT_DIR
+
+
+def _code_names(code):
+    # global / attribute names used by a code object and the ones nested in it
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def _functions(obj):
+    # the plain functions behind a function or a class's methods / properties
+    if not inspect.isclass(obj):
+        return [obj]
+    functions = []
+    for value in vars(obj).values():
+        if isinstance(value, property):
+            value = value.fget
+        elif isinstance(value, (classmethod, staticmethod)):
+            value = value.__func__
+        if inspect.isfunction(value):
+            functions.append(value)
+    return functions
+
+
+def code_sources(fn):
+    """
+    Source of fn and, transitively, of every project function / class and
+    JSON-able module constant it refers to by name: {qualified name: text}.
+    """
+    found = {}
+    todo = [fn]
+    while todo:
+        obj = todo.pop()
+        qualname = f"{obj.__module__}.{obj.__qualname__}"
+        if qualname in found:
+            continue
+        found[qualname] = inspect.getsource(obj)
+
+        for function in _functions(obj):
+            namespace = function.__globals__
+            for name in _code_names(function.__code__):
+                if name not in namespace:
+                    continue
+                value = namespace[name]
+                if inspect.isfunction(value) or inspect.isclass(value):
+                    if _is_project(value):
+                        todo.append(value)
+                elif not inspect.ismodule(value):
+                    try:
+                        found[f"{function.__module__}.{name}"] = json.dumps(value, sort_keys=True)
+                    except (TypeError, ValueError):
+                        pass  # not a plain constant (a snapshot, a lock, ...)
+    return found
+
+
+def code_hash(fn, datasets=None):
+    """
+    Hash of code_sources(fn). With `datasets`, every get("name") in that
+    code also mixes in datasets(name), the key of the dataset it reads.
+    """
+    sources = code_sources(fn)
+    digest = hashlib.sha256()
+    for qualname in sorted(sources):
+        digest.update(qualname.encode())
+        digest.update(sources[qualname].encode())
+    if datasets is not None:
+        used = set(_GET_CALL.findall("".join(sources.values())))
+        for name in sorted(used):
+            digest.update(name.encode())
+            digest.update(datasets(name).encode())
+    return digest.hexdigest()
+
+
+def fingerprint(inputs, build=None, datasets=None):
+    """
+    Content hash of the input files, plus code_hash(build, datasets): the
+    build step's source, the helpers it calls and the datasets it reads, so
+    editing any of them also invalidates the artifact.
+    """
+    digest = hashlib.sha256(str(ARTIFACT_VERSION).encode())
+    for path in inputs:
+        digest.update(path.encode())
+        digest.update(file_hash(path).encode())
+    if build is not None:
+        digest.update(code_hash(build, datasets).encode())
+    return digest.hexdigest()[:16]
+
+
+def artifact_path(name, key):
+    return os.path.join(ARTIFACT_DIR, f"{name}-{key}.arrow")
+
+
+def read_artifact(path):
+    """
+    Memory-map an Arrow artifact back into a DataFrame.
+    """
+    table = feather.read_table(path, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def write_artifact(df, path):
+    """
+    Write a DataFrame as an uncompressed Arrow (Feather v2) file, atomically.
+    """
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    feather.write_feather(df, tmp, compression="uncompressed")
+    os.replace(tmp, path)
+
+
+def _remove_old(name, keep):
+    for fname in os.listdir(ARTIFACT_DIR):
+        if fname.startswith(name + "-") and fname.endswith(".arrow"):
+            path = os.path.join(ARTIFACT_DIR, fname)
+            if path != keep:
+                os.remove(path)
+
+
+def cached_table(name, key, build):
+    """
+    Return the table `name`: memory-mapped from its artifact if one exists for
+    `key` (its fingerprint), otherwise built with build() and saved.
+    """
+    if feather is None:
+        return build()
+
+    path = artifact_path(name, key)
+    if os.path.exists(path):
+        try:
+            return read_artifact(path)
+        except (OSError, pa.ArrowException):
+            pass  # unreadable (e.g. truncated) -> rebuild below
+
+    df = build()
+    try:
+        write_artifact(df, path)
+        _remove_old(name, keep=path)
+    except (OSError, pa.ArrowException) as e:
+        print(f"artifacts: could not save {name}: {e}", file=sys.stderr)
+    return df
+
+
+def clear_artifacts():
+    """
+    Delete every saved artifact (the file hash manifest is kept).
+    """
+    if not os.path.isdir(ARTIFACT_DIR):
+        return
+    for fname in os.listdir(ARTIFACT_DIR):
+        if fname.endswith(".arrow"):
+            os.remove(os.path.join(ARTIFACT_DIR, fname))
+
+
+if __name__ == "__main__":
+    if "--force" in sys.argv:
+        clear_artifacts()
+
+    # loading every table through data_manager rebuilds the stale ones
+    import data_manager
+
+    for name in data_manager.TABLES:
+        data_manager.get(name)
+
+    for fname in sorted(os.listdir(ARTIFACT_DIR)):
+        if fname.endswith(".arrow"):
+            size = os.path.getsize(os.path.join(ARTIFACT_DIR, fname))
+            print(f"{fname:45s} {size / 1e6:8.2f} MB")
@@ -0,0 +1,143 @@
+// browser-side completion-year filter for the affordable housing map
+//
+// the affh-points-data store carries the aff_points layer (sorted by year) and
+// the council district x year prefix sums as base64 typed arrays (see
+// data_manager.load_aff_points_client). Moving affh-year-slider re-slices the
+// points trace and recomputes the council totals here, so the server is not
+// involved and the rest of the figure (council GeoJSON, listings) is reused.
+
+(function () {
+    var POINTS_TRACE = "Affordable Housing (points)";
+    var COUNCIL_TRACE = "Council District Total Units";
+    var ARRAY_TYPES = {
+        float32: Float32Array,
+        float64: Float64Array,
+        int16: Int16Array,
+        int32: Int32Array,
+    };
+
+    // decoded arrays per store value, so a drag doesn't decode them again
+    var decodedCache = new WeakMap();
+
+    function decodeArray(packed) {
+        var bin = atob(packed.data);
+        var bytes = new Uint8Array(bin.length);
+        for (var i = 0; i < bin.length; i++) {
+            bytes[i] = bin.charCodeAt(i);
+        }
+        return new ARRAY_TYPES[packed.dtype](bytes.buffer);
+    }
+
+    function decode(data) {
+        var decoded = decodedCache.get(data);
+        if (!decoded) {
+            decoded = {
+                lat: decodeArray(data.points.lat),
+                lon: decodeArray(data.points.lon),
+                units: decodeArray(data.points.units),
+                year: decodeArray(data.points.year),
+                name: decodeArray(data.points.name),
+                names: data.points.names,
+                firstYear: data.council.first_year,
+                nYears: data.council.n_years,
+                cum: decodeArray(data.council.cum),
+            };
+            decodedCache.set(data, decoded);
+        }
+        return decoded;
+    }
+
+    // first position whose (sorted) value is >= v
+    function lowerBound(values, v) {
+        var lo = 0, hi = values.length;
+        while (lo < hi) {
+            var mid = (lo + hi) >>> 1;
+            if (values[mid] < v) { lo = mid + 1; } else { hi = mid; }
+        }
+        return lo;
+    }
+
+    function clamp(v, lo, hi) {
+        return Math.min(Math.max(v, lo), hi);
+    }
+
+    // same sizes / colours as update_affh_map
+    function pointsTrace(trace, d, yrMin, yrMax) {
+        var start = lowerBound(d.year, yrMin);
+        var end = lowerBound(d.year, yrMax + 1);
+        var n = end - start;
+
+        var maxUnits = 0;
+        for (var i = start; i < end; i++) {
+            maxUnits = Math.max(maxUnits, d.units[i]);
+        }
+
+        var lat = new Array(n), lon = new Array(n), size = new Array(n);
+        var color = new Array(n), customdata = new Array(n);
+        for (var k = 0; k < n; k++) {
+            var u = d.units[start + k];
+            lat[k] = d.lat[start + k];
+            lon[k] = d.lon[start + k];
+            size[k] = maxUnits > 0 ? 6 + (u / maxUnits) * 24 : 10;
+            color[k] = clamp(u, 0, 200);
+            customdata[k] = [d.names[d.name[start + k]], u, d.year[start + k]];
+        }
+
+        return Object.assign({}, trace, {
+            lat: lat,
+            lon: lon,
+            marker: Object.assign({}, trace.marker, {size: size, color: color}),
+            customdata: customdata,
+        });
+    }
+
+    // units completed in [yrMin, yrMax] per district, from the prefix sums
+    function councilTrace(trace, d, yrMin, yrMax) {
+        var width = d.nYears + 1;
+        var j = clamp(yrMax - d.firstYear + 1, 0, d.nYears);
+        var i = Math.min(clamp(yrMin - d.firstYear, 0, d.nYears), j);
+        var label = yrMin + "–" + yrMax;
+
+        var z = [], zmax = 1;
+        var customdata = (trace.customdata || []).map(function (row, r) {
+            var units = d.cum[r * width + j] - d.cum[r * width + i];
+            z.push(units);
+            zmax = Math.max(zmax, units);
+            return [units].concat(row.slice(1, 5), [label]);
+        });
+
+        var colorbar = Object.assign({}, trace.colorbar);
+        colorbar.title = Object.assign({}, colorbar.title, {text: "Units " + label});
+
+        return Object.assign({}, trace, {
+            z: z,
+            zmax: zmax,
+            customdata: customdata,
+            colorbar: colorbar,
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        affh: {
+            filterYears: function (yearRange, data, figure) {
+                if (!yearRange || yearRange.length !== 2 || !data || !figure) {
+                    return window.dash_clientside.no_update;
+                }
+                var d = decode(data);
+                var yrMin = Math.min(yearRange[0], yearRange[1]);
+                var yrMax = Math.max(yearRange[0], yearRange[1]);
+
+                var traces = figure.data.map(function (trace) {
+                    if (trace.name === POINTS_TRACE) {
+                        return pointsTrace(trace, d, yrMin, yrMax);
+                    }
+                    if (trace.name === COUNCIL_TRACE) {
+                        return councilTrace(trace, d, yrMin, yrMax);
+                    }
+                    return trace;
+                });
+                return Object.assign({}, figure, {data: traces});
+            },
+        },
+    });
+})();
@@ -0,0 +1,133 @@
+# this file times building the map traces with figures.py against
+# graph_objects / px (plus the .to_dict() fig_cache used to do), on the same
+# arrays: random listing points and the ZIP table in data/merged_zip_data.csv
+#
+#     python -m benchmarks.figure_traces
+
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import figures
+from data_manager import CRIME_ZIP_CSV, crime_color_map
+
+N_POINTS = 50_000
+ZIP_GEOJSON_URL = "/geo/zip.json"
+HOVER_DATA = ["zipcode", "airbnb_count", "average_price", "total_major_crime_reports"]
+
+
+def listing_points(n=N_POINTS, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "latitude": rng.uniform(40.55, 40.90, n),
+        "longitude": rng.uniform(-74.05, -73.75, n),
+        "name": [f"listing {i}" for i in range(n)],
+    })
+
+
+def zip_table():
+    df = pd.read_csv(CRIME_ZIP_CSV, dtype={"zipcode": str})
+    crime = np.where(
+        df["total_major_crime_reports"] > df["total_major_crime_reports"].median(), "High", "Low"
+    )
+    listings = np.where(df["airbnb_count"] > df["airbnb_count"].median(), "High", "Low")
+    df["crime_airbnb_category"] = [
+        f"{c} crime / {l} listings" for c, l in zip(crime, listings)
+    ]
+    return df
+
+
+# ------------------------------------------------------------
+# the same trace, both ways
+# ------------------------------------------------------------
+def cases(points, zips):
+    layout = figures.map_layout(10)
+    bivariate_hover = HOVER_DATA + ["crime_airbnb_category"]
+
+    yield (
+        f"scattermapbox ({len(points):,} points)",
+        lambda: figures.figure([figures.scatter_mapbox(
+            points["latitude"], points["longitude"],
+            marker={"size": 4, "opacity": 0.15},
+            hovertext=points["name"], hoverinfo="text",
+        )], layout),
+        lambda: go.Figure(go.Scattermapbox(
+            lat=points["latitude"], lon=points["longitude"], mode="markers",
+            marker=dict(size=4, opacity=0.15),
+            hovertext=points["name"], hoverinfo="text",
+        ), layout).to_dict(),
+    )
+    yield (
+        f"choroplethmapbox ({len(zips)} zips)",
+        lambda: figures.figure([figures.choropleth_mapbox(
+            ZIP_GEOJSON_URL, zips["zipcode"], zips["airbnb_count"], "properties.zipcode",
+            colorscale=figures.named_colorscale("Viridis"),
+            marker={"opacity": 1, "line": {"width": 1, "color": "black"}},
+        )], layout),
+        lambda: go.Figure(go.Choroplethmapbox(
+            geojson=ZIP_GEOJSON_URL, locations=zips["zipcode"], z=zips["airbnb_count"],
+            featureidkey="properties.zipcode", colorscale="Viridis",
+            marker_opacity=1, marker_line_width=1, marker_line_color="black",
+        ), layout).to_dict(),
+    )
+
+    def continuous():
+        traces, extra = figures.continuous_choropleth(
+            zips, ZIP_GEOJSON_URL, "zipcode", "properties.zipcode",
+            color="total_major_crime_reports", hover_data=HOVER_DATA,
+        )
+        return figures.figure(traces, {**extra, **layout})
+
+    yield (
+        "px continuous choropleth",
+        continuous,
+        lambda: px.choropleth_mapbox(
+            zips, geojson=ZIP_GEOJSON_URL, locations="zipcode",
+            featureidkey="properties.zipcode", color="total_major_crime_reports",
+            hover_data=HOVER_DATA, color_continuous_scale="Viridis", opacity=0.7,
+        ).update_layout(layout).to_dict(),
+    )
+
+    def discrete():
+        traces, extra = figures.discrete_choropleth(
+            zips, ZIP_GEOJSON_URL, "zipcode", "properties.zipcode",
+            color="crime_airbnb_category", hover_data=bivariate_hover,
+            color_map=crime_color_map,
+        )
+        return figures.figure(traces, {**extra, **layout})
+
+    yield (
+        "px discrete choropleth",
+        discrete,
+        lambda: px.choropleth_mapbox(
+            zips, geojson=ZIP_GEOJSON_URL, locations="zipcode",
+            featureidkey="properties.zipcode", color="crime_airbnb_category",
+            hover_data=bivariate_hover, color_discrete_map=crime_color_map, opacity=0.75,
+        ).update_layout(layout).to_dict(),
+    )
+
+
+def best(fn, repeat):
+    fn()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times) * 1000
+
+
+def benchmark(repeat=5):
+    """
+    Best-of-`repeat` milliseconds per trace, figures.py vs go / px.
+    """
+    print(f"{'trace':34s} {'dict ms':>8s} {'go/px ms':>9s}")
+    for label, new, old in cases(listing_points(), zip_table()):
+        print(f"{label:34s} {best(new, repeat):8.2f} {best(old, repeat):9.2f}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,33 +1,231 @@
 # this file will contain all of our callbacks
 
-import plotly.express as px
-import plotly.graph_objects as go
-from dash.dependencies import Input, Output
-from dash import html
-import pandas as pd
-
-from data_manager import (
-    airbnb_df,
-    aff_points,
-    council_choropleth_trace,
-    nta_geojson,
-    airbnb_10k,
-    df_map,
-    subway_df,
-    room_colors,
-    merged_zip_data,
-    nyc_zip,
-    crime_color_map
-)
-
-from layouts.airbnb_only_layout import airbnb_only_layout
-from layouts.affordable_housing_layout import affordable_housing_layout
-from layouts.transit_layout import transit_layout
-from layouts.crime_layout import crime_layout
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from dash import Patch, html, ctx, no_update
+import functools
+import numpy as np
+
+# data_manager loads every dataset lazily, so each callback only reads
+# (and on first use builds) the tables its own view needs. Each callback
+# takes the live snapshot once, so a data reload can't mix versions.
+import data_manager
+import fig_cache
+import figures
+from fig_cache import as_set, clamp_range
+from geo_assets import detail_level, geojson_url
+from viewport import cells_trace, default_window, listing_layer, view_window, window_key
+from data_manager import room_colors, crime_color_map
+from utils import fit_line
+
+from layout import PAGES, VIEW_PAGES
+from layouts.airbnb_only_layout import FILTER_STYLE, HIDDEN, create_airbnb_only_layout
+from layouts.affordable_housing_layout import create_affordable_housing_layout
+from layouts.transit_layout import create_transit_layout
+from layouts.crime_layout import create_crime_layout
+
+# page -> its layout (the Airbnb page also takes the view mode)
+PAGE_LAYOUTS = {
+    "airbnb": create_airbnb_only_layout,
+    "affh": create_affordable_housing_layout,
+    "transit": create_transit_layout,
+    "crime": create_crime_layout,
+}
+
+
+def ignore_map_state(**uses):
+    """
+    Decorator: skip the update when it was triggered only by a map state store
+    (<map>-detail, <map>-viewport) the current figure doesn't depend on.
+    uses: store kind ("detail" / "viewport") -> predicate on the callback's
+    arguments saying whether the figure uses it.
+    """
+    def wrap(fn):
+        @functools.wraps(fn)
+        def guarded(*args):
+            trigger = ctx.triggered_id
+            if isinstance(trigger, str):
+                kind = trigger.rsplit("-", 1)[-1]
+                if kind in uses and not uses[kind](*args):
+                    raise PreventUpdate
+            return fn(*args)
+        return guarded
+    return wrap
+
+
+# ------------------------------------------------------------
+# Affordable housing map layers (see update_affh_map)
+# ------------------------------------------------------------
+# trace order of the affh figure (after them: an invisible anchor point)
+AFFH_LAYERS = ["airbnb", "aff_points", "council"]
+
+
+def affh_colorbar_x(layers):
+    """
+    Colorbar x of the (aff_points, council) traces: side by side when both
+    are shown, otherwise at the right edge.
+    """
+    if "aff_points" in layers and "council" in layers:
+        return 0.88, 0.96
+    return 0.96, 0.96
+
+
+def affh_airbnb_key(snap, boroughs, window):
+    # what the airbnb trace shows (JSON-friendly, kept in affh-map-airbnb)
+    zoom, bounds = window_key(window or default_window(10.5))
+    return [snap.version, list(as_set(boroughs)), zoom, list(bounds)]
+
+
+def affh_airbnb_trace(snap, boroughs, window):
+    kind, df_copy = listing_layer(
+        snap.airbnb_df, snap.airbnb_grid, window or default_window(10.5),
+        index=snap.airbnb_filter, boroughs=boroughs,
+    )
+
+    if kind == "cells":
+        return cells_trace(df_copy, name="Airbnb Listings", showlegend=True)
+    return figures.scatter_mapbox(
+        df_copy["latitude"],
+        df_copy["longitude"],
+        marker=dict(
+            size=7,
+            opacity=0.65
+        ),
+        name="Airbnb Listings",
+        text=df_copy["name"],
+        hovertemplate="Airbnb: %{text}<extra></extra>",
+    )
+
+
+def affh_points_trace(snap, yr_min, yr_max):
+    # Affordable Housing points (All Counted Units); points are sorted by
+    # year, so the range is one slice
+    points = snap.aff_points.iloc[
+        data_manager.year_slice(snap.aff_point_years, yr_min, yr_max)
+    ]
+
+    units = points["All Counted Units"].fillna(0)
+    units_clipped = units.clip(lower=0, upper=200)
+
+    # Marker size scaled by units
+    if units.max() > 0:
+        marker_sizes = 6 + (units / units.max()) * 24
+    else:
+        marker_sizes = [10] * len(points)
+
+    return figures.scatter_mapbox(
+        points["Latitude"],
+        points["Longitude"],
+        marker=dict(
+            size=figures.array(marker_sizes),
+            sizemode="area",
+            sizemin=5,
+            opacity=0.9,
+            color=figures.array(units_clipped),
+            colorscale=figures.named_colorscale("Viridis"),  # MATCH standalone script
+            cmin=0,
+            cmax=200,
+            showscale=True,
+            colorbar=figures.colorbar(
+                "Units by project",
+                len=0.55,
+                lenmode="fraction",
+                thickness=18,
+                x=0.88,
+            ),
+        ),
+        name="Affordable Housing (points)",
+        customdata=points[
+            ["Project Name", "All Counted Units", "CompletionYear"]
+        ].values,
+        hovertemplate=(
+            "Project: %{customdata[0]}<br>"
+            "All Counted Units: %{customdata[1]}<br>"
+            "Completion Year: %{customdata[2]}"
+            "<extra></extra>"
+        ),
+    )
+
+
+def affh_council_trace(snap, detail, yr_min, yr_max):
+    # Council District polygon layer (Total Units in the year range)
+    aff_by_council = snap.aff_by_council
+
+    # units completed in the slider's years, from the prefix sums
+    units = data_manager.council_units_between(
+        snap.council_units_cumulative, yr_min, yr_max
+    )
+    customdata = np.column_stack([
+        units,
+        aff_by_council[["airbnb_listings", "Population", "Area_sqmi", "total_units"]].to_numpy(dtype=float),
+    ]).tolist()
+    year_label = f"{yr_min}–{yr_max}"
+    for row in customdata:
+        row.append(year_label)
+
+    # Build the council choropleth exactly like standalone version
+    return figures.choropleth_mapbox(
+        geojson_url("council", snap, detail),
+        aff_by_council["COUNDIST_str"],
+        units,
+        "properties.COUNDIST",
+        colorscale=figures.named_colorscale("GnBu"),
+        zmin=0,
+        zmax=max(1, units.max(initial=0)),
+        marker=dict(opacity=0.45, line=dict(width=0.5)),
+        name="Council District Total Units",
+        customdata=customdata,
+        hovertemplate=(
+            "Council District: %{location}<br>"
+            "Affordable units completed %{customdata[5]}: %{customdata[0]:,.0f}<br>"
+            "Total affordable units, all time (Total Units): %{customdata[4]:,.0f}<br>"
+            "Airbnb last 12 month listing (# in district): %{customdata[1]}<br>"
+            "Council District Population: %{customdata[2]}<br>"
+            "District Area: %{customdata[3]:.2f} sq mi"
+            "<extra></extra>"
+        ),
+        colorbar=figures.colorbar(
+            f"Units {year_label}",
+            len=0.55,
+            thickness=18,
+            x=0.96,
+            tickformat=",d"
+        ),
+    )
 
 
 def register_callbacks(app):
 
+    # ------------------------------------------------------------
+    # Boundary level of detail follows each map's zoom
+    # ------------------------------------------------------------
+    for map_id in ["airbnb-map", "affh-map", "crime-map"]:
+        @app.callback(
+            Output(f"{map_id}-detail", "data"),
+            Input(map_id, "relayoutData"),
+            State(f"{map_id}-detail", "data"),
+        )
+        def update_map_detail(relayout_data, current_level):
+            zoom = (relayout_data or {}).get("mapbox.zoom")
+            if zoom is None or detail_level(zoom) == current_level:
+                raise PreventUpdate
+            return detail_level(zoom)
+
+    # ------------------------------------------------------------
+    # Listings window (padded, snapped view) of the point maps
+    # ------------------------------------------------------------
+    for map_id in ["airbnb-map", "affh-map"]:
+        @app.callback(
+            Output(f"{map_id}-viewport", "data"),
+            Input(map_id, "relayoutData"),
+            State(f"{map_id}-viewport", "data"),
+        )
+        def update_map_viewport(relayout_data, current_window):
+            window = view_window(relayout_data)
+            if window is None or window == current_window:
+                raise PreventUpdate
+            return window
+
     # ------------------------------------------------------------
     # Airbnb-only map callback
     # ------------------------------------------------------------
@@ -35,47 +233,60 @@ def register_callbacks(app):
         Output("airbnb-map", "figure"),
         [
             Input("airbnb-neighborhood-filter", "value"),
-            Input("view-selector", "value")
+            Input("airbnb-view-mode", "data"),
+            Input("airbnb-map-detail", "data"),
+            Input("airbnb-map-viewport", "data"),
         ]
     )
-    def update_airbnb_map(selected_neighborhoods, view_mode):
-
-        fig = go.Figure()
-
-        airbnb_df_filtered = airbnb_df.copy()
+    @ignore_map_state(
+        detail=lambda selected_neighborhoods, view_mode, detail, window: view_mode == "population",
+        viewport=lambda selected_neighborhoods, view_mode, detail, window: view_mode == "airbnb_points",
+    )
+    @fig_cache.memoize(key=lambda selected_neighborhoods, view_mode, detail, window: (
+        as_set(selected_neighborhoods) if view_mode == "airbnb_points" else (),
+        view_mode,
+        detail if view_mode == "population" else None,
+        window_key(window or default_window(10)) if view_mode == "airbnb_points" else None,
+    ))
+    def update_airbnb_map(selected_neighborhoods, view_mode, detail, window):
+        snap = data_manager.current()
 
-        if selected_neighborhoods:
-            airbnb_df_filtered = airbnb_df_filtered[
-                airbnb_df_filtered["neighborhood_group_cleansed"].isin(selected_neighborhoods)
-            ]
+        traces = []
 
         # PLACEHOLDER CODE FOR FIRST TRY OF POLYGONS:
 
-        # plot Airbnb points only if selected
+        # plot Airbnb points only if selected: raw points when the listings
+        # in view fit the point budget, aggregated cells otherwise
         if view_mode == "airbnb_points":
-            fig.add_trace(go.Scattermapbox(
-                lat=airbnb_df_filtered["latitude"],
-                lon=airbnb_df_filtered["longitude"],
-                mode="markers",
-                marker=dict(size=4, opacity=0.15),
-                hovertext=airbnb_df_filtered["name"],
-                hoverinfo="text"
-            ))
+            kind, shown = listing_layer(
+                snap.airbnb_df, snap.airbnb_grid, window or default_window(10),
+                index=snap.airbnb_filter, boroughs=selected_neighborhoods,
+            )
+            if kind == "points":
+                traces.append(figures.scatter_mapbox(
+                    shown["latitude"],
+                    shown["longitude"],
+                    marker=dict(size=4, opacity=0.15),
+                    hovertext=figures.array(shown["name"]),
+                    hoverinfo="text"
+                ))
+            else:
+                traces.append(cells_trace(shown))
 
         # choropleth if selected
         if view_mode == "population":
+            airbnb_10k = snap.airbnb_10k
+
             # NTA choropleth
-            fig.add_trace(go.Choroplethmapbox(
-                geojson=nta_geojson,
-                locations=airbnb_10k["NTA2020"],
-                z=airbnb_10k["airbnb_per_10k"],
-                featureidkey="properties.NTA2020",
-                colorscale="Viridis",
-                marker_opacity=1,
-                marker_line_width=1,
-                marker_line_color="black",
+            traces.append(figures.choropleth_mapbox(
+                geojson_url("nta", snap, detail),
+                airbnb_10k["NTA2020"],
+                airbnb_10k["airbnb_per_10k"],
+                "properties.NTA2020",
+                colorscale=figures.named_colorscale("Viridis"),
+                marker=dict(opacity=1, line=dict(width=1, color="black")),
                 # show something nice when you hover over
-                hovertext=(
+                hovertext=figures.array(
                     "Borough: " + airbnb_10k["neighborhood_group_cleansed"] +
                     "<br>NTA: " + airbnb_10k["NTAName"] +
                     "<br>Airbnbs per 10k: " + airbnb_10k["airbnb_per_10k"].astype(str)
@@ -85,81 +296,93 @@ def register_callbacks(app):
                 zmin=airbnb_10k["airbnb_per_10k"].quantile(0.05),
                 zmax=airbnb_10k["airbnb_per_10k"].quantile(0.95)
             ))
-        
-        fig.update_layout(
-            mapbox_style="carto-positron",
-            mapbox_zoom=10,
-            mapbox_center={"lat": 40.7128, "lon": -74.0060},
-            margin={"l":0, "r":0, "t":0, "b":0}
-        )
 
-        return fig
-    
-    # only show neighborhood filter when "airbnb_points" is selected
+        # keep the user's pan / zoom when the figure is replaced
+        return figures.figure(traces, figures.map_layout(10, uirevision="airbnb-map"))
+
+    # Airbnb page: follow the view selector only while an Airbnb view is
+    # selected, and only show the neighborhood filter for the points view
     @app.callback(
-        Output("airbnb-filter-container", "style"),
-        Input("view-selector", "value")
+        [
+            Output("airbnb-view-mode", "data"),
+            Output("airbnb-filter-container", "style"),
+        ],
+        Input("view-selector", "value"),
+        State("airbnb-view-mode", "data"),
     )
-    def toggle_airbnb_filter(view_mode):
-        
-        # show filter for air_bnb points
-        if view_mode == "airbnb_points":
-            return {'width': '50%', 'padding': '10px'}
+    def toggle_airbnb_filter(view_mode, shown_mode):
+        if VIEW_PAGES.get(view_mode) != "airbnb" or view_mode == shown_mode:
+            raise PreventUpdate
 
-        # hide otherwise
-        return {'display': 'none'}
+        # show filter for air_bnb points, hide otherwise
+        return view_mode, FILTER_STYLE if view_mode == "airbnb_points" else HIDDEN
 
-    # SWITCH LAYER CALLBACK 
+    # SWITCH VIEW CALLBACK: fill a page the first time its view is selected,
+    # afterwards only hide / show it (its callbacks stay idle while hidden,
+    # since nothing on a hidden page can change)
     @app.callback(
-        Output("page-content", "children"),
+        [Output(f"page-{page}", "children") for page in PAGES]
+        + [Output(f"page-{page}", "style") for page in PAGES]
+        + [Output("mounted-pages", "data")],
         Input("view-selector", "value"),
+        State("mounted-pages", "data"),
     )
-    def switch_layout(selected_view):
-        # Airbnb points
-        if selected_view == "airbnb_points":
-            return airbnb_only_layout
-
-        # Population choropleth
-        if selected_view == "population":
-            return airbnb_only_layout  # Same layout, BUT callback will return different map
+    def show_view(selected_view, mounted):
+        shown = VIEW_PAGES.get(selected_view, "airbnb")
+        mounted = list(mounted or [])
 
-        # Affordable Housing
-        if selected_view == "affh":
-            return affordable_housing_layout
+        children = [no_update] * len(PAGES)
+        if shown not in mounted:
+            layout = PAGE_LAYOUTS[shown]
+            children[PAGES.index(shown)] = layout(selected_view) if shown == "airbnb" else layout()
+            mounted.append(shown)
 
-        if selected_view == "transit":
-            return transit_layout
-
-        if selected_view == "crime":
-            return crime_layout
-
-        # Fallback
-        return airbnb_only_layout
+        styles = [{} if page == shown else {"display": "none"} for page in PAGES]
+        return children + styles + [mounted]
 
     # ------------------------------------------------------------
     # 3) Affordable Housing multi-layer map callback (final styled)
     # ------------------------------------------------------------
-    @app.callback(
-        Output("affh-map", "figure"),
-        [
-            Input("affh-neighborhood-filter", "value"),
-            Input("affh-layer-toggle", "value"),
-            Input("affh-year-slider", "value"),
-        ],
-    )
-    def update_affh_map(selected_neighborhoods, selected_layers, year_range):
-        # If nothing is selected, treat as empty list
-        if not selected_layers:
-            selected_layers = []
-        
-        fig = go.Figure()
+    # The figure always holds one trace per layer (AFFH_LAYERS order) plus an
+    # invisible anchor; it is built once per page and then changed with Patch:
+    # toggles flip `visible`, filters replace the airbnb trace, zoom swaps the
+    # council GeoJSON URL. affh-map-airbnb remembers what the airbnb trace was
+    # built for, so turning it back on only resends it when that changed.
+    @fig_cache.memoize(key=lambda selected_neighborhoods, selected_layers, detail, window, year_range: (
+        as_set(selected_neighborhoods) if "airbnb" in (selected_layers or []) else (),
+        as_set(selected_layers),
+        clamp_range(year_range, data_manager.get("min_year"), data_manager.get("max_year")),
+        detail,
+        window_key(window or default_window(10.5)) if "airbnb" in (selected_layers or []) else None,
+    ))
+    def build_affh_map(selected_neighborhoods, selected_layers, detail, window, year_range):
+        snap = data_manager.current()
+        layers = set(selected_layers or [])
+        yr_min, yr_max = clamp_range(year_range, snap.min_year, snap.max_year)
+
+        # the airbnb trace stays empty until the layer is turned on
+        if "airbnb" in layers:
+            airbnb = affh_airbnb_trace(snap, selected_neighborhoods, window)
+        else:
+            airbnb = figures.scatter_mapbox([], [], name="Airbnb Listings")
+        traces = [
+            airbnb,
+            affh_points_trace(snap, yr_min, yr_max),
+            affh_council_trace(snap, detail, yr_min, yr_max),
+            # an invisible point, so Mapbox renders with every layer off
+            figures.hidden_anchor(),
+        ]
+
+        for trace, layer in zip(traces, AFFH_LAYERS):
+            trace["visible"] = layer in layers
+        aff_x, council_x = affh_colorbar_x(layers)
+        traces[1]["marker"]["colorbar"]["x"] = aff_x
+        traces[2]["colorbar"]["x"] = council_x
 
         # Base figure / mapbox config
-        fig.update_layout(
-            mapbox_style="carto-positron",
-            mapbox_zoom=10.5,
-            mapbox_center={"lat": 40.7128, "lon": -74.0060},
-            margin={"r": 0, "t": 0, "l": 0, "b": 0},
+        return figures.figure(traces, figures.map_layout(
+            10.5,
+            uirevision="affh-map",
             height= 800,
             legend=dict(
                 orientation="h",
@@ -169,213 +392,120 @@ def register_callbacks(app):
                 x=0.01,
                 font=dict(size=14)
             ),
-        )
-
-        # --------------------------------------------------------
-        # 1) Airbnb Listings layer
-        # --------------------------------------------------------
-        if "airbnb" in selected_layers:
-            df_copy = airbnb_df.copy()
-            if selected_neighborhoods:
-                df_copy = df_copy[
-                    df_copy["neighborhood_group_cleansed"].isin(
-                        selected_neighborhoods
-                    )
-                ]
-
-            fig.add_trace(
-                go.Scattermapbox(
-                    lat=df_copy["latitude"],
-                    lon=df_copy["longitude"],
-                    mode="markers",
-                    marker=dict(
-                        size=7,
-                        opacity=0.65
-                    ),
-                    name="Airbnb Listings",
-                    text=df_copy["name"],
-                    hovertemplate="Airbnb: %{text}<extra></extra>",
-                )
-            )
-
-        # --------------------------------------------------------
-        # 2) Affordable Housing points (All Counted Units)
-        # --------------------------------------------------------
-        if "aff_points" in selected_layers:
-            points = aff_points.copy()
-
-            if year_range is not None and len(year_range) == 2:
-                yr_min, yr_max = year_range
-                points = points[
-                    (points["CompletionYear"] >= yr_min)
-                    & (points["CompletionYear"] <= yr_max)
-                ]
-
-            if not points.empty:
-                units = points["All Counted Units"].fillna(0)
-                units_clipped = units.clip(lower=0, upper=200)
-
-                # Marker size scaled by units
-                if units.max() > 0:
-                    marker_sizes = 6 + (units / units.max()) * 24
-                else:
-                    marker_sizes = [10] * len(points)
-
-                fig.add_trace(
-                    go.Scattermapbox(
-                        lat=points["Latitude"],
-                        lon=points["Longitude"],
-                        mode="markers",
-                        marker=dict(
-                            size=marker_sizes,
-                            sizemode="area",
-                            sizemin=5,
-                            opacity=0.9,
-                            color=units_clipped,
-                            colorscale="Viridis",  # MATCH standalone script
-                            cmin=0,
-                            cmax=200,
-                            showscale=True,
-                            colorbar=dict(
-                                title="Units by project",
-                                len=0.55,  
-                                lenmode="fraction",
-                                thickness=18,
-                                x=0.88,
-                            ),
-                        ),
-                        name="Affordable Housing (points)",
-                        customdata=points[
-                            ["Project Name", "All Counted Units", "CompletionYear"]
-                        ].values,
-                        hovertemplate=(
-                            "Project: %{customdata[0]}<br>"
-                            "All Counted Units: %{customdata[1]}<br>"
-                            "Completion Year: %{customdata[2]}"
-                            "<extra></extra>"
-                        ),
-                    )
-                )
-
-        # --------------------------------------------------------
-        # 3) Council District polygon layer (Total Units)
-        # --------------------------------------------------------
-        if "council" in selected_layers:
-            # Build the council choropleth exactly like standalone version
-            council_trace = go.Choroplethmapbox(
-                geojson=council_choropleth_trace.geojson,
-                locations=council_choropleth_trace.locations,
-                z=council_choropleth_trace.z,
-                featureidkey="properties.COUNDIST",
-                colorscale="GnBu",
-                zmin=0,
-                zmax=max(1, max(council_choropleth_trace.z)),
-                marker_opacity=0.45,
-                marker_line_width=0.5,
-                name="Council District Total Units",
-                customdata=council_choropleth_trace.customdata,
-                hovertemplate=(
-                    "Council District: %{location}<br>"
-                    "Total affordable units (Total Units): %{customdata[0]}<br>"
-                    "Airbnb last 12 month listing (# in district): %{customdata[1]}<br>"
-                    "Council District Population: %{customdata[2]}<br>"
-                    "District Area: %{customdata[3]:.2f} sq mi"
-                    "<extra></extra>"
-                ),
-                colorbar=dict(
-                    title="Total Units",
-                    len=0.55,
-                    thickness=18,
-                    x=0.96,
-                    tickformat=",d"
-                ),
-            )
-
-            fig.add_trace(council_trace)
-
-
-        # --------------------------------------------------------
-        # 4) If both aff_points + council are on, arrange colorbars
-        # --------------------------------------------------------
-        if "aff_points" in selected_layers and "council" in selected_layers:
-
-            aff_colorbar = None
-            council_colorbar = None
-
-            for trace in fig.data:
-                if trace.name == "Affordable Housing (points)":
-                    aff_colorbar = trace.marker.colorbar
-                if trace.name == "Council District Total Units":
-                    council_colorbar = trace.colorbar
-
-            if aff_colorbar and council_colorbar:
-                # AH slightly left
-                aff_colorbar.x = 0.88
-                aff_colorbar.y = 0.5
-                aff_colorbar.len = 0.55
-
-                # Council slightly right
-                council_colorbar.x = 0.96
-                council_colorbar.y = 0.5
-                council_colorbar.len = 0.55
-
-        # If no layers selected, add an invisible trace so Mapbox renders
-        if len(selected_layers) == 0:
-            fig.add_trace(go.Scattermapbox(
-                lat=[40.7128], lon=[-74.0060],
-                mode="markers",
-                marker=dict(size=0, opacity=0),
-                hoverinfo="skip",
-                showlegend=False
-            ))
+        ))
 
-        return fig
+    @app.callback(
+        [
+            Output("affh-map", "figure"),
+            Output("affh-map-airbnb", "data"),
+        ],
+        [
+            Input("affh-neighborhood-filter", "value"),
+            Input("affh-layer-toggle", "value"),
+            Input("affh-map-detail", "data"),
+            Input("affh-map-viewport", "data"),
+        ],
+        [
+            # the slider itself is applied in the browser (affh_year_filter.js);
+            # new figures just start from its current value
+            State("affh-year-slider", "value"),
+            State("affh-map-airbnb", "data"),
+        ],
+    )
+    def update_affh_map(selected_neighborhoods, selected_layers, detail, window, year_range, airbnb_key):
+        snap = data_manager.current()
+        layers = set(selected_layers or [])
+        triggered = set(ctx.triggered_prop_ids.values())
+        key = affh_airbnb_key(snap, selected_neighborhoods, window) if "airbnb" in layers else None
+
+        # first render of the page: the whole figure
+        if not triggered:
+            fig = build_affh_map(selected_neighborhoods, selected_layers, detail, window, year_range)
+            return fig, key
+
+        patched = Patch()
+        changed = False
+
+        if "affh-layer-toggle" in triggered:
+            for i, layer in enumerate(AFFH_LAYERS):
+                patched["data"][i]["visible"] = layer in layers
+            aff_x, council_x = affh_colorbar_x(layers)
+            patched["data"][1]["marker"]["colorbar"]["x"] = aff_x
+            patched["data"][2]["colorbar"]["x"] = council_x
+            changed = True
+
+        # the airbnb trace only when it is shown and built for something else
+        new_key = no_update
+        if "airbnb" in layers and key != airbnb_key:
+            patched["data"][0] = affh_airbnb_trace(snap, selected_neighborhoods, window)
+            new_key = key
+            changed = True
+
+        if "council" in layers and triggered & {"affh-layer-toggle", "affh-map-detail"}:
+            patched["data"][2]["geojson"] = geojson_url("council", snap, detail)
+            changed = True
+
+        if not changed:
+            raise PreventUpdate
+        return patched, new_key
+
+    # Completion-year slider: applied in the browser from the typed arrays in
+    # affh-points-data (assets/affh_year_filter.js), no server round trip
+    app.clientside_callback(
+        ClientsideFunction(namespace="affh", function_name="filterYears"),
+        Output("affh-map", "figure", allow_duplicate=True),
+        Input("affh-year-slider", "value"),
+        State("affh-points-data", "data"),
+        State("affh-map", "figure"),
+        prevent_initial_call=True,
+    )
 
     # TRANSIT CALLBACK
 
     @app.callback(
-    [
         Output("transit-main-map", "figure"),
-        Output("transit-scatter", "figure"),
-        Output("transit-luxury-map", "figure")
-    ],
-    Input("transit-room-filter", "value")
+        Input("transit-room-filter", "value")
     )
+    @fig_cache.memoize()
     def update_transit_dashboard(selected_category):
+        snap = data_manager.current()
+        df_map = snap.df_map
+        subway_df = snap.subway_df
+        room_rows = snap.df_map_filter.rows
 
-        # Filter
+        # Filter (row positions from the filter index, no full-frame scan)
         if selected_category == "ALL":
             filt = df_map
             categories = room_colors.keys()
         else:
-            filt = df_map[df_map['room_type'] == selected_category]
+            filt = df_map.take(room_rows("room_type", selected_category))
             categories = [selected_category]
 
         # ------------------------------------------
         # 1. MAP — Listing Locations + Subway
         # ------------------------------------------
-        map_fig = go.Figure()
+        traces = []
 
         for rt in categories:
-            sub = filt[filt['room_type'] == rt]
+            sub = filt if len(categories) == 1 else df_map.take(room_rows("room_type", rt))
             if sub.empty: continue
 
             # Outline
-            map_fig.add_trace(go.Scattermapbox(
-                lat=sub['latitude'], lon=sub['longitude'],
-                mode="markers",
+            traces.append(figures.scatter_mapbox(
+                sub['latitude'], sub['longitude'],
                 marker=dict(size=5, color="white", opacity=0.5),
                 hoverinfo="skip",
                 showlegend=False
             ))
 
             # Colored dots
-            map_fig.add_trace(go.Scattermapbox(
-                lat=sub['latitude'], lon=sub['longitude'],
-                mode="markers",
+            traces.append(figures.scatter_mapbox(
+                sub['latitude'], sub['longitude'],
                 marker=dict(size=3, opacity=0.8, color=room_colors[rt]),
                 name=rt,
-                customdata=sub[["room_type", "price_clean"]],
+                customdata=np.column_stack([
+                    figures.array(sub["room_type"]), figures.array(sub["price_clean"]),
+                ]),
                 hovertemplate=(
                     "%{customdata[0]}<br>"          # room type
                     "Price: $%{customdata[1]:,.0f}" # formatted price
@@ -384,151 +514,200 @@ def register_callbacks(app):
             ))
 
         # Subway
-        map_fig.add_trace(go.Scattermapbox(
-            lat=subway_df['lat'], lon=subway_df['lon'],
-            mode="markers",
+        traces.append(figures.scatter_mapbox(
+            subway_df['lat'], subway_df['lon'],
             marker=dict(size=5, color="black"),
             name="Subway Station",
-            customdata=subway_df[['Stop Name']],
+            customdata=subway_df[['Stop Name']].to_numpy(),
             hovertemplate="%{customdata[0]}<extra></extra>"
         ))
 
-        map_fig.update_layout(
-            mapbox_style="carto-positron",
-            mapbox_center={"lat": 40.7128, "lon": -74.0060},
-            mapbox_zoom=10.5,
-            margin={"l":0,"r":0,"t":40,"b":0}
-        )
+        return figures.figure(traces, figures.map_layout(10.5, margin=figures.margin(t=40)))
 
-        # ------------------------------------------
-        # 2. SCATTER — Price vs Distance
-        # ------------------------------------------
-        scatter_df = filt[(filt["price_clean"] < 1000) & (filt["dist_to_subway_meters"] < 3000)]
+    # ------------------------------------------
+    # 2. SCATTER — Price vs Distance ("proximity premium")
+    # ------------------------------------------
+    @app.callback(
+        Output("transit-scatter", "figure"),
+        [
+            Input("transit-room-filter", "value"),
+            Input("transit-trend-mode", "value"),
+        ]
+    )
+    @fig_cache.memoize()
+    def update_proximity_scatter(selected_category, trend_mode):
+        snap = data_manager.current()
+        premium = snap.proximity_premium
+        room_types = premium["room_types"]
+        moments = premium["moments"]
 
         if selected_category == "ALL":
-            scatter_fig = px.scatter(
-                scatter_df,
-                x="dist_to_subway_meters",
-                y="price_clean",
-                color="room_type",
-                color_discrete_map=room_colors,
-                opacity=0.4,
-                labels={
-                    "dist_to_subway_meters": "Distance to Subway (meters)",
-                    "price_clean": "Price ($)"
-                },
-                template="plotly_white"
-            )
+            categories = [rt for rt in room_colors if rt in room_types]
         else:
-            # Force color for single category
-            scatter_fig = px.scatter(
-                scatter_df,
-                x="dist_to_subway_meters",
-                y="price_clean",
-                opacity=0.4,
-                labels={
-                    "dist_to_subway_meters": "Distance to Subway (meters)",
-                    "price_clean": "Price ($)"
-                },
-                template="plotly_white"
-            )
+            categories = [selected_category] if selected_category in room_types else []
 
-            # Manually recolor markers
-            scatter_fig.update_traces(marker=dict(color=room_colors[selected_category]))
-
-        # ------------------------------------------
-        # MULTI-CATEGORY NUMPY TRENDLINES
-        # ------------------------------------------
-        import numpy as np
+        # downsampled points (WebGL), split by room type
+        rows = premium["samples"].get(selected_category, premium["samples"]["ALL"][:0])
+        sample = snap.df_map.take(rows)
+        codes = sample["room_type"].cat.codes.to_numpy()
+        x_all = sample["dist_to_subway_meters"].to_numpy()
+        y_all = sample["price_clean"].to_numpy()
 
-        if selected_category == "ALL":
-            # Loop through all categories and add separate trendlines
-            for rt, color in room_colors.items():
-                sub = scatter_df[scatter_df["room_type"] == rt]
-
-                if len(sub) > 1:
-                    x = sub["dist_to_subway_meters"].values
-                    y = sub["price_clean"].values
-
-                    # Perform linear regression
-                    m, b = np.polyfit(x, y, 1)
-
-                    reg_x = np.linspace(x.min(), x.max(), 200)
-                    reg_y = m * reg_x + b
-
-                    scatter_fig.add_trace(
-                        go.Scatter(
-                            x=reg_x,
-                            y=reg_y,
-                            mode="lines",
-                            line=dict(color=room_colors[rt], width=3),
-                            name=f"{rt} Trendline",
-                            showlegend=True
-                        )
-                    )
-        else:
-            # Only one category selected - single trendline
-            x = scatter_df["dist_to_subway_meters"].values
-            y = scatter_df["price_clean"].values
+        traces = []
+        for rt in categories:
+            mine = codes == room_types.index(rt)
+            traces.append(figures.scatter(
+                x_all[mine],
+                y_all[mine],
+                webgl=True,
+                mode="markers",
+                marker=dict(color=room_colors[rt], opacity=0.4, size=5),
+                name=rt,
+                legendgroup=rt,
+                hovertemplate="Distance: %{x:,.0f} m<br>Price: $%{y:,.0f}<extra>" + rt + "</extra>",
+            ))
 
-            if len(scatter_df) > 1:
-                m, b = np.polyfit(x, y, 1)
-                reg_x = np.linspace(x.min(), x.max(), 200)
+        # trend curves from every listing, not just the drawn sample
+        for rt in categories:
+            code = room_types.index(rt)
+            if trend_mode == "median":
+                binned = premium["binned"][rt]
+                reg_x, reg_y = binned["distance"], binned["median_price"]
+                name, mode = f"{rt} Binned Median", "lines+markers"
+            else:
+                fit = fit_line(moments, code)
+                if fit is None:
+                    continue
+                m, b = fit
+                reg_x = np.array([moments["xmin"][code], moments["xmax"][code]])
                 reg_y = m * reg_x + b
+                name, mode = f"{rt} Trendline", "lines"
+
+            traces.append(figures.scatter(
+                reg_x,
+                reg_y,
+                mode=mode,
+                line=dict(color=room_colors[rt], width=3),
+                name=name,
+                legendgroup=rt,
+                showlegend=True
+            ))
 
-                # Use that category's color
-                color = room_colors[selected_category]
-
-                scatter_fig.add_trace(
-                    go.Scatter(
-                        x=reg_x,
-                        y=reg_y,
-                        mode="lines",
-                        line=dict(color=room_colors[selected_category], width=3),
-                        name=f"{selected_category} Trendline",
-                        showlegend=True
-                    )
-                )
-
-
-
-        # ------------------------------------------
-        # 3. LUXURY MAP — Avg Price Near Stations
-        # ------------------------------------------
-        walk = filt[filt['dist_to_subway_meters'] < 800]
-
-        grouped = walk.groupby("nearest_station_idx")['price_clean'].median()
-        listing_count = walk.groupby("nearest_station_idx")['price_clean'].count()
-
-        stats = pd.DataFrame({"avg_price": grouped, "count": listing_count}).reset_index()
-        merged = subway_df.reset_index().merge(stats, left_on="index", right_on="nearest_station_idx", how="left")
-        merged = merged[merged['avg_price'].notna()]
-
-        lux_fig = go.Figure()
-
-        lux_fig.add_trace(go.Scattermapbox(
-            lat=merged['lat'],
-            lon=merged['lon'],
-            mode="markers",
+        total = int(sum(moments["n"][room_types.index(rt)] for rt in categories))
+        layout = dict(
+            template="plotly_white",
+            xaxis=dict(title=dict(text="Distance to Subway (meters)")),
+            yaxis=dict(title=dict(text="Price ($)")),
+            legend=dict(title=dict(text="room_type")),
+        )
+        if len(rows) < total:
+            layout["annotations"] = [dict(
+                text=f"{len(rows):,} of {total:,} listings drawn",
+                xref="paper", yref="paper", x=1, y=1.05,
+                showarrow=False, font=dict(size=11, color="gray"),
+            )]
+
+        return figures.figure(traces, layout)
+
+    # ------------------------------------------
+    # 3. LUXURY MAP — Median Price Near Stations (walkshed radius)
+    # ------------------------------------------
+    @app.callback(
+    [
+        Output("transit-luxury-map", "figure"),
+        Output("transit-walk-summary", "children"),
+    ],
+    [
+        Input("transit-room-filter", "value"),
+        Input("transit-walk-radius", "value"),
+    ]
+    )
+    @fig_cache.memoize()
+    def update_luxury_map(selected_category, radius):
+        snap = data_manager.current()
+        if radius not in data_manager.WALK_RADII:
+            radius = data_manager.STATION_WALK_METERS
+
+        # a slice of the precomputed radius x station x room type cube
+        merged = snap.station_cube.get((radius, selected_category))
+        if merged is None:
+            merged = snap.station_cube[(radius, "ALL")].iloc[:0]
+
+        lux_fig = figures.figure([figures.scatter_mapbox(
+            merged['lat'],
+            merged['lon'],
             marker=dict(
                 size=12,
-                color=merged['avg_price'],
-                colorscale="Viridis",
+                color=figures.array(merged['avg_price']),
+                colorscale=figures.named_colorscale("Viridis"),
                 cmin=0, cmax=300,
                 showscale=True
             ),
-            text=merged.apply(lambda r: f"{r['Stop Name']}<br>${r['avg_price']:.0f}<br>Listings: {r['count']}", axis=1),
+            text=figures.array(merged["hover"]),
             hoverinfo="text"
-        ))
+        )], figures.map_layout(11, margin=figures.margin(t=40)))
+
+        # stations within reach of each listing (of the selected room type)
+        reach = snap.walksheds["reach"][radius]
+        if selected_category != "ALL":
+            reach = reach[snap.df_map_filter.rows("room_type", selected_category)]
+        in_reach = reach[reach > 0]
+        if len(in_reach):
+            summary = (
+                f"{len(in_reach) / len(reach):.0%} of listings are within {radius} m "
+                f"of a subway station; those reach {int(np.median(in_reach))} "
+                f"station(s) on median (up to {int(in_reach.max())})."
+            )
+        else:
+            summary = f"No listings within {radius} m of a subway station."
+
+        return lux_fig, summary
 
-        lux_fig.update_layout(
-            mapbox_style="carto-positron",
-            mapbox_center={"lat": 40.7128, "lon": -74.0060},
-            mapbox_zoom=11,
-            margin={"l":0,"r":0,"t":40,"b":0}
+    # ------------------------------------------
+    # 3b. SUBWAY LINES — Median Price Near Each Route
+    # ------------------------------------------
+    @app.callback(
+        Output("transit-route-ranking", "figure"),
+        [
+            Input("transit-room-filter", "value"),
+            Input("transit-walk-radius", "value"),
+        ]
+    )
+    @fig_cache.memoize()
+    def update_route_ranking(selected_category, radius):
+        snap = data_manager.current()
+        if radius not in data_manager.WALK_RADII:
+            radius = data_manager.STATION_WALK_METERS
+
+        # one row per route, already ranked by median price
+        routes = snap.route_cube.get((radius, selected_category))
+        if routes is None:
+            routes = snap.route_cube[(radius, "ALL")].iloc[:0]
+
+        bars = figures.bar(
+            routes["median_price"],
+            routes["route"],
+            orientation="h",
+            marker=dict(
+                color=figures.array(routes["median_price"]),
+                colorscale=figures.named_colorscale("Viridis"), cmin=0, cmax=300,
+            ),
+            customdata=routes[["p25", "p75", "count", "stations"]].to_numpy(),
+            hovertemplate=(
+                "<b>%{y}</b><br>Median Price: $%{x:.0f}"
+                "<br>Middle 50%: $%{customdata[0]:.0f}–$%{customdata[1]:.0f}"
+                "<br>Listings: %{customdata[2]:,}<br>Stations: %{customdata[3]}"
+                "<extra></extra>"
+            ),
         )
 
-        return map_fig, scatter_fig, lux_fig
+        return figures.figure([bars], dict(
+            template="plotly_white",
+            xaxis=dict(title=dict(text=f"Median Price of Listings within {radius} m of the Line ($)")),
+            yaxis=dict(title=dict(text="Subway Line"), type="category", autorange="reversed"),
+            height=max(300, 22 * len(routes) + 100),
+            margin=figures.margin(l=60, r=20, t=20, b=50),
+        ))
     
 
     # ------------------------------------------------------------
@@ -537,100 +716,49 @@ def register_callbacks(app):
 
     @app.callback(
         Output("crime-map", "figure"),
-        Input("crime-map-selector", "value")
+        [
+            Input("crime-map-selector", "value"),
+            Input("crime-map-detail", "data"),
+        ]
     )
+    @fig_cache.memoize()
+    def update_crime_visualization(view_mode, detail):
 
-    def update_crime_visualization(view_mode):
-
-        df = merged_zip_data.copy()
+        snap = data_manager.current()
+        df = snap.merged_zip_data
+        nyc_zip = geojson_url("zip", snap, detail)
 
         # Base map settings
-        common_layout = dict(
-            mapbox_style="carto-positron",
-            mapbox_zoom=9.5,
-            mapbox_center={"lat": 40.7128, "lon": -74.0060},
-            margin={"l":0, "r":0, "t":40, "b":0},
+        common_layout = figures.map_layout(
+            9.5, uirevision="crime-map", margin=figures.margin(t=40),
         )
+        hover_data = ["zipcode", "total_major_crime_reports", "airbnb_count", "average_price"]
 
         # --------------------------------------------------------
-        # MODE 1: Crime Choropleth
+        # MODES 1-3: Crime / Airbnb Count / Average Price Choropleth
         # --------------------------------------------------------
-        if view_mode == "crime":
-            fig = px.choropleth_mapbox(
-                df,
-                geojson=nyc_zip,
-                locations="zipcode",
-                featureidkey="properties.zipcode",
-                color="total_major_crime_reports",
-                hover_data=["zipcode", "total_major_crime_reports", "airbnb_count", "average_price"],
-                color_continuous_scale="Viridis",
-                opacity=0.7,
+        if view_mode in ("crime", "airbnb_count", "average_price"):
+            color = "total_major_crime_reports" if view_mode == "crime" else view_mode
+            traces, layout = figures.continuous_choropleth(
+                df, nyc_zip, "zipcode", "properties.zipcode",
+                color=color, hover_data=hover_data,
+                colorscale="Viridis", opacity=0.7,
             )
-            fig.update_layout(**common_layout)
-
-            return fig
-
-        # --------------------------------------------------------
-        # MODE 2: Airbnb Count Choropleth
-        # --------------------------------------------------------
-        if view_mode == "airbnb_count":
-            fig = px.choropleth_mapbox(
-                df,
-                geojson=nyc_zip,
-                locations="zipcode",
-                featureidkey="properties.zipcode",
-                color="airbnb_count",
-                hover_data=["zipcode", "total_major_crime_reports", "airbnb_count", "average_price"],
-                color_continuous_scale="Viridis",
-                opacity=0.7,
-            )
-            fig.update_layout(**common_layout)
-
-            return fig
-
-        # --------------------------------------------------------
-        # MODE 3: Average Price Choropleth
-        # --------------------------------------------------------
-        if view_mode == "average_price":
-            fig = px.choropleth_mapbox(
-                df,
-                geojson=nyc_zip,
-                locations="zipcode",
-                featureidkey="properties.zipcode",
-                color="average_price",
-                hover_data=["zipcode", "total_major_crime_reports", "airbnb_count", "average_price"],
-                color_continuous_scale="Viridis",
-                opacity=0.7,
-            )
-            fig.update_layout(**common_layout)
-
-            return fig
+            return figures.figure(traces, {**layout, **common_layout})
 
         # --------------------------------------------------------
         # MODE 4: Bivariate Crime × Airbnb Classification
         # --------------------------------------------------------
         if view_mode == "bivariate":
-            fig = px.choropleth_mapbox(
-                df,
-                geojson=nyc_zip,
-                locations="zipcode",
-                featureidkey="properties.zipcode",
+            traces, layout = figures.discrete_choropleth(
+                df, nyc_zip, "zipcode", "properties.zipcode",
                 color="crime_airbnb_category",
-                hover_data=[
-                    "zipcode",
-                    "total_major_crime_reports",
-                    "airbnb_count",
-                    "average_price",
-                    "crime_airbnb_category"
-                ],
-                color_discrete_map=crime_color_map,
-                opacity=0.75,
+                hover_data=hover_data + ["crime_airbnb_category"],
+                color_map=crime_color_map, opacity=0.75,
             )
-            fig.update_layout(**common_layout)
-
-            return fig
+            return figures.figure(traces, {**layout, **common_layout})
 
         # fallback
-        return go.Figure(), "Select a layer to begin."
+        return figures.figure(layout=common_layout)
 
         
\ No newline at end of file
@@ -1,14 +1,29 @@
 # this file is to handle any data loading and preprocessing
 # will also initialize base version of map
+#
+# nothing is loaded at import time: every dataset / derived table below is
+# registered with @dataset (or @table for the heavy ones, which are also cached
+# as Arrow artifacts by artifacts.cached_table) and built the first time it is
+# asked for, from the live snapshot: current().df_map or get("df_map")
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import base64
+import gzip
+import hashlib
 import json
 import os
 import sys
-import plotly.graph_objects as go
-from utils import point_in_district, point_in_ring
-from scipy.spatial import cKDTree
+import threading
+import time
+from artifacts import cached_table, code_hash, fingerprint
+import figures
+import shared_arrays
+from utils import (
+    FilterIndex, PointGrid, ProximityIndex, RegionIndex, expand_ranges,
+    group_moments, simplify_geojson, sorted_segment_quantile,
+    stratified_sample, stream_group_medians,
+)
 
 # folder name for easy use
 DATA_DIR = "data"
@@ -19,297 +34,1111 @@ AIRBNB_FILE = os.path.join(DATA_DIR, "airbnb_one_year.csv")
 AFFORDABLE_HOUSING_FILE = os.path.join(DATA_DIR, "Affordable_Housing_Production_by_Building.csv")
 COUNCIL_GEOJSON_FILE = os.path.join(DATA_DIR, "nycc.json")
 TAB_GEOJSON = os.path.join(DATA_DIR, "NYC_Neighborhood_Tabulation_Areas_2020.geojson")
-AIRBNB_10K = os.path.join(DATA_DIR, "NTA_airbnb_10k.csv")
+CENSUS_FILE = os.path.join(DATA_DIR, "nyc_decennialcensusdata_2010_2020_change-core-geographies_v2.csv")
 CRIME_ZIP_CSV = os.path.join(DATA_DIR, "merged_zip_data.csv")
 ZIP_GEOJSON = os.path.join(DATA_DIR, "nyc_zipcodes.geojson")
 SUBWAY_FILE = os.path.join(DATA_DIR, "MTA_Subway_Stations_20251217.csv")
 
+# input files of each cached table (a change in any of them rebuilds it)
+GEOGRAPHY_FILES = [COUNCIL_GEOJSON_FILE, ZIP_GEOJSON, TAB_GEOJSON]
+AIRBNB_INPUTS = [AIRBNB_FILE] + GEOGRAPHY_FILES
+AFF_BUILDINGS_INPUTS = [AFFORDABLE_HOUSING_FILE]
+AFF_POINTS_INPUTS = [AFFORDABLE_HOUSING_FILE] + GEOGRAPHY_FILES
+AFF_BY_COUNCIL_INPUTS = [AFFORDABLE_HOUSING_FILE] + AIRBNB_INPUTS
+AFF_UNITS_BY_YEAR_INPUTS = [AFFORDABLE_HOUSING_FILE]
+AIRBNB_10K_INPUTS = [CENSUS_FILE] + AIRBNB_INPUTS
+DF_MAP_INPUTS = [AIRBNB_FILE, SUBWAY_FILE]
+MERGED_ZIP_INPUTS = [CRIME_ZIP_CSV] + AIRBNB_INPUTS
+
+# only the columns the dashboard actually uses are read from the big files
+AIRBNB_COLUMNS = [
+    "id", "name", "neighborhood_group_cleansed",
+    "latitude", "longitude", "room_type", "price",
+]
+AFF_COLUMNS = [
+    "Project Name", "Latitude", "Longitude", "All Counted Units",
+    "Building Completion Date", "Council District", "Total Units",
+]
+
+# the year file is streamed this many rows at a time when building df_map;
+# past DF_MAP_MAX_STATE distinct (listing, price) pairs the per-listing
+# medians switch from exact to a quantile sketch (0.5% relative error)
+AIRBNB_CHUNKSIZE = 250_000
+DF_MAP_MAX_STATE = 5_000_000
+
 # NYC bounding box
 NYC_LAT_MIN = 40.45
 NYC_LAT_MAX = 40.95
 NYC_LON_MIN = -74.30
 NYC_LON_MAX = -73.65
 
-### LOAD DATA ### 
+### LAZY DATASET REGISTRY ###
+#
+# datasets live in a Snapshot: built lazily on first use, never modified
+# afterwards. When files in data/ change, the reloader builds a complete new
+# snapshot in the background and swaps it in with a single assignment, so a
+# callback that grabs current() once sees one consistent version of the data.
+
+_loaders = {}         # name -> function that builds the value
+TABLES = []           # names of the artifact-cached tables
+_tables = {}          # table name -> (input files, build function)
+
+# every input file; a change to any of them triggers a reload
+WATCHED_FILES = [
+    AIRBNB_FILE, AFFORDABLE_HOUSING_FILE, COUNCIL_GEOJSON_FILE, TAB_GEOJSON,
+    CENSUS_FILE, CRIME_ZIP_CSV, ZIP_GEOJSON, SUBWAY_FILE,
+]
+
+# seconds between checks of WATCHED_FILES (0 disables the reloader)
+RELOAD_INTERVAL = float(os.environ.get("DATA_RELOAD_INTERVAL", 60))
+
+
+def dataset(name):
+    """
+    Decorator: register fn as the loader of the lazily built value `name`.
+    """
+    def register(fn):
+        _loaders[name] = fn
+        return fn
+    return register
+
+
+def table(name, inputs):
+    """
+    Decorator: like dataset(), but the built DataFrame is also cached as an
+    Arrow artifact keyed by table_key(name). With DATA_SHARED_DIR set, the
+    big tables are served from shared memory instead (see shared_arrays).
+    """
+    def register(build):
+        def load():
+            key = table_key(name)
+            if shared_arrays.enabled() and name in shared_arrays.SHARED_TABLES:
+                return shared_arrays.shared_table(
+                    name, key, lambda: cached_table(name, key, build),
+                )
+            return cached_table(name, key, build)
+
+        _loaders[name] = load
+        _tables[name] = (inputs, build)
+        TABLES.append(name)
+        return build
+    return register
+
+
+def table_key(name):
+    """
+    Artifact key of a table: the content of its input files, the code of its
+    build step and the helpers it calls, and the key of every dataset it
+    reads with get() (so a table built from airbnb_df is rebuilt whenever
+    airbnb_df is).
+    """
+    inputs, build = _tables[name]
+    return fingerprint(inputs, build, datasets=dataset_key)
+
+
+def dataset_key(name):
+    # tables: their artifact key; other datasets: the code that builds them
+    if name in _tables:
+        return table_key(name)
+    return code_hash(_loaders[name], datasets=dataset_key)
+
+
+def file_stamps():
+    """
+    (size, mtime) of every watched file, None for missing ones.
+    """
+    stamps = {}
+    for path in WATCHED_FILES:
+        try:
+            st = os.stat(path)
+            stamps[path] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            stamps[path] = None
+    return stamps
+
+
+# the snapshot whose loaders are running on this thread (so a loader's own
+# get() calls resolve inside the snapshot being built, not the current one)
+_building = threading.local()
+
+
+class Snapshot:
+    """
+    One version of every dataset, each built lazily on first use.
+    Thread-safe: concurrent callers wait for the one build instead of
+    repeating it. Datasets are also readable as attributes (snap.df_map).
+    """
+
+    def __init__(self, version, stamps):
+        self.version = version
+        self.stamps = stamps
+        self._values = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def get(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+
+        if name not in _loaders:
+            raise KeyError(f"Unknown dataset: {name!r}")
+
+        with self._locks_guard:
+            lock = self._locks.setdefault(name, threading.Lock())
+
+        with lock:
+            if name not in self._values:
+                outer = getattr(_building, "snapshot", None)
+                _building.snapshot = self
+                try:
+                    self._values[name] = _loaders[name]()
+                finally:
+                    _building.snapshot = outer
+        return self._values[name]
+
+    def loaded(self):
+        return list(self._values)
+
+    def items(self):
+        return list(self._values.items())
+
+    def __getattr__(self, name):
+        if name in _loaders:
+            return self.get(name)
+        raise AttributeError(name)
+
+
+_current = Snapshot(0, file_stamps())
+_reload_lock = threading.Lock()
+
+
+def current():
+    """
+    The live snapshot. Callbacks should call this once and read everything
+    from the returned object.
+    """
+    return _current
+
+
+def get(name):
+    """
+    Return the dataset `name` from the snapshot being built on this thread,
+    or from the live snapshot, building it on first use.
+    """
+    snapshot = getattr(_building, "snapshot", None) or _current
+    return snapshot.get(name)
+
+
+def loaded():
+    """
+    Names of the datasets that have been built so far.
+    """
+    return _current.loaded()
+
+
+def reload_if_changed():
+    """
+    If any watched file changed, build a new snapshot off the request path
+    (every dataset that is loaded now is rebuilt) and swap it in atomically.
+    Returns True if a new snapshot was installed.
+    """
+    global _current
+
+    with _reload_lock:
+        old = _current
+        stamps = file_stamps()
+        if stamps == old.stamps:
+            return False
+
+        new = Snapshot(old.version + 1, stamps)
+        for name in old.loaded():
+            new.get(name)
+
+        _current = new
+        return True
+
+
+def _reload_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            if reload_if_changed():
+                print(f"data_manager: reloaded data (snapshot {_current.version})", file=sys.stderr)
+        except Exception as e:
+            # keep serving the old snapshot, try again next round
+            print(f"data_manager: reload failed: {e!r}", file=sys.stderr)
+
+
+_reloader = None
+
+
+def start_reloader(interval=RELOAD_INTERVAL):
+    """
+    Start (once) the background thread that polls data/ for changes.
+    """
+    global _reloader
+    if interval <= 0 or _reloader is not None:
+        return
+    _reloader = threading.Thread(
+        target=_reload_loop, args=(interval,), name="data-reloader", daemon=True
+    )
+    _reloader.start()
+
+
+def nbytes(value, _seen=None):
+    """
+    Approximate resident size of a dataset value in bytes: frames and arrays
+    by their buffers, bytes by length, containers by their items (each object
+    counted once) and index objects by their own nbytes.
+    """
+    seen = set() if _seen is None else _seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            nbytes(k, seen) + nbytes(v, seen) for k, v in value.items()
+        )
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(nbytes(v, seen) for v in value)
+    if isinstance(getattr(value, "nbytes", None), int):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+def memory_report():
+    """
+    Bytes held by every loaded dataset, largest first.
+    """
+    report = pd.DataFrame(
+        [(name, nbytes(value)) for name, value in _current.items()],
+        columns=["dataset", "bytes"],
+    )
+    report = report.sort_values("bytes", ascending=False, ignore_index=True)
+    report["MB"] = (report["bytes"] / 1e6).round(2)
+    return report
 
-airbnb_df = pd.read_csv(AIRBNB_FILE) # airbnb data 
 
-borough_list = airbnb_df['neighborhood_group_cleansed'].unique().tolist() # list for each borough 
+def __getattr__(name):
+    # module attribute access (data_manager.airbnb_df) loads lazily too
+    if name in _loaders:
+        return _current.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-aff_raw = pd.read_csv(AFFORDABLE_HOUSING_FILE) # affordable housing
 
-airbnb_10k = pd.read_csv(AIRBNB_10K) # airbnb per 10k
+### LOAD DATA ###
 
-with open(COUNCIL_GEOJSON_FILE, "r") as f: # council geojson
-        council_geojson = json.load(f)
+@dataset("nta_geojson")
+def load_nta_geojson():
+    with open(TAB_GEOJSON, "r") as f:
+        return json.load(f)
 
-with open(TAB_GEOJSON, "r") as f:
-    nta_geojson = json.load(f)
 
-merged_zip_data = pd.read_csv(CRIME_ZIP_CSV)
+@dataset("nyc_zip")
+def load_nyc_zip():
+    with open(ZIP_GEOJSON, "r") as f:
+        nyc_zip = json.load(f)
 
-with open(ZIP_GEOJSON, "r") as f:
-    nyc_zip = json.load(f)
+    # Ensure the ZIP GeoJSON properties match 5-digit ZIPs
+    if "features" in nyc_zip:
+        for feature in nyc_zip["features"]:
+            props = feature.get("properties", {})
+            if "zipcode" in props:
+                props["zipcode"] = str(props["zipcode"]).zfill(5)
+    return nyc_zip
 
-subway_df = pd.read_csv(SUBWAY_FILE)
-subway_df = subway_df.rename(columns={'GTFS Latitude': 'lat', 'GTFS Longitude': 'lon'})
 
+@dataset("subway_df")
+def load_subway_df():
+    subway_df = pd.read_csv(SUBWAY_FILE)
+    return subway_df.rename(columns={'GTFS Latitude': 'lat', 'GTFS Longitude': 'lon'})
 
-### DEFINE BASE MAP ###
 
-base_map = go.Figure()
+# meter-accurate nearest / within-radius lookups (see utils.ProximityIndex);
+# results are row positions in subway_df
+@dataset("subway_proximity")
+def load_subway_proximity():
+    subway_df = get("subway_df")
+    return ProximityIndex(subway_df["lon"].to_numpy(), subway_df["lat"].to_numpy())
 
-base_map.update_layout(
-    mapbox_style="carto-positron",
-    mapbox_zoom=9.5,
-    mapbox_center={"lat": 40.7, "lon": -74.0},
-    height=600,
-    margin={"l":0, "r":0, "t":0, "b":0}
-)
 
-# Fatima, most of your code logic is here now:
+### DEFINE BASE MAP ###
+
+@dataset("base_map")
+def load_base_map():
+    return figures.figure(layout=figures.map_layout(
+        9.5, center={"lat": 40.7, "lon": -74.0}, height=600,
+    ))
 
 # -------------------------------------------------------------
-# AFFORDABLE HOUSING POINTS (LAYER 2)
+# COUNCIL DISTRICTS FROM nycc.json (LAYER 3)
 # -------------------------------------------------------------
-# We'll use Building Completion Date to derive a year filter
-aff_points = aff_raw.copy()
-
-# Convert numeric fields
-aff_points["Latitude"] = pd.to_numeric(aff_points["Latitude"], errors="coerce")
-aff_points["Longitude"] = pd.to_numeric(aff_points["Longitude"], errors="coerce")
-aff_points["All Counted Units"] = pd.to_numeric(
-    aff_points["All Counted Units"], errors="coerce"
-)
+# nycc.json must be a FeatureCollection with "features" list.
 
-# Parse completion year from Building Completion Date
-aff_points["Building Completion Date"] = pd.to_datetime(
-    aff_points["Building Completion Date"], errors="coerce"
-)
-aff_points["CompletionYear"] = aff_points["Building Completion Date"].dt.year
+@dataset("council_geojson")
+def load_council_geojson():
+    with open(COUNCIL_GEOJSON_FILE, "r") as f: # council geojson
+        council_geojson = json.load(f)
 
-# Keep rows with coordinates, units, and a valid completion year
-aff_points = aff_points.dropna(
-    subset=["Latitude", "Longitude", "All Counted Units", "CompletionYear"]
-)
+    features = council_geojson.get("features", [])
+    if not features:
+        raise ValueError("nycc.json has no features.")
+
+    # Auto-detect the council district property name
+    district_prop = None
+    sample_props = features[0].get("properties", {})
+    for key in sample_props.keys():
+        kl = key.lower()
+        # handle "District", "district", "coundist", "council district", etc.
+        if kl in ("district", "coundist", "council district", "council_dist") or (
+            "coun" in kl and "dist" in kl
+        ):
+            district_prop = key
+            break
+
+    if district_prop is None:
+        raise ValueError(
+            f"Could not find a council district field in nycc.json. "
+            f"Properties in first feature: {list(sample_props.keys())}"
+        )
+
+    # Normalize council district into a standard 'COUNDIST' property (int)
+    for feat in features:
+        props = feat.get("properties", {})
+        raw_val = props.get(district_prop)
+
+        try:
+            did = int(raw_val)
+        except (TypeError, ValueError):
+            did = None
+
+        props["COUNDIST"] = did
+        feat["properties"] = props
+
+    # Save back mutated features
+    council_geojson["features"] = features
+    return council_geojson
+
+
+@dataset("council_districts")
+def load_council_districts():
+    # Extract population (Adj_Population) and area (Area) for each district,
+    # and keep each district's geometry (all polygons and holes) for the spatial join.
+    districts = {
+        "ids": [],
+        "geometries": [],
+        "pop_lookup": {},
+        "area_lookup": {},
+    }
+
+    for feat in get("council_geojson")["features"]:
+        props = feat.get("properties", {})
+        did = props.get("COUNDIST")
+        if did is None:
+            continue
+
+        districts["ids"].append(did)
+        districts["geometries"].append(feat.get("geometry", {}))
+        districts["pop_lookup"][did] = props.get("Adj_Population")
+        districts["area_lookup"][did] = props.get("Area")  # NOTE: this is already in square miles
+
+    return districts
+
+
+# Region keys: a council_code / zip_code / nta_code is a position in these
+@dataset("council_ids")
+def load_council_ids():
+    return get("council_districts")["ids"]
+
+
+@dataset("zip_keys")
+def load_zip_keys():
+    return [f.get("properties", {}).get("zipcode") for f in get("nyc_zip").get("features", [])]
+
+
+@dataset("nta_keys")
+def load_nta_keys():
+    return [f.get("properties", {}).get("NTA2020") for f in get("nta_geojson").get("features", [])]
+
+
+# boundary layers served to the browser as static files (see geo_assets):
+# layer -> (dataset, join key property). Each is published at a few levels of
+# detail, simplified with the given tolerance in degrees (~1e-4 = 10 m)
+BOUNDARY_LAYERS = {
+    "council": ("council_geojson", "COUNDIST"),
+    "zip": ("nyc_zip", "zipcode"),
+    "nta": ("nta_geojson", "NTA2020"),
+}
+DETAIL_LEVELS = {"full": 0.0, "medium": 1e-4, "low": 5e-4}
+BOUNDARY_DECIMALS = 5
+
+
+@dataset("boundary_files")
+def load_boundary_files():
+    # "<layer>-<level>" -> compact JSON bytes, their gzip and an ETag
+    files = {}
+    for layer, (name, key) in BOUNDARY_LAYERS.items():
+        versions = simplify_geojson(
+            get(name), key, list(DETAIL_LEVELS.values()), decimals=BOUNDARY_DECIMALS
+        )
+        for level, geojson in zip(DETAIL_LEVELS, versions):
+            body = json.dumps(geojson, separators=(",", ":")).encode()
+            files[f"{layer}-{level}"] = {
+                "body": body,
+                "gzip": gzip.compress(body, compresslevel=9),
+                "etag": hashlib.sha256(body).hexdigest()[:16],
+            }
+    return files
 
-# NEW: only keep affordable housing points inside NYC bounding box
-aff_points = aff_points[
-    aff_points["Latitude"].between(NYC_LAT_MIN, NYC_LAT_MAX)
-    & aff_points["Longitude"].between(NYC_LON_MIN, NYC_LON_MAX)
-].copy()
-
-# Determine slider range from available years
-if not aff_points["CompletionYear"].dropna().empty:
-    min_year = int(aff_points["CompletionYear"].min())
-    max_year = int(aff_points["CompletionYear"].max())
-else:
-    # Fallback if no valid years (arbitrary)
-    min_year = 2000
-    max_year = 2025
 
 # -------------------------------------------------------------
-# COUNCIL DISTRICTS FROM nycc.json (LAYER 3)
+# GEOGRAPHY ASSIGNMENT: COUNCIL / ZIP / NTA CODE PER POINT
 # -------------------------------------------------------------
-# nycc.json must be a FeatureCollection with "features" list.
+# Every Airbnb listing and affordable housing point is located once in each
+# geography. Codes are small ints: the position of the region in
+# council_ids / zip_keys / nta_keys, or -1 when the point is outside all of
+# them. Every per-region aggregation below is a groupby / bincount on these.
+
+@dataset("region_indexes")
+def load_region_indexes():
+    # Grid indexes over region bounding boxes (only needed by the build steps)
+    districts = get("council_districts")
+    return (
+        RegionIndex(districts["geometries"], keys=districts["ids"]),
+        RegionIndex.from_geojson(get("nyc_zip"), key="zipcode"),
+        RegionIndex.from_geojson(get("nta_geojson"), key="NTA2020"),
+    )
+
 
-features = council_geojson.get("features", [])
-if not features:
-    raise ValueError("nycc.json has no features.")
-
-# Auto-detect the council district property name
-district_prop = None
-sample_props = features[0].get("properties", {})
-for key in sample_props.keys():
-    kl = key.lower()
-    # handle "District", "district", "coundist", "council district", etc.
-    if kl in ("district", "coundist", "council district", "council_dist") or (
-        "coun" in kl and "dist" in kl
-    ):
-        district_prop = key
-        break
-
-if district_prop is None:
-    raise ValueError(
-        f"Could not find a council district field in nycc.json. "
-        f"Properties in first feature: {list(sample_props.keys())}"
+def assign_geographies(df, lon_col, lat_col):
+    """
+    Add int16 council_code, zip_code and nta_code columns to df in place.
+    """
+    council_index, zip_index, nta_index = get("region_indexes")
+    lons = pd.to_numeric(df[lon_col], errors="coerce").values
+    lats = pd.to_numeric(df[lat_col], errors="coerce").values
+
+    df["council_code"] = council_index.locate(lons, lats).astype(np.int16)
+    df["zip_code"] = zip_index.locate(lons, lats).astype(np.int16)
+    df["nta_code"] = nta_index.locate(lons, lats).astype(np.int16)
+    return df
+
+
+def listing_counts(df, code_col, n_codes):
+    """
+    Distinct listings (unique id) per region code 0..n_codes-1. Every view
+    counts listings this way; the year file has one row per listing and month.
+    """
+    located = df.loc[df[code_col] >= 0, [code_col, "id"]].drop_duplicates()
+    return np.bincount(located[code_col].to_numpy(dtype=np.int64), minlength=n_codes)
+
+
+def parse_price(prices, dtype=np.float32):
+    """
+    "$1,234.00" style price strings -> floats (NaN where missing / invalid).
+    """
+    cleaned = prices.astype("string").str.replace("[$,]", "", regex=True)
+    return pd.to_numeric(cleaned, errors="coerce").astype(dtype)
+
+
+def compact(df, categories=(), floats=()):
+    """
+    Shrink df in place: repeated labels -> category, coordinates / prices ->
+    float32. Only call once spatial work needing full precision is done.
+    """
+    for col in categories:
+        df[col] = df[col].astype("category")
+    for col in floats:
+        df[col] = df[col].astype(np.float32)
+    return df
+
+
+@table("airbnb_df", AIRBNB_INPUTS)
+def build_airbnb_df():
+    # airbnb data, located in every geography
+    df = pd.read_csv(AIRBNB_FILE, usecols=AIRBNB_COLUMNS)
+    df["price"] = parse_price(df["price"])
+    assign_geographies(df, "longitude", "latitude")
+
+    # the same listing appears once per month, so names repeat a lot too
+    return compact(
+        df,
+        categories=["name", "neighborhood_group_cleansed", "room_type"],
+        floats=["latitude", "longitude"],
     )
 
-# Normalize council district into a standard 'COUNDIST' property (int)
-# Also extract population (Adj_Population) and area (Area) for each district,
-# and store polygon rings for point-in-polygon tests.
-pop_lookup = {}
-area_lookup = {}
-polygons_by_dist = {}
-
-for feat in features:
-    props = feat.get("properties", {})
-    geom = feat.get("geometry", {})
-    raw_val = props.get(district_prop)
-
-    try:
-        did = int(raw_val)
-    except (TypeError, ValueError):
-        did = None
-
-    props["COUNDIST"] = did
-
-    # Population and area from properties
-    pop_val = props.get("Adj_Population")
-    area_val = props.get("Area")  # NOTE: this is already in square miles
-
-    if did is not None:
-        pop_lookup[did] = pop_val
-        area_lookup[did] = area_val
-
-    # Extract exterior rings from geometry for spatial join
-    rings = []
-    gtype = geom.get("type")
-    coords = geom.get("coordinates")
-
-    if did is not None and gtype and coords:
-        if gtype == "Polygon":
-            # coords: [ [ [lon, lat], ... ] ]  (outer ring + holes)
-            if len(coords) > 0:
-                rings.append(coords[0])  # exterior ring only
-        elif gtype == "MultiPolygon":
-            # coords: [ [ [ [lon, lat], ... ], ... ], ... ]
-            for poly in coords:
-                if poly and len(poly) > 0:
-                    rings.append(poly[0])  # exterior ring of each polygon
-
-    if did is not None:
-        polygons_by_dist[did] = rings
-
-    feat["properties"] = props
-
-# Save back mutated features
-council_geojson["features"] = features
+
+@dataset("borough_list")
+def load_borough_list():
+    return get("airbnb_df")['neighborhood_group_cleansed'].unique().tolist() # list for each borough
+
+
+@dataset("airbnb_grid")
+def load_airbnb_grid():
+    # sorted-grid index over the listings for viewport queries (see viewport.py)
+    airbnb_df = get("airbnb_df")
+    return PointGrid(airbnb_df["longitude"].to_numpy(), airbnb_df["latitude"].to_numpy())
+
+
+@dataset("airbnb_filter")
+def load_airbnb_filter():
+    # row positions per borough / room type (see utils.FilterIndex)
+    return FilterIndex(get("airbnb_df"), ["neighborhood_group_cleansed", "room_type"])
+
+# Fatima, most of your code logic is here now:
 
 # -------------------------------------------------------------
-# SPATIAL JOIN: COUNT AIRBNB LISTINGS PER DISTRICT
+# AFFORDABLE HOUSING BUILDINGS (ONE PARSE OF THE CSV)
 # -------------------------------------------------------------
-airbnb_counts = {dist: 0 for dist in polygons_by_dist.keys()}
+@table("aff_buildings", AFF_BUILDINGS_INPUTS)
+def build_aff_buildings():
+    # every column the affordable housing layers use, read and parsed once;
+    # aff_points, aff_by_council and aff_units_by_year are derived from this
+    aff = pd.read_csv(AFFORDABLE_HOUSING_FILE, usecols=AFF_COLUMNS)
 
-for _, row in airbnb_df.iterrows():
-    lon = row.get("longitude")
-    lat = row.get("latitude")
-    if pd.isna(lon) or pd.isna(lat):
-        continue
+    # Convert numeric fields
+    for col in ["Latitude", "Longitude", "All Counted Units", "Council District", "Total Units"]:
+        aff[col] = pd.to_numeric(aff[col], errors="coerce")
+
+    # Parse completion year from Building Completion Date (NaN: not completed)
+    aff["CompletionYear"] = pd.to_datetime(
+        aff.pop("Building Completion Date"), errors="coerce"
+    ).dt.year
+    return aff
 
-    # Check which district this point falls into (first match wins)
-    for dist, rings in polygons_by_dist.items():
-        if not rings:
-            continue
-        if point_in_district(lon, lat, rings):
-            airbnb_counts[dist] += 1
-            break
+
+# -------------------------------------------------------------
+# AFFORDABLE HOUSING POINTS (LAYER 2)
+# -------------------------------------------------------------
+@table("aff_points", AFF_POINTS_INPUTS)
+def build_aff_points():
+    # We'll use Building Completion Date to derive a year filter
+    aff_points = get("aff_buildings")[
+        ["Project Name", "Latitude", "Longitude", "All Counted Units", "CompletionYear"]
+    ]
+
+    # Keep rows with coordinates, units, and a valid completion year
+    aff_points = aff_points.dropna(
+        subset=["Latitude", "Longitude", "All Counted Units", "CompletionYear"]
+    ).copy()
+    aff_points["CompletionYear"] = aff_points["CompletionYear"].astype(np.int16)
+
+    # NEW: only keep affordable housing points inside NYC bounding box
+    aff_points = aff_points[
+        aff_points["Latitude"].between(NYC_LAT_MIN, NYC_LAT_MAX)
+        & aff_points["Longitude"].between(NYC_LON_MIN, NYC_LON_MAX)
+    ].copy()
+
+    assign_geographies(aff_points, "Longitude", "Latitude")
+
+    # sorted by year, so a year range is one contiguous slice (aff_point_years)
+    aff_points = aff_points.sort_values("CompletionYear", kind="stable").reset_index(drop=True)
+    return compact(
+        aff_points, floats=["Latitude", "Longitude", "All Counted Units"]
+    )
+
+
+@dataset("aff_point_years")
+def load_aff_point_years():
+    return get("aff_points")["CompletionYear"].to_numpy()
+
+
+def year_slice(years, yr_min, yr_max):
+    """
+    Slice of the rows whose (sorted) year is in [yr_min, yr_max].
+    """
+    lo, hi = np.searchsorted(years, [yr_min, yr_max + 1])
+    return slice(int(lo), int(hi))
+
+
+@dataset("year_range")
+def load_year_range():
+    aff_points = get("aff_points")
+
+    # Determine slider range from available years
+    if not aff_points["CompletionYear"].dropna().empty:
+        return (
+            int(aff_points["CompletionYear"].min()),
+            int(aff_points["CompletionYear"].max()),
+        )
+
+    # Fallback if no valid years (arbitrary)
+    return 2000, 2025
+
+
+@dataset("min_year")
+def load_min_year():
+    return get("year_range")[0]
+
+
+@dataset("max_year")
+def load_max_year():
+    return get("year_range")[1]
 
 # -------------------------------------------------------------
 # SUM TOTAL UNITS PER COUNCIL DISTRICT (CSV)
 # -------------------------------------------------------------
-aff_units = aff_raw.copy()
-aff_units["Council District"] = pd.to_numeric(
-    aff_units["Council District"], errors="coerce"
-)
-aff_units["Total Units"] = pd.to_numeric(
-    aff_units["Total Units"], errors="coerce"
-)
+@table("aff_by_council", AFF_BY_COUNCIL_INPUTS)
+def build_aff_by_council():
+    aff_units = get("aff_buildings")[["Council District", "Total Units"]]
+
+    # Keep rows with valid district + total units
+    aff_units = aff_units.dropna(subset=["Council District", "Total Units"])
+
+    # Group by council district (for polygon layer) using Total Units
+    aff_by_council = (
+        aff_units.groupby("Council District", as_index=False)["Total Units"]
+        .sum()
+        .rename(
+            columns={
+                "Council District": "COUNDIST",
+                "Total Units": "total_units",
+            }
+        )
+    )
+
+    # Convert COUNDIST to int (and string for Plotly locations)
+    aff_by_council["COUNDIST"] = pd.to_numeric(
+        aff_by_council["COUNDIST"], errors="coerce"
+    ).astype("Int64")
+    aff_by_council = aff_by_council.dropna(subset=["COUNDIST"])
+    aff_by_council["COUNDIST_str"] = aff_by_council["COUNDIST"].astype(str)
+
+    # Airbnb listings per council district
+    airbnb_df = get("airbnb_df")
+    districts = get("council_districts")
+    council_listing_counts = listing_counts(airbnb_df, "council_code", len(districts["ids"]))
+    airbnb_counts = {
+        dist: int(count) for dist, count in zip(districts["ids"], council_listing_counts)
+    }
+
+    # Map population, area, and Airbnb counts onto the council table
+    aff_by_council["Population"] = aff_by_council["COUNDIST"].map(districts["pop_lookup"])
+    aff_by_council["Area_sqmi"] = aff_by_council["COUNDIST"].map(districts["area_lookup"])
+    aff_by_council["airbnb_listings"] = (
+        aff_by_council["COUNDIST"].map(airbnb_counts).fillna(0).astype(int)
+    )
+    return aff_by_council
 
-# Keep rows with valid district + total units
-aff_units = aff_units.dropna(subset=["Council District", "Total Units"])
 
-# Group by council district (for polygon layer) using Total Units
-aff_by_council = (
-    aff_units.groupby("Council District", as_index=False)["Total Units"]
-    .sum()
-    .rename(
+# -------------------------------------------------------------
+# UNITS PER COUNCIL DISTRICT AND COMPLETION YEAR
+# -------------------------------------------------------------
+@table("aff_units_by_year", AFF_UNITS_BY_YEAR_INPUTS)
+def build_aff_units_by_year():
+    aff_units = get("aff_buildings").rename(
+        columns={"Council District": "COUNDIST", "Total Units": "total_units"}
+    )[["COUNDIST", "total_units", "CompletionYear"]]
+
+    # buildings not completed yet have no year and only count all-time
+    aff_units = aff_units.dropna(subset=["COUNDIST", "total_units", "CompletionYear"])
+    by_year = aff_units.groupby(["COUNDIST", "CompletionYear"], as_index=False)["total_units"].sum()
+    by_year["COUNDIST"] = by_year["COUNDIST"].astype(np.int64)
+    by_year["CompletionYear"] = by_year["CompletionYear"].astype(np.int16)
+    return by_year
+
+
+@dataset("council_units_cumulative")
+def load_council_units_cumulative():
+    """
+    District x year prefix sums of completed units, rows in aff_by_council
+    order: units completed in [y0 + i, y0 + j) = cum[:, j] - cum[:, i].
+    """
+    by_year = get("aff_units_by_year")
+    districts = get("aff_by_council")["COUNDIST"].astype(np.int64).to_numpy()
+    if by_year.empty:
+        y0, n_years = 0, 0
+    else:
+        y0 = int(by_year["CompletionYear"].min())
+        n_years = int(by_year["CompletionYear"].max()) - y0 + 1
+
+    units = np.zeros((len(districts), n_years + 1))
+    row = pd.Index(districts).get_indexer(by_year["COUNDIST"])
+    known = row >= 0
+    np.add.at(
+        units,
+        (row[known], by_year["CompletionYear"].to_numpy()[known] - y0 + 1),
+        by_year["total_units"].to_numpy()[known],
+    )
+    return {"first_year": y0, "cum": np.cumsum(units, axis=1)}
+
+
+def council_units_between(cumulative, yr_min, yr_max):
+    """
+    Units completed in [yr_min, yr_max] per council district (aff_by_council
+    order), from the prefix sums: O(districts).
+    """
+    cum = cumulative["cum"]
+    n_years = cum.shape[1] - 1
+    i = min(max(yr_min - cumulative["first_year"], 0), n_years)
+    j = min(max(yr_max - cumulative["first_year"] + 1, 0), n_years)
+    return cum[:, j] - cum[:, min(i, j)]
+
+
+def typed_array(values, dtype):
+    """
+    Array as {"dtype", "data": base64 of its little-endian bytes}, which the
+    browser turns back into a typed array without parsing numbers.
+    """
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {
+        "dtype": np.dtype(dtype).name,
+        "data": base64.b64encode(values.tobytes()).decode("ascii"),
+    }
+
+
+@dataset("aff_points_client")
+def load_aff_points_client():
+    """
+    What the browser needs to apply the completion-year slider on its own
+    (assets/affh_year_filter.js): the aff_points columns of the points layer
+    (year sorted, like aff_points) and the council prefix sums, as typed arrays.
+    """
+    aff_points = get("aff_points")
+    names = aff_points["Project Name"].astype("category")
+    cumulative = get("council_units_cumulative")
+
+    return {
+        "points": {
+            "lat": typed_array(aff_points["Latitude"], np.float32),
+            "lon": typed_array(aff_points["Longitude"], np.float32),
+            "units": typed_array(aff_points["All Counted Units"].fillna(0), np.float32),
+            "year": typed_array(aff_points["CompletionYear"], np.int16),
+            "name": typed_array(names.cat.codes, np.int32),
+            "names": names.cat.categories.astype(str).tolist(),
+        },
+        "council": {
+            "first_year": cumulative["first_year"],
+            "n_years": cumulative["cum"].shape[1] - 1,
+            "cum": typed_array(cumulative["cum"].ravel(), np.float64),
+        },
+    }
+
+
+### DENSITY
+
+# -------------------------------------------------------------
+# AIRBNB LISTINGS PER 10K RESIDENTS BY NTA
+# -------------------------------------------------------------
+@table("airbnb_10k", AIRBNB_10K_INPUTS)
+def build_airbnb_10k():
+    census_df = pd.read_csv( # census population (NTA rows)
+        CENSUS_FILE, usecols=["GeoType", "GeoID", "Borough", "Name", "Pop1"]
+    )
+    nta_pop = census_df[census_df["GeoType"] == "NTA2020"].rename(
         columns={
-            "Council District": "COUNDIST",
-            "Total Units": "total_units",
+            "GeoID": "NTA2020",
+            "Name": "NTAName",
+            "Borough": "neighborhood_group_cleansed",
+            "Pop1": "Population",
         }
     )
-)
+    nta_pop["Population"] = pd.to_numeric(
+        nta_pop["Population"].astype(str).str.replace(",", ""), errors="coerce"
+    )
 
-# Convert COUNDIST to int (and string for Plotly locations)
-aff_by_council["COUNDIST"] = pd.to_numeric(
-    aff_by_council["COUNDIST"], errors="coerce"
-).astype("Int64")
-aff_by_council = aff_by_council.dropna(subset=["COUNDIST"])
-aff_by_council["COUNDIST_str"] = aff_by_council["COUNDIST"].astype(str)
-
-# Map population, area, and Airbnb counts onto the council table
-aff_by_council["Population"] = aff_by_council["COUNDIST"].map(pop_lookup)
-aff_by_council["Area_sqmi"] = aff_by_council["COUNDIST"].map(area_lookup)
-aff_by_council["airbnb_listings"] = (
-    aff_by_council["COUNDIST"].map(airbnb_counts).fillna(0).astype(int)
-)
+    airbnb_df = get("airbnb_df")
+    nta_keys = get("nta_keys")
+    airbnb_10k = pd.DataFrame({
+        "NTA2020": nta_keys,
+        "airbnb_count": listing_counts(airbnb_df, "nta_code", len(nta_keys)),
+    })
+    airbnb_10k = airbnb_10k.merge(
+        nta_pop[["NTA2020", "NTAName", "neighborhood_group_cleansed", "Population"]],
+        on="NTA2020",
+        how="inner",
+    ).dropna(subset=["Population"])
+
+    airbnb_10k = airbnb_10k[airbnb_10k["airbnb_count"] > 0]
+    airbnb_10k["airbnb_per_10k"] = round(
+        airbnb_10k["airbnb_count"] / airbnb_10k["Population"] * 10000, 2
+    )
+
+    # drop extreme rates and tiny populations (same cut-offs as the NTA notebook)
+    return airbnb_10k[
+        (airbnb_10k["airbnb_per_10k"] <= 1000) & (airbnb_10k["Population"] >= 1000)
+    ].reset_index(drop=True)
 
-# Color scale limits
-max_units = aff_by_council["total_units"].max()
-if pd.isna(max_units) or max_units <= 0:
-    max_units = 1
-
-# Build customdata for hover: [Total Units, # of listing, Population, Area_sqmi]
-customdata = aff_by_council[
-    ["total_units", "airbnb_listings", "Population", "Area_sqmi"]
-].values
-
-# Pre-build council district choropleth trace using Plotly only
-council_choropleth_trace = go.Choroplethmapbox(
-    geojson=council_geojson,
-    locations=aff_by_council["COUNDIST_str"],
-    z=aff_by_council["total_units"],
-    featureidkey="properties.COUNDIST",
-    colorscale="YlOrRd",
-    zmin=0,
-    zmax=max_units,
-    marker_opacity=0.45,
-    marker_line_width=0.5,
-    name="Council District Total Units",
-    colorbar=dict(
-        title="Total Units",
-        x=1.08,
-        y=0.5,
-        len=0.9,
-        thickness=20,
-    ),
-    customdata=customdata,
-    hovertemplate=(
-        "Council District: %{location}<br>"
-        "Total affordable units (Total Units): %{customdata[0]}<br>"
-        "Airbnb last 12 month listing (# of listings in this district): %{customdata[1]}<br>"
-        "Council District Population (people currently living in this district): %{customdata[2]}<br>"
-        "Council District Area: %{customdata[3]:.2f} square miles"
-        "<extra></extra>"
-    ),
-)
 
 ### TRANSIT STUFF
-all_listings = airbnb_df.copy()
+@table("df_map", DF_MAP_INPUTS)
+def build_df_map():
+    keys = ['id','latitude','longitude','neighborhood_group_cleansed','room_type']
+
+    # Stream the year file in chunks, cleaning prices as we go
+    def price_chunks():
+        for chunk in pd.read_csv(
+            AIRBNB_FILE, usecols=keys + ["price"], chunksize=AIRBNB_CHUNKSIZE
+        ):
+            chunk["price_clean"] = parse_price(chunk.pop("price"), dtype=float)
+            yield chunk
+
+    # Median price per listing (exact unless the running state outgrows
+    # DF_MAP_MAX_STATE rows, then from a mergeable quantile sketch)
+    df_map, exact = stream_group_medians(
+        price_chunks(), keys, "price_clean", max_state=DF_MAP_MAX_STATE
+    )
+    if not exact:
+        print("df_map: listing medians are approximate (sketch)", file=sys.stderr)
 
-# Clean price
-df_clean = all_listings.dropna(subset=["price"]).copy()
-df_clean['price_clean'] = df_clean['price'].replace('[$,]', '', regex=True).astype(float)
+    df_map = df_map[df_map['price_clean'] <= 5000]
 
-# Median price per listing
-df_map = df_clean.groupby(
-    ['id','latitude','longitude','neighborhood_group_cleansed','room_type']
-    )['price_clean'].median().reset_index()
+    # -------------------------------------------------
+    # Compute nearest subway distance for each listing
+    # -------------------------------------------------
+    distances, indices = get("subway_proximity").nearest(
+        df_map['longitude'].to_numpy(), df_map['latitude'].to_numpy()
+    )
 
-df_map = df_map[df_map['price_clean'] <= 5000]
+    df_map['nearest_station_idx'] = indices.astype(np.int16)
+    df_map['dist_to_subway_meters'] = distances
+    return compact(
+        df_map.reset_index(drop=True),
+        categories=["neighborhood_group_cleansed", "room_type"],
+        floats=["latitude", "longitude", "price_clean", "dist_to_subway_meters"],
+    )
 
-# -------------------------------------------------
-# Compute nearest subway distance for each listing
-# -------------------------------------------------
-coords_list = df_map[['latitude','longitude']].values
-coords_stations = subway_df[['lat','lon']].values
 
-tree = cKDTree(coords_stations)
-distances, indices = tree.query(coords_list, k=1)
+@dataset("df_map_filter")
+def load_df_map_filter():
+    return FilterIndex(get("df_map"), ["room_type", "neighborhood_group_cleansed"])
+
+
+# walk radii (meters) offered by the transit view; listings within a radius
+# of a station are in its "walkshed"
+WALK_RADII = [400, 800, 1200, 1600]
+STATION_WALK_METERS = 800   # default radius
+
+
+@dataset("listing_proximity")
+def load_listing_proximity():
+    df_map = get("df_map")
+    return ProximityIndex(df_map["longitude"].to_numpy(), df_map["latitude"].to_numpy())
+
+
+@dataset("walksheds")
+def load_walksheds():
+    """
+    Station -> listings neighbour lists for every radius in WALK_RADII, as
+    CSR (ptr, rows): the df_map rows within r of station i are
+    rows[ptr[i]:ptr[i + 1]], sorted by distance. Also "reach": per radius,
+    the number of stations within reach of each listing.
+    """
+    subway_df = get("subway_df")
+    n_listings = len(get("df_map"))
+
+    # one bulk query at the largest radius; smaller radii are a filter
+    ptr, rows, dist = get("listing_proximity").within(
+        subway_df["lon"].to_numpy(), subway_df["lat"].to_numpy(), max(WALK_RADII)
+    )
+    station = np.repeat(np.arange(len(subway_df)), np.diff(ptr))
+
+    lists, reach = {}, {}
+    for radius in WALK_RADII:
+        keep = dist <= radius
+        r_ptr = np.zeros(len(ptr), dtype=np.int64)
+        np.cumsum(np.bincount(station[keep], minlength=len(subway_df)), out=r_ptr[1:])
+        lists[radius] = (r_ptr, rows[keep])
+        reach[radius] = np.bincount(rows[keep], minlength=n_listings).astype(np.int16)
+    return {"lists": lists, "reach": reach}
+
+
+@dataset("route_stations")
+def load_route_stations():
+    """
+    Subway route -> stations from the "Daytime Routes" field (space separated
+    route names), as CSR: the subway_df rows served by routes[i] are
+    stations[ptr[i]:ptr[i + 1]].
+    """
+    routes = get("subway_df")["Daytime Routes"].fillna("").str.split()
+    pairs = routes.explode().dropna()
+    pairs = pd.DataFrame({"route": pairs.to_numpy(), "station": pairs.index.to_numpy()})
+    pairs = pairs.drop_duplicates().sort_values(["route", "station"])
+
+    names, counts = np.unique(pairs["route"].to_numpy(), return_counts=True)
+    ptr = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ptr[1:])
+    return {"routes": names.tolist(), "ptr": ptr, "stations": pairs["station"].to_numpy()}
+
+
+@dataset("route_cube")
+def load_route_cube():
+    """
+    Price stats of the listings within reach of any station of each route, per
+    radius and room type: {(radius, room type): DataFrame, one row per route
+    with listings, sorted by median price (highest first)}.
+    """
+    df_map = get("df_map")
+    route_stations = get("route_stations")
+    routes = np.array(route_stations["routes"], dtype=object)
+    n_routes, n_listings = len(routes), len(df_map)
+    prices = df_map["price_clean"].to_numpy(dtype=float)
+    room_codes = df_map["room_type"].cat.codes.to_numpy()
+    room_types = ["ALL"] + list(df_map["room_type"].cat.categories)
+
+    station_counts = np.diff(route_stations["ptr"])
+    route_of_station = np.repeat(np.arange(n_routes), station_counts)
+
+    cube = {}
+    for radius, (ptr, rows) in get("walksheds")["lists"].items():
+        # route -> listing pairs through the route's stations' walksheds
+        st = route_stations["stations"]
+        per_station = ptr[st + 1] - ptr[st]
+        pair_route = np.repeat(route_of_station, per_station)
+        pair_rows = rows[expand_ranges(ptr[st], per_station)]
+
+        # a listing near several stations of one route counts once; listings
+        # are ordered by price within each route, so any room type subset
+        # stays sorted and quantiles can be read by position
+        key = np.unique(pair_route.astype(np.int64) * n_listings + pair_rows)
+        pair_route, pair_rows = key // n_listings, key % n_listings
+        order = np.lexsort((prices[pair_rows], pair_route))
+        pair_route, pair_rows = pair_route[order], pair_rows[order]
+        keep_priced = ~np.isnan(prices[pair_rows])
+        pair_route, pair_rows = pair_route[keep_priced], pair_rows[keep_priced]
+
+        for code, room_type in enumerate(room_types, start=-1):
+            keep = slice(None) if room_type == "ALL" else room_codes[pair_rows] == code
+            r, p = pair_route[keep], prices[pair_rows[keep]]
+            counts = np.bincount(r, minlength=n_routes)
+            seg = np.zeros(n_routes + 1, dtype=np.int64)
+            np.cumsum(counts, out=seg[1:])
+
+            has = np.flatnonzero(counts)
+            stats = pd.DataFrame({
+                "route": routes[has],
+                "median_price": sorted_segment_quantile(p, seg, 0.5)[has],
+                "p25": sorted_segment_quantile(p, seg, 0.25)[has],
+                "p75": sorted_segment_quantile(p, seg, 0.75)[has],
+                "count": counts[has],
+                "stations": station_counts[has],
+            })
+            cube[(radius, room_type)] = stats.sort_values(
+                "median_price", ascending=False, kind="stable"
+            ).reset_index(drop=True)
+    return cube
+
+
+@dataset("station_cube")
+def load_station_cube():
+    """
+    Price stats of the listings in each station's walkshed, per radius and
+    room type ("ALL" = every room type): {(radius, room type): DataFrame with
+    one row per station that has listings, in subway_df order, incl. the hover
+    text}.
+    """
+    df_map = get("df_map")
+    subway_df = get("subway_df").reset_index(drop=True)
+    prices = df_map["price_clean"].to_numpy(dtype=float)
+    room_codes = df_map["room_type"].cat.codes.to_numpy()
+    room_types = ["ALL"] + list(df_map["room_type"].cat.categories)
+
+    cube = {}
+    for radius, (ptr, rows) in get("walksheds")["lists"].items():
+        station = np.repeat(np.arange(len(subway_df)), np.diff(ptr))
+        for code, room_type in enumerate(room_types, start=-1):
+            keep = ~np.isnan(prices[rows])
+            if room_type != "ALL":
+                keep &= room_codes[rows] == code
+            st, p = station[keep], prices[rows[keep]]
+
+            # sort prices within each station, then read quantiles by position
+            order = np.lexsort((p, st))
+            st, p = st[order], p[order]
+            counts = np.bincount(st, minlength=len(subway_df))
+            seg = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=seg[1:])
+
+            has = np.flatnonzero(counts)
+            stats = pd.DataFrame({
+                "nearest_station_idx": has,
+                "avg_price": sorted_segment_quantile(p, seg, 0.5)[has],
+                "count": counts[has],
+                "p25": sorted_segment_quantile(p, seg, 0.25)[has],
+                "p75": sorted_segment_quantile(p, seg, 0.75)[has],
+            })
+            stations = subway_df.iloc[has]
+            stats["Stop Name"] = stations["Stop Name"].to_numpy()
+            stats["lat"] = stations["lat"].to_numpy()
+            stats["lon"] = stations["lon"].to_numpy()
+            stats["hover"] = (
+                stats["Stop Name"].astype(str)
+                + "<br>$" + stats["avg_price"].map("{:.0f}".format)
+                + "<br>Listings: " + stats["count"].astype(str)
+                + "<br>Middle 50%: $" + stats["p25"].map("{:.0f}".format)
+                + "–$" + stats["p75"].map("{:.0f}".format)
+            )
+            cube[(radius, room_type)] = stats
+    return cube
+
+
+# "Proximity premium" scatter: listings in this price / distance window,
+# at most SCATTER_POINT_BUDGET of them drawn, trend curves from all of them
+PREMIUM_MAX_PRICE = 1000
+PREMIUM_MAX_METERS = 3000
+PREMIUM_BIN_METERS = 100      # distance bins of the binned-median curves
+PREMIUM_MIN_BIN_COUNT = 5     # bins with fewer listings are left out
+SCATTER_POINT_BUDGET = int(os.environ.get("SCATTER_POINT_BUDGET", 6000))
+
+
+@dataset("proximity_premium")
+def load_proximity_premium():
+    """
+    Everything the price vs distance scatter needs, per room type:
+    "samples": {room type or "ALL": df_map rows to draw (density-preserving
+    downsample)}, "moments": group_moments() of (distance, price) per room
+    type code, "binned": {room type: DataFrame of distance bin centre, median
+    price, count}.
+    """
+    df_map = get("df_map")
+    dist = df_map["dist_to_subway_meters"].to_numpy(dtype=float)
+    prices = df_map["price_clean"].to_numpy(dtype=float)
+    room_codes = df_map["room_type"].cat.codes.to_numpy()
+    rows = np.flatnonzero(
+        (prices < PREMIUM_MAX_PRICE) & (dist < PREMIUM_MAX_METERS) & (room_codes >= 0)
+    )
+    dist, prices, room_codes = dist[rows], prices[rows], room_codes[rows]
+    room_types = list(df_map["room_type"].cat.categories)
+
+    samples = {"ALL": rows[stratified_sample(dist, prices, SCATTER_POINT_BUDGET, strata=room_codes)]}
+    binned = {}
+    n_bins = int(np.ceil(PREMIUM_MAX_METERS / PREMIUM_BIN_METERS))
+    bins = (dist // PREMIUM_BIN_METERS).astype(np.int64)
+
+    for code, room_type in enumerate(room_types):
+        mine = np.flatnonzero(room_codes == code)
+        samples[room_type] = rows[mine[stratified_sample(dist[mine], prices[mine], SCATTER_POINT_BUDGET)]]
+
+        # prices sorted within each distance bin -> medians by position
+        order = np.lexsort((prices[mine], bins[mine]))
+        counts = np.bincount(bins[mine], minlength=n_bins)
+        seg = np.zeros(n_bins + 1, dtype=np.int64)
+        np.cumsum(counts, out=seg[1:])
+        has = np.flatnonzero(counts >= PREMIUM_MIN_BIN_COUNT)
+        binned[room_type] = pd.DataFrame({
+            "distance": (has + 0.5) * PREMIUM_BIN_METERS,
+            "median_price": sorted_segment_quantile(prices[mine][order], seg, 0.5)[has],
+            "count": counts[has],
+        })
+
+    return {
+        "room_types": room_types,
+        "samples": samples,
+        "moments": group_moments(dist, prices, room_codes, len(room_types)),
+        "binned": binned,
+    }
 
-df_map['nearest_station_idx'] = indices
-df_map['dist_to_subway_meters'] = distances * 111139
 
 # -------------------------------------------------
 # Colors
@@ -333,49 +1162,65 @@ crime_color_map = {
 # ------------------------------------------------------------
 # CRIME / AIRBNB BIVARIATE CATEGORY + ZIP NORMALIZATION
 # ------------------------------------------------------------
+@table("merged_zip_data", MERGED_ZIP_INPUTS)
+def build_merged_zip_data():
+    merged_zip_data = pd.read_csv(CRIME_ZIP_CSV)
+
+    # Ensure ZIP codes are 5-digit strings
+    merged_zip_data["zipcode"] = (
+        merged_zip_data["zipcode"]
+        .astype(str)
+        .str.zfill(5)
+    )
 
-# Ensure ZIP codes are 5-digit strings
-merged_zip_data["zipcode"] = (
-    merged_zip_data["zipcode"]
-    .astype(str)
-    .str.zfill(5)
-)
-
-# Ensure the ZIP GeoJSON properties also match 5-digit ZIPs
-if "features" in nyc_zip:
-    for feature in nyc_zip["features"]:
-        props = feature.get("properties", {})
-        if "zipcode" in props:
-            props["zipcode"] = str(props["zipcode"]).zfill(5)
-
-# Compute medians for category breaks
-crime_median = merged_zip_data["total_major_crime_reports"].median()
-airbnb_median = merged_zip_data["airbnb_count"].median()
-
-def classify_zip(row):
-    crime = row["total_major_crime_reports"]
-    airbnb = row["airbnb_count"]
-
-    if crime >= crime_median and airbnb >= airbnb_median:
-        return "High crime / High listings"
-    elif crime >= crime_median and airbnb < airbnb_median:
-        return "High crime / Low listings"
-    elif crime < crime_median and airbnb >= airbnb_median:
-        return "Low crime / High listings"
-    else:
-        return "Low crime / Low listings"
-
-# Add bivariate classification column
-merged_zip_data["crime_airbnb_category"] = merged_zip_data.apply(classify_zip, axis=1)
-
-# Enforce ordering (helps produce nice legends)
-merged_zip_data["crime_airbnb_category"] = pd.Categorical(
-    merged_zip_data["crime_airbnb_category"],
-    categories=[
-        "High crime / High listings",
-        "High crime / Low listings",
-        "Low crime / High listings",
-        "Low crime / Low listings"
-    ],
-    ordered=True
-)
+    # Recompute the Airbnb side from the listings' ZIP codes so it always agrees
+    # with the council and NTA views; crime counts still come from the CSV
+    airbnb_df = get("airbnb_df")
+    in_zip = airbnb_df[airbnb_df["zip_code"] >= 0]
+    zip_keys = get("zip_keys")
+    zip_summary = pd.DataFrame({
+        "airbnb_count": listing_counts(airbnb_df, "zip_code", len(zip_keys)),
+        "average_price": in_zip["price"].astype(float).groupby(in_zip["zip_code"]).mean()
+        .reindex(range(len(zip_keys))),
+    })
+    zip_summary = zip_summary[zip_summary["airbnb_count"] > 0]
+    zip_summary["zipcode"] = np.asarray(zip_keys)[zip_summary.index]
+
+    merged_zip_data = zip_summary.merge(
+        merged_zip_data[["zipcode", "total_major_crime_reports"]],
+        on="zipcode",
+        how="inner",
+    )[["zipcode", "airbnb_count", "average_price", "total_major_crime_reports"]]
+
+    # Compute medians for category breaks
+    crime_median = merged_zip_data["total_major_crime_reports"].median()
+    airbnb_median = merged_zip_data["airbnb_count"].median()
+
+    def classify_zip(row):
+        crime = row["total_major_crime_reports"]
+        airbnb = row["airbnb_count"]
+
+        if crime >= crime_median and airbnb >= airbnb_median:
+            return "High crime / High listings"
+        elif crime >= crime_median and airbnb < airbnb_median:
+            return "High crime / Low listings"
+        elif crime < crime_median and airbnb >= airbnb_median:
+            return "Low crime / High listings"
+        else:
+            return "Low crime / Low listings"
+
+    # Add bivariate classification column
+    merged_zip_data["crime_airbnb_category"] = merged_zip_data.apply(classify_zip, axis=1)
+
+    # Enforce ordering (helps produce nice legends)
+    merged_zip_data["crime_airbnb_category"] = pd.Categorical(
+        merged_zip_data["crime_airbnb_category"],
+        categories=[
+            "High crime / High listings",
+            "High crime / Low listings",
+            "Low crime / High listings",
+            "Low crime / Low listings"
+        ],
+        ordered=True
+    )
+    return merged_zip_data
@@ -0,0 +1,172 @@
+# this file is a small in-memory cache for callback figures
+#
+# most callbacks only have a handful of possible inputs (4 crime modes,
+# 5 room types, ...), so the figure for a given input is built once per data
+# snapshot and handed back from here on every repeat interaction
+#
+#     @app.callback(...)
+#     @fig_cache.memoize(key=lambda mode: (mode,))
+#     def update_something(mode): ...
+
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+
+import data_manager
+
+# upper bound on the total serialized size of the cached figures
+MAX_BYTES = int(float(os.environ.get("FIGURE_CACHE_MB", 256)) * 1e6)
+
+
+# ------------------------------------------------------------
+# input normalizers (so equivalent inputs share one entry)
+# ------------------------------------------------------------
+def as_set(values):
+    """
+    A multi-select value as a sorted tuple; None and [] are the same.
+    """
+    if not values:
+        return ()
+    if isinstance(values, str):
+        return (values,)
+    return tuple(sorted(set(values)))
+
+
+def clamp_range(value, lo, hi):
+    """
+    A [start, end] slider value clamped to [lo, hi] (None -> the full range).
+    """
+    if value is None or len(value) != 2:
+        return (lo, hi)
+    start, end = sorted(value)
+    return (min(max(start, lo), hi), min(max(end, lo), hi))
+
+
+# ------------------------------------------------------------
+# cache
+# ------------------------------------------------------------
+def _freeze(value):
+    # figures are stored as plain dicts: cheap to hand back, never mutated
+    if isinstance(value, go.Figure):
+        return value.to_dict()
+    if isinstance(value, (tuple, list)):
+        return type(value)(_freeze(v) for v in value)
+    return value
+
+
+class FigureCache:
+    """
+    LRU cache of callback results, bounded by their serialized size. Entries
+    belong to one data snapshot and are dropped when a new one goes live.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def _sync(self, version):
+        # caller holds the lock; False for a request on an outdated snapshot
+        if self.version is not None and version < self.version:
+            return False
+        if version != self.version:
+            self._entries.clear()
+            self.total = 0
+            self.version = version
+        return True
+
+    def lookup(self, key, version):
+        with self._lock:
+            if not self._sync(version):
+                self.misses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def store(self, key, version, value):
+        size = len(to_json_plotly(value))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if not self._sync(version) or key in self._entries:
+                return
+            self._entries[key] = (value, size)
+            self.total += size
+            while self.total > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.total -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "snapshot": self.version,
+            }
+
+
+cache = FigureCache()
+
+# name -> undecorated figure function (for benchmarks: bypasses the cache)
+builders = {}
+
+
+def memoize(key=None):
+    """
+    Decorator for a Dash callback: cache its result per normalized input.
+    `key` maps the callback's arguments to a hashable key (default: the
+    arguments themselves, with lists turned into tuples).
+    """
+    def wrap(fn):
+        builders[fn.__name__] = fn
+
+        @functools.wraps(fn)
+        def cached(*args):
+            if key is not None:
+                k = (fn.__name__, key(*args))
+            else:
+                k = (fn.__name__,) + tuple(
+                    tuple(a) if isinstance(a, list) else a for a in args
+                )
+
+            version = data_manager.current().version
+            entry = cache.lookup(k, version)
+            if entry is not None:
+                return entry[0]
+
+            value = _freeze(fn(*args))
+            # only keep it if the data didn't change while it was being built
+            if data_manager.current().version == version:
+                cache.store(k, version, value)
+            return value
+        return cached
+    return wrap
+
+
+def stats():
+    return cache.stats()
@@ -0,0 +1,213 @@
+# this file builds the dashboard's plotly figures as plain dicts
+#
+# go.Figure / px validate every property and copy every array they are given,
+# which is most of a callback's time once a trace has tens of thousands of
+# points. The helpers here assemble the same JSON structure directly from
+# NumPy arrays / pandas columns (Dash serializes them exactly like plotly
+# does) and reuse templates and layout pieces that are resolved once. Nothing
+# is validated, so only use property names plotly.js knows; nested
+# properties are spelled out (marker={"opacity": ...}, not marker_opacity).
+#
+# benchmark against the graph_objects / px construction with:
+#     python -m benchmarks.figure_traces
+
+import functools
+
+import numpy as np
+import pandas as pd
+import plotly.colors
+import plotly.io as pio
+
+NYC_CENTER = {"lat": 40.7128, "lon": -74.0060}
+MAP_STYLE = "carto-positron"
+
+# the same colours / fonts go.Figure would apply (its default template)
+DEFAULT_TEMPLATE = "plotly"
+
+_templates = {}
+
+
+def template(name=DEFAULT_TEMPLATE):
+    """
+    A plotly template as a plain dict, resolved once per process.
+    """
+    if name not in _templates:
+        _templates[name] = pio.templates[name].to_plotly_json()
+    return _templates[name]
+
+
+def array(values):
+    """
+    Trace data as a NumPy array (categoricals as their values), no copy for
+    plain numeric columns.
+    """
+    if isinstance(values, (pd.Series, pd.Index)):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return np.asarray(values.astype(object))
+        return values.to_numpy()
+    return np.asarray(values)
+
+
+# ------------------------------------------------------------
+# figures and layouts
+# ------------------------------------------------------------
+def figure(data=(), layout=None, template_name=DEFAULT_TEMPLATE):
+    """
+    {"data": [...], "layout": {...}} with the template filled in.
+    """
+    layout = dict(layout or {})
+    layout["template"] = template(layout.pop("template", template_name))
+    return {"data": list(data), "layout": layout}
+
+
+def margin(l=0, r=0, t=0, b=0):
+    return {"l": l, "r": r, "t": t, "b": b}
+
+
+def map_layout(zoom, center=NYC_CENTER, uirevision=None, **extra):
+    """
+    The shared carto-positron mapbox layout; extra keys are added as given.
+    """
+    layout = {
+        "mapbox": {"style": MAP_STYLE, "zoom": zoom, "center": dict(center)},
+        "margin": margin(),
+    }
+    if uirevision is not None:
+        layout["uirevision"] = uirevision
+    layout.update(extra)
+    return layout
+
+
+def colorbar(title, **props):
+    return {"title": {"text": title}, **props}
+
+
+@functools.lru_cache(maxsize=None)
+def _named_colorscale(name):
+    return tuple(tuple(stop) for stop in plotly.colors.get_colorscale(name))
+
+
+def named_colorscale(name):
+    """
+    A named colorscale ("Viridis", "GnBu", ...) as [[position, colour], ...];
+    plotly.js only knows a few names itself.
+    """
+    return [list(stop) for stop in _named_colorscale(name)]
+
+
+# ------------------------------------------------------------
+# traces
+# ------------------------------------------------------------
+def scatter_mapbox(lat, lon, **props):
+    return {
+        "type": "scattermapbox",
+        "lat": array(lat),
+        "lon": array(lon),
+        "mode": "markers",
+        **props,
+    }
+
+
+def choropleth_mapbox(geojson, locations, z, featureidkey, **props):
+    return {
+        "type": "choroplethmapbox",
+        "geojson": geojson,
+        "locations": array(locations),
+        "z": array(z),
+        "featureidkey": featureidkey,
+        **props,
+    }
+
+
+def scatter(x, y, webgl=False, **props):
+    return {
+        "type": "scattergl" if webgl else "scatter",
+        "x": array(x),
+        "y": array(y),
+        **props,
+    }
+
+
+def bar(x, y, **props):
+    return {"type": "bar", "x": array(x), "y": array(y), **props}
+
+
+def hidden_anchor():
+    """
+    An invisible point, so a map with no other visible trace still renders.
+    """
+    return scatter_mapbox(
+        [NYC_CENTER["lat"]], [NYC_CENTER["lon"]],
+        marker={"size": 0, "opacity": 0},
+        hoverinfo="skip",
+        showlegend=False,
+    )
+
+
+# ------------------------------------------------------------
+# choropleths coloured by a data frame column (what px used to build)
+# ------------------------------------------------------------
+def _hover(columns, color_col, color_ref, color_first=False):
+    # "col=value" lines in hover_data order (like px), reading customdata
+    lines = [
+        f"{col}={color_ref if col == color_col else f'%{{customdata[{i}]}}'}"
+        for i, col in enumerate(columns)
+    ]
+    if color_first:
+        i = list(columns).index(color_col)
+        lines.insert(0, lines.pop(i))
+    return "<br>".join(lines) + "<extra></extra>"
+
+
+def continuous_choropleth(df, geojson, locations, featureidkey, color, hover_data,
+                          colorscale="Viridis", opacity=0.7):
+    """
+    One choropleth trace coloured by a numeric column, with a shared
+    coloraxis; returns (traces, layout additions).
+    """
+    trace = choropleth_mapbox(
+        geojson, df[locations], df[color], featureidkey,
+        coloraxis="coloraxis",
+        customdata=np.column_stack([array(df[col]) for col in hover_data]),
+        hovertemplate=_hover(hover_data, color, "%{z}"),
+        marker={"opacity": opacity},
+        name="",
+    )
+    layout = {
+        "coloraxis": {
+            "colorbar": colorbar(color),
+            "colorscale": named_colorscale(colorscale),
+        },
+        "legend": {"tracegroupgap": 0},
+    }
+    return [trace], layout
+
+
+def discrete_choropleth(df, geojson, locations, featureidkey, color, hover_data,
+                        color_map, opacity=0.75):
+    """
+    One single-colour choropleth trace per category of `color` (in order of
+    appearance), listed in the legend; returns (traces, layout additions).
+    """
+    values = array(df[color])
+    customdata = np.column_stack([array(df[col]) for col in hover_data])
+    color_ref = f"%{{customdata[{list(hover_data).index(color)}]}}"
+    hovertemplate = _hover(hover_data, color, color_ref, color_first=True)
+
+    traces = []
+    for category in pd.unique(values):
+        rows = np.flatnonzero(values == category)
+        hex_color = color_map.get(category, "#636efa")
+        traces.append(choropleth_mapbox(
+            geojson, array(df[locations])[rows], np.ones(len(rows)), featureidkey,
+            colorscale=[[0.0, hex_color], [1.0, hex_color]],
+            showscale=False,
+            customdata=customdata[rows],
+            hovertemplate=hovertemplate,
+            marker={"opacity": opacity},
+            name=str(category),
+            showlegend=True,
+        ))
+    layout = {"legend": {"title": {"text": color}, "tracegroupgap": 0}}
+    return traces, layout
+
@@ -0,0 +1,75 @@
+# this file serves the boundary GeoJSON layers as static files
+#
+# choropleth traces point at /geojson/<layer>-<level>.json instead of carrying
+# the whole GeoJSON in every figure, so the browser downloads each boundary
+# file once (gzipped, cached under a content-versioned URL) and the callback
+# responses only carry the values. Maps pick the level of detail (simplified
+# boundaries, see utils.simplify_geojson) from their current zoom.
+
+import dash
+from flask import Response, abort, request
+
+import data_manager
+
+# the ?v=<etag> URLs never change content, so they can be cached for good
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# (max zoom, level of detail): below zoom 11 a pixel is ~50 m, so the 5e-4
+# degree "low" boundaries look the same; "full" is only sent past zoom 13
+ZOOM_LEVELS = [(11, "low"), (13, "medium")]
+
+
+def detail_level(zoom):
+    """
+    Level of detail ("low", "medium" or "full") for a mapbox zoom.
+    """
+    for max_zoom, level in ZOOM_LEVELS:
+        if zoom < max_zoom:
+            return level
+    return "full"
+
+
+def geojson_url(layer, snap=None, level="full"):
+    """
+    URL of a boundary layer ("council", "zip" or "nta") at a level of detail,
+    for a choropleth's geojson property, versioned by the file's content.
+    """
+    snap = snap or data_manager.current()
+    name = f"{layer}-{level}"
+    etag = snap.boundary_files[name]["etag"]
+    return dash.get_relative_path(f"/geojson/{name}.json") + f"?v={etag}"
+
+
+def serve_geojson(name):
+    files = data_manager.current().boundary_files
+    if name not in files:
+        abort(404)
+    entry = files[name]
+    etag = entry["etag"]
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif "gzip" in request.headers.get("Accept-Encoding", ""):
+        response = Response(entry["gzip"], mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(entry["body"], mimetype="application/json")
+
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    if request.args.get("v") == etag:
+        response.headers["Cache-Control"] = IMMUTABLE
+    else:
+        # unversioned URL: let the browser revalidate with the ETag
+        response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
+
+def register_geojson_routes(app):
+    """
+    Add the /geojson/<layer>-<level>.json route to the app's Flask server.
+    """
+    prefix = app.config.routes_pathname_prefix
+    app.server.add_url_rule(
+        f"{prefix}geojson/<name>.json", "geojson", serve_geojson, methods=["GET"]
+    )
@@ -0,0 +1,25 @@
+# gunicorn settings for serving the dashboard with several workers:
+#     gunicorn app:server
+#
+# the master builds the big tables once into shared memory before forking, so
+# every worker memory-maps the same copy instead of building its own
+
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("WEB_CONCURRENCY", min(4, multiprocessing.cpu_count())))
+timeout = 120
+
+# must be set before data_manager / shared_arrays are imported anywhere
+os.environ.setdefault("DATA_SHARED_DIR", "/dev/shm/nyc-airbnb")
+
+
+def on_starting(server):
+    # data_manager only, not app: the reloader thread must start in the workers
+    import data_manager
+    import shared_arrays
+
+    for name in shared_arrays.SHARED_TABLES:
+        data_manager.get(name)
+        server.log.info("shared table ready: %s", name)
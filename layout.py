@@ -1,8 +1,17 @@
 # this file will contain all HTML components for our UI
 
 from dash import dcc, html
-from layouts.airbnb_only_layout import airbnb_only_layout
-from layouts.affordable_housing_layout import affordable_housing_layout
+
+# view-selector value -> page showing it (both Airbnb views share one page)
+VIEW_PAGES = {
+    "airbnb_points": "airbnb",
+    "population": "airbnb",
+    "affh": "affh",
+    "transit": "transit",
+    "crime": "crime",
+}
+PAGES = ["airbnb", "affh", "transit", "crime"]
+
 
 def create_layout():
     return html.Div([ 
@@ -31,6 +40,16 @@ def create_layout():
         
         html.Hr(),
 
-        # start with airbnb only
-        html.Div(id='page-content', children=airbnb_only_layout)
+        # one container per page, filled by the show_view callback the first
+        # time its view is selected (so no view's data is loaded before), then
+        # only hidden / shown: its graphs and their state stay alive
+        html.Div(
+            id='page-content',
+            children=[
+                html.Div(id=f"page-{page}", style={"display": "none"})
+                for page in PAGES
+            ],
+        ),
+        # pages already filled
+        dcc.Store(id="mounted-pages", data=[]),
     ])
\ No newline at end of file
@@ -1,101 +1,118 @@
 # this is the affordable housing layout Fatima made
 
 from dash import dcc, html
-from data_manager import borough_list, min_year, max_year
+import data_manager
+from geo_assets import detail_level
+from viewport import default_window
 
-affordable_housing_layout = html.Div(
-    [
-        html.H1(
-            "NYC Airbnb & Affordable Housing Layers",
-            style={"textAlign": "center"},
-        ),
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.Label("Select Neighborhood (Airbnb):"),
-                        dcc.Dropdown(
-                            id="affh-neighborhood-filter",
-                            options=[
-                                {"label": i, "value": i}
-                                for i in borough_list
-                            ],
-                            value=None,
-                            placeholder="All Neighborhoods",
-                            multi=True,
-                        ),
-                    ],
-                    style={
-                        "width": "48%",
-                        "display": "inline-block",
-                        "verticalAlign": "top",
-                    },
-                ),
-                html.Div(
-                    [
-                        html.Label("Toggle Layers:"),
-                        dcc.Checklist(
-                            id="affh-layer-toggle",
-                            options=[
-                                {
-                                    "label": "Airbnb Listings",
-                                    "value": "airbnb",
-                                },
-                                {
-                                    "label": "Affordable Housing Points",
-                                    "value": "aff_points",
-                                },
-                                {
-                                    "label": "Council District Totals (Total Units)",
-                                    "value": "council",
+
+def create_affordable_housing_layout():
+    snap = data_manager.current()
+    borough_list = snap.borough_list
+    min_year = snap.min_year
+    max_year = snap.max_year
+
+    return html.Div(
+        [
+            html.H1(
+                "NYC Airbnb & Affordable Housing Layers",
+                style={"textAlign": "center"},
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.Label("Select Neighborhood (Airbnb):"),
+                            dcc.Dropdown(
+                                id="affh-neighborhood-filter",
+                                options=[
+                                    {"label": i, "value": i}
+                                    for i in borough_list
+                                ],
+                                value=None,
+                                placeholder="All Neighborhoods",
+                                multi=True,
+                            ),
+                        ],
+                        style={
+                            "width": "48%",
+                            "display": "inline-block",
+                            "verticalAlign": "top",
+                        },
+                    ),
+                    html.Div(
+                        [
+                            html.Label("Toggle Layers:"),
+                            dcc.Checklist(
+                                id="affh-layer-toggle",
+                                options=[
+                                    {
+                                        "label": "Airbnb Listings",
+                                        "value": "airbnb",
+                                    },
+                                    {
+                                        "label": "Affordable Housing Points",
+                                        "value": "aff_points",
+                                    },
+                                    {
+                                        "label": "Council District Totals (Total Units)",
+                                        "value": "council",
+                                    },
+                                ],
+                                value=["aff_points", "council"],
+                                inline=True,
+                            ),
+                            html.Br(),
+                            html.Label(
+                                "Filter Affordable Housing (points and district totals) by Completion Year:"
+                            ),
+                            dcc.RangeSlider(
+                                id="affh-year-slider",
+                                min=min_year,
+                                max=max_year,
+                                value=[min_year, max_year],
+                                marks={
+                                    year: str(year)
+                                    for year in range(min_year, max_year + 1)
                                 },
-                            ],
-                            value=["aff_points", "council"],
-                            inline=True,
-                        ),
-                        html.Br(),
-                        html.Label(
-                            "Filter Affordable Housing by Completion Year:"
-                        ),
-                        dcc.RangeSlider(
-                            id="affh-year-slider",
-                            min=min_year,
-                            max=max_year,
-                            value=[min_year, max_year],
-                            marks={
-                                year: str(year)
-                                for year in range(min_year, max_year + 1)
-                            },
-                            step=1,
-                        ),
-                    ],
-                    style={
-                        "width": "48%",
-                        "display": "inline-block",
-                        "verticalAlign": "top",
-                        "paddingLeft": "20px",
-                    },
-                ),
-            ],
-            style={"padding": "10px 20px"},
-        ),
-        dcc.Graph(id="affh-map"),
+                                step=1,
+                            ),
+                        ],
+                        style={
+                            "width": "48%",
+                            "display": "inline-block",
+                            "verticalAlign": "top",
+                            "paddingLeft": "20px",
+                        },
+                    ),
+                ],
+                style={"padding": "10px 20px"},
+            ),
+            dcc.Graph(id="affh-map"),
+            # boundary level of detail for the current zoom (see geo_assets)
+            dcc.Store(id="affh-map-detail", data=detail_level(10.5)),
+            # listings window currently shown (see viewport.py)
+            dcc.Store(id="affh-map-viewport", data=default_window(10.5)),
+            # what the map's airbnb trace was built for (see update_affh_map)
+            dcc.Store(id="affh-map-airbnb"),
+            # points + council year totals for the browser-side year filter
+            dcc.Store(id="affh-points-data", data=snap.aff_points_client),
 
-        html.Br(),
+            html.Br(),
 
-        html.Div(
-            id="affh-description-box",
-            children=[
-                html.P([
-                    "Airbnb Listings – Blue points showing Airbnb listings from the last 12 months, filtered by neighborhood if selected.",
-                    html.Br(),
-                    "Affordable Housing Units (by Project) – Greenish circles whose size and color reflect the number of ‘All Counted Units’ at each project. The year slider controls which completion years are shown.",
-                    html.Br(),
-                    "Total Affordable Units (within Council District) – Purple/blue polygons representing the total number of affordable units in each NYC Council District, with darker colors indicating more units."
+            html.Div(
+                id="affh-description-box",
+                children=[
+                    html.P([
+                        "Airbnb Listings – Blue points showing Airbnb listings from the last 12 months, filtered by neighborhood if selected.",
+                        html.Br(),
+                        "Affordable Housing Units (by Project) – Greenish circles whose size and color reflect the number of ‘All Counted Units’ at each project. The year slider controls which completion years are shown.",
+                        html.Br(),
+                        "Total Affordable Units (within Council District) – Purple/blue polygons representing the number of affordable units completed in each NYC Council District within the years selected on the slider, with darker colors indicating more units. Buildings without a completion date are not included."
+                    ],
+                    style={"fontSize": "16px", "marginTop": "10px"})
                 ],
-                style={"fontSize": "16px", "marginTop": "10px"})
-            ],
-            style={"textAlign": "center", "padding": "10px 20px"}
-        )
-    ]
-)
\ No newline at end of file
+                style={"textAlign": "center", "padding": "10px 20px"}
+            )
+        ]
+    )
\ No newline at end of file
@@ -2,9 +2,20 @@
 # airbnb data only
 
 from dash import dcc, html
-from data_manager import base_map, borough_list
+import data_manager
+from geo_assets import detail_level
+from viewport import default_window
 
-airbnb_only_layout = html.Div([ 
+
+# the neighborhood filter only applies to the points view
+FILTER_STYLE = {'width': '50%', 'padding': '10px'}
+HIDDEN = {'display': 'none'}
+
+
+def create_airbnb_only_layout(view_mode="airbnb_points"):
+    snap = data_manager.current()
+
+    return html.Div([ 
         html.H1("Airbnb Listings & Density", style={'textAlign': 'center'}), 
 
         # drop down for neighborhood filter
@@ -12,17 +23,23 @@ airbnb_only_layout = html.Div([
             html.Label("Select Neighborhood:"), 
             dcc.Dropdown( 
                 id='airbnb-neighborhood-filter', 
-                options=[{'label': i, 'value': i} for i in borough_list], 
+                options=[{'label': i, 'value': i} for i in snap.borough_list], 
                 value=None, # no initial selection
                 placeholder="All Neighborhoods", 
                 multi=True # can select multiple boroughs at once
             ) 
         ], 
         id="airbnb-filter-container",
-        style={'width': '50%', 'padding': '10px'}), 
+        style=FILTER_STYLE if view_mode == "airbnb_points" else HIDDEN), 
 
         # needed to display base map
-        dcc.Graph(id='airbnb-map', figure=base_map),
+        dcc.Graph(id='airbnb-map', figure=snap.base_map),
+        # boundary level of detail for the current zoom (see geo_assets)
+        dcc.Store(id='airbnb-map-detail', data=detail_level(10)),
+        # listings window currently shown (see viewport.py)
+        dcc.Store(id='airbnb-map-viewport', data=default_window(10)),
+        # which of the two Airbnb views the map shows (see toggle_airbnb_filter)
+        dcc.Store(id='airbnb-view-mode', data=view_mode),
 
         html.Br(),
 
@@ -1,56 +1,87 @@
 from dash import html, dcc
-from data_manager import df_map
-
-transit_layout = html.Div([
-    html.H1("NYC Airbnb & Transit Analytics", style={'textAlign': 'center'}),
-
-    # Dropdown
-    html.Div([
-        html.Label("Filter Dashboard by Room Type:"),
-        dcc.Dropdown(
-            id='transit-room-filter',
-             options=[{"label": "Compare All Categories", "value": "ALL"}] +
-            [{"label": rt, "value": rt} for rt in sorted(df_map['room_type'].unique())],
-            value='ALL',
-            clearable=False,
-            style={'width': '50%'}
-        )
-    ], style={'padding': '10px'}),
-
-    html.Hr(),
-
-    # Map 1
-    html.Div([
-        html.H3("Listing Locations & Subway Lines", style={'marginBottom': '5px'}),
-        dcc.Graph(id="transit-main-map")
-    ], style={'padding': '10px'}),
-
-    # Scatter Plot
-    html.Div([
-        html.H3("The 'Proximity Premium' Analysis", style={'marginBottom': '5px'}),
-        dcc.Graph(id="transit-scatter")
-    ], style={'padding': '10px'}),
-
-    # Luxury Lines Map
-    html.Div([
-        html.H3("The 'Luxury Lines': Average Price by Subway Station"),
-        dcc.Graph(id="transit-luxury-map")
-    ], style={'padding': '10px'}),
-
-    html.Br(),
-
-    html.Div(
-        id="transit-description-box",
-        children=[
-            html.P([
-                "Listing locations: Different categories of Airbnb listings and subway stations in NYC.",
-                html.Br(),
-                "Proximity premium: Shows price trend of Airbnbs based on distance to the nearest subway station.",
-                html.Br(),
-                "Luxury lines: Subway stations colored by the average price of Airbnbs within a 10-minute walk (800m)."
+import data_manager
+
+
+def create_transit_layout():
+    df_map = data_manager.current().df_map
+
+    return html.Div([
+        html.H1("NYC Airbnb & Transit Analytics", style={'textAlign': 'center'}),
+
+        # Dropdown
+        html.Div([
+            html.Label("Filter Dashboard by Room Type:"),
+            dcc.Dropdown(
+                id='transit-room-filter',
+                 options=[{"label": "Compare All Categories", "value": "ALL"}] +
+                [{"label": rt, "value": rt} for rt in sorted(df_map['room_type'].unique())],
+                value='ALL',
+                clearable=False,
+                style={'width': '50%'}
+            )
+        ], style={'padding': '10px'}),
+
+        html.Hr(),
+
+        # Map 1
+        html.Div([
+            html.H3("Listing Locations & Subway Lines", style={'marginBottom': '5px'}),
+            dcc.Graph(id="transit-main-map")
+        ], style={'padding': '10px'}),
+
+        # Scatter Plot
+        html.Div([
+            html.H3("The 'Proximity Premium' Analysis", style={'marginBottom': '5px'}),
+            dcc.RadioItems(
+                id="transit-trend-mode",
+                options=[
+                    {"label": "Linear trendline", "value": "linear"},
+                    {"label": "Binned median", "value": "median"},
+                ],
+                value="linear",
+                inline=True,
+            ),
+            dcc.Graph(id="transit-scatter")
+        ], style={'padding': '10px'}),
+
+        # Luxury Lines Map
+        html.Div([
+            html.H3("The 'Luxury Lines': Average Price by Subway Station"),
+            html.Label("Walking radius around each station:"),
+            dcc.Slider(
+                id="transit-walk-radius",
+                min=min(data_manager.WALK_RADII),
+                max=max(data_manager.WALK_RADII),
+                step=None,
+                marks={r: f"{r} m" for r in data_manager.WALK_RADII},
+                value=data_manager.STATION_WALK_METERS,
+            ),
+            html.Div(id="transit-walk-summary", style={'padding': '5px 0'}),
+            dcc.Graph(id="transit-luxury-map")
+        ], style={'padding': '10px'}),
+
+        # Subway Line Ranking (same room type and walking radius)
+        html.Div([
+            html.H3("Subway Lines Ranked by Median Nearby Price"),
+            dcc.Graph(id="transit-route-ranking")
+        ], style={'padding': '10px'}),
+
+        html.Br(),
+
+        html.Div(
+            id="transit-description-box",
+            children=[
+                html.P([
+                    "Listing locations: Different categories of Airbnb listings and subway stations in NYC.",
+                    html.Br(),
+                    "Proximity premium: Shows price trend of Airbnbs based on distance to the nearest subway station (a representative sample of listings is drawn; trend curves use all of them).",
+                    html.Br(),
+                    "Luxury lines: Subway stations colored by the median price of Airbnbs within the chosen walking radius (800m is about a 10-minute walk).",
+                    html.Br(),
+                    "Subway lines: Lines ranked by the median price of Airbnbs within the walking radius of any of their stations (each listing counted once per line)."
+                ],
+                style={"fontSize": "16px", "marginTop": "10px"})
             ],
-            style={"fontSize": "16px", "marginTop": "10px"})
-        ],
-        style={"textAlign": "center", "padding": "10px 20px"}
-    )
-])
+            style={"textAlign": "center", "padding": "10px 20px"}
+        )
+    ])
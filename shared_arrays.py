@@ -0,0 +1,119 @@
+# this file lets several gunicorn workers share one copy of the big tables
+#
+# with DATA_SHARED_DIR set (e.g. /dev/shm/nyc-airbnb, see gunicorn.conf.py),
+# the largest tables are stored there column by column as .npy files. The
+# first process that needs a table (normally the gunicorn master, before it
+# forks) writes it; every worker then memory-maps the same files read-only,
+# so the OS keeps a single copy in RAM no matter how many workers run.
+#
+# text columns are stored as categorical codes (the categories themselves are
+# small and kept per process), so every shared column is a plain number array
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # not on Windows -> writers only synchronise per process
+    fcntl = None
+
+SHARED_DIR = os.environ.get("DATA_SHARED_DIR", "")
+
+# tables worth sharing (the rest are tiny)
+SHARED_TABLES = ["airbnb_df", "df_map", "aff_points"]
+
+_write_lock = threading.Lock()
+
+
+def enabled():
+    return bool(SHARED_DIR)
+
+
+def table_dir(name, key):
+    return os.path.join(SHARED_DIR, f"{name}-{key}")
+
+
+def export_table(df, path):
+    """
+    Write every column of df as an .npy file under path, plus a manifest
+    with dtypes and categories. The directory appears atomically.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        entry = {"name": col, "file": f"{i}.npy"}
+
+        if not isinstance(series.dtype, pd.CategoricalDtype) and not (
+            pd.api.types.is_numeric_dtype(series.dtype)
+            or pd.api.types.is_bool_dtype(series.dtype)
+        ):
+            series = series.astype("category")
+
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            entry["categories"] = series.cat.categories.tolist()
+            entry["ordered"] = bool(series.cat.ordered)
+            values = series.cat.codes.to_numpy()
+        else:
+            values = series.to_numpy()
+
+        np.save(os.path.join(tmp, entry["file"]), values, allow_pickle=False)
+        columns.append(entry)
+
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump({"columns": columns, "rows": len(df)}, f)
+
+    os.replace(tmp, path)
+
+
+def attach_table(path):
+    """
+    Rebuild the DataFrame from the .npy files without copying them: numeric
+    columns and category codes stay backed by the shared, read-only mapping.
+    """
+    with open(os.path.join(path, "manifest.json"), "r") as f:
+        manifest = json.load(f)
+
+    data = {}
+    for entry in manifest["columns"]:
+        values = np.load(os.path.join(path, entry["file"]), mmap_mode="r")
+        if "categories" in entry:
+            dtype = pd.CategoricalDtype(entry["categories"], ordered=entry["ordered"])
+            values = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        data[entry["name"]] = values
+
+    return pd.DataFrame(data, copy=False)
+
+
+def shared_table(name, key, build):
+    """
+    Return table `name` for content key `key` from shared memory, writing it
+    there first (once, across processes) with build() if it is missing.
+    """
+    path = table_dir(name, key)
+    if not os.path.isdir(path):
+        os.makedirs(SHARED_DIR, exist_ok=True)
+        with _write_lock, open(os.path.join(SHARED_DIR, f"{name}.lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isdir(path):
+                export_table(build(), path)
+                _remove_old(name, keep=path)
+
+    return attach_table(path)
+
+
+def _remove_old(name, keep):
+    # workers still attached to an old version keep their mapping alive
+    for fname in os.listdir(SHARED_DIR):
+        path = os.path.join(SHARED_DIR, fname)
+        if fname.startswith(name + "-") and os.path.isdir(path) and path != keep:
+            shutil.rmtree(path, ignore_errors=True)
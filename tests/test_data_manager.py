@@ -0,0 +1,92 @@
+# this file checks the year filters in data_manager against a direct
+# boolean mask over the buildings: the searchsorted slice over the sorted
+# aff_points years and the per-district prefix sums behind the council map
+#
+#     python -m pytest tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_manager
+from data_manager import (
+    build_aff_units_by_year, council_units_between, load_council_units_cumulative, year_slice,
+)
+
+FIRST_YEAR, LAST_YEAR = 2014, 2024
+
+# full range, single years at both edges, ranges reaching past the data,
+# ranges entirely before / after it and an inverted range
+YEAR_RANGES = [
+    (FIRST_YEAR, LAST_YEAR),
+    (FIRST_YEAR, FIRST_YEAR),
+    (LAST_YEAR, LAST_YEAR),
+    (2017, 2019),
+    (2000, 2016),
+    (2020, 2035),
+    (1990, 2005),
+    (2030, 2040),
+    (1990, 2040),
+    (2019, 2017),
+]
+
+
+@pytest.fixture(scope="module")
+def buildings():
+    # aff_buildings in miniature: some buildings have no completion year,
+    # district 9 has none with a year and district 4 is not on the map
+    rng = np.random.default_rng(0)
+    n = 500
+    years = rng.integers(FIRST_YEAR, LAST_YEAR + 1, n).astype(float)
+    years[rng.random(n) < 0.15] = np.nan
+    districts = rng.choice([1, 2, 3, 4, 5, 7], n)
+    districts[:5] = 9
+    years[:5] = np.nan
+    return pd.DataFrame({
+        "Council District": districts,
+        "Total Units": rng.integers(1, 300, n).astype(float),
+        "CompletionYear": years,
+    })
+
+
+@pytest.fixture(scope="module")
+def council_order():
+    # aff_by_council row order
+    return np.array([7, 3, 9, 1, 5, 2])
+
+
+@pytest.fixture
+def cumulative(buildings, council_order, monkeypatch):
+    frames = {
+        "aff_buildings": buildings,
+        "aff_by_council": pd.DataFrame({"COUNDIST": council_order}),
+    }
+    monkeypatch.setattr(data_manager, "get", frames.__getitem__)
+    frames["aff_units_by_year"] = build_aff_units_by_year()
+    return load_council_units_cumulative()
+
+
+def masked_units(buildings, council_order, yr_min, yr_max):
+    years = buildings["CompletionYear"]
+    inside = buildings[(years >= yr_min) & (years <= yr_max)]
+    totals = inside.groupby("Council District")["Total Units"].sum()
+    return totals.reindex(council_order, fill_value=0).to_numpy()
+
+
+@pytest.mark.parametrize("yr_min, yr_max", YEAR_RANGES)
+def test_council_units_between_matches_mask(buildings, council_order, cumulative, yr_min, yr_max):
+    got = council_units_between(cumulative, yr_min, yr_max)
+    assert np.array_equal(got, masked_units(buildings, council_order, yr_min, yr_max))
+
+
+@pytest.mark.parametrize("yr_min, yr_max", YEAR_RANGES)
+def test_year_slice_matches_mask(buildings, yr_min, yr_max):
+    # aff_points: dated buildings only, sorted by year
+    points = buildings.dropna(subset=["CompletionYear"])
+    points = points.sort_values("CompletionYear", kind="stable").reset_index(drop=True)
+    years = points["CompletionYear"].astype(np.int16).to_numpy()
+
+    mask = (years >= yr_min) & (years <= yr_max)
+    rows = np.arange(len(points))[year_slice(years, yr_min, yr_max)]
+    assert np.array_equal(rows, np.flatnonzero(mask))
+    assert points["Total Units"].to_numpy()[rows].sum() == points.loc[mask, "Total Units"].sum()
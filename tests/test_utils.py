@@ -0,0 +1,283 @@
+# this file checks the helpers in utils against straightforward reference
+# versions: the vectorized geometry code against the original per-point
+# functions (on the council districts in data/nycc.json), the streaming
+# medians against pandas, boundary simplification against its promise of
+# no gaps between neighbours and the proximity index against brute force
+#
+#     python -m pytest tests
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import (
+    ProximityIndex, RegionIndex, assign_regions, haversine_m, point_in_district, point_in_ring,
+    points_in_polygon, points_in_ring, simplify_geojson, stream_group_medians,
+)
+
+NYCC_FILE = os.path.join(os.path.dirname(__file__), "..", "data", "nycc.json")
+
+
+@pytest.fixture(scope="module")
+def districts():
+    with open(NYCC_FILE) as f:
+        return json.load(f)["features"]
+
+
+def polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+
+def all_rings(features):
+    # every ring of every polygon, exterior and holes
+    return [ring for feat in features for poly in polygons(feat["geometry"]) for ring in poly]
+
+
+def ring_points(ring, rng, n_random=200, n_vertices=50):
+    """
+    Random points in the ring's bounding box, points exactly on vertices,
+    on edge midpoints and level with vertices (rays through a vertex).
+    """
+    ring = np.asarray(ring, dtype=float)[:, :2]
+    (x_min, y_min), (x_max, y_max) = ring.min(axis=0), ring.max(axis=0)
+    pad_x, pad_y = (x_max - x_min) * 0.05, (y_max - y_min) * 0.05
+
+    random = np.column_stack([
+        rng.uniform(x_min - pad_x, x_max + pad_x, n_random),
+        rng.uniform(y_min - pad_y, y_max + pad_y, n_random),
+    ])
+    picks = rng.choice(len(ring), size=min(n_vertices, len(ring)), replace=False)
+    vertices = ring[picks]
+    midpoints = (ring[picks] + ring[(picks + 1) % len(ring)]) / 2
+    level = np.column_stack([rng.uniform(x_min, x_max, len(picks)), ring[picks, 1]])
+    return np.concatenate([random, vertices, midpoints, level])
+
+
+def city_points(features, rng, n=800):
+    # random points over all districts plus some district vertices
+    rings = all_rings(features)
+    coords = np.concatenate([np.asarray(r, dtype=float)[:, :2] for r in rings])
+    (x_min, y_min), (x_max, y_max) = coords.min(axis=0), coords.max(axis=0)
+    random = np.column_stack([rng.uniform(x_min, x_max, n), rng.uniform(y_min, y_max, n)])
+    vertices = coords[rng.choice(len(coords), size=n // 10, replace=False)]
+    return np.concatenate([random, vertices])
+
+
+def reference_regions(features, points, missing=-1):
+    # the original spatial join: exterior rings per district, first match wins
+    exteriors = [[poly[0] for poly in polygons(feat["geometry"])] for feat in features]
+    codes = np.full(len(points), missing, dtype=np.int32)
+    for i, (lon, lat) in enumerate(points):
+        for code, rings in enumerate(exteriors):
+            if point_in_district(lon, lat, rings):
+                codes[i] = code
+                break
+    return codes
+
+
+def test_points_in_ring_matches_point_in_ring(districts):
+    rng = np.random.default_rng(0)
+    for ring in all_rings(districts):
+        points = ring_points(ring, rng)
+        expected = [point_in_ring(lon, lat, ring) for lon, lat in points]
+        got = points_in_ring(points[:, 0], points[:, 1], ring)
+        assert got.tolist() == expected
+
+
+def test_points_in_polygon_with_hole(districts):
+    # nycc.json has no holes: punch one into a district by reusing a
+    # shrunken copy of its exterior as an inner ring
+    rng = np.random.default_rng(1)
+    exterior = polygons(districts[0]["geometry"])[0][0]
+    ring = np.asarray(exterior, dtype=float)[:, :2]
+    center = ring.mean(axis=0)
+    hole = (center + (ring - center) * 0.4).tolist()
+    polygon = [exterior, hole]
+
+    points = np.concatenate([ring_points(exterior, rng), ring_points(hole, rng)])
+    expected = [
+        point_in_ring(lon, lat, exterior) and not point_in_ring(lon, lat, hole)
+        for lon, lat in points
+    ]
+    assert points_in_polygon(points[:, 0], points[:, 1], polygon).tolist() == expected
+    assert any(expected) and not all(expected)
+
+
+def test_assign_regions_matches_first_match_loop(districts):
+    rng = np.random.default_rng(2)
+    points = city_points(districts, rng)
+    geometries = [feat["geometry"] for feat in districts]
+
+    expected = reference_regions(districts, points)
+    got = assign_regions(points[:, 0], points[:, 1], geometries)
+    assert np.array_equal(got, expected)
+    assert (expected >= 0).any() and (expected == -1).any()
+
+
+def test_region_index_matches_assign_regions(districts):
+    rng = np.random.default_rng(3)
+    points = np.concatenate([city_points(districts, rng), [[np.nan, 40.7], [-80.0, 40.7]]])
+    geometries = [feat["geometry"] for feat in districts]
+
+    expected = assign_regions(points[:, 0], points[:, 1], geometries)
+    for grid_size in (1, 16, 64):
+        index = RegionIndex(geometries, grid_size=grid_size)
+        assert np.array_equal(index.locate(points[:, 0], points[:, 1]), expected)
+
+
+# ------------------------------------------------------------
+# streaming group medians
+# ------------------------------------------------------------
+def listing_prices(rng, n_rows=20_000, n_listings=700):
+    # a year file in miniature: repeated rows per listing, a few missing prices
+    df = pd.DataFrame({
+        "id": rng.integers(0, n_listings, n_rows),
+        "room_type": rng.choice(["Entire home/apt", "Private room"], n_rows),
+        "price": np.round(rng.lognormal(5, 0.8, n_rows), 2),
+    })
+    df.loc[rng.random(n_rows) < 0.02, "price"] = np.nan
+    return df
+
+
+def chunked(df, size):
+    return (df.iloc[start:start + size] for start in range(0, len(df), size))
+
+
+def test_stream_group_medians_exact_matches_groupby():
+    df = listing_prices(np.random.default_rng(4))
+    keys = ["id", "room_type"]
+
+    got, exact = stream_group_medians(chunked(df, 3000), keys, "price")
+    expected = df.groupby(keys)["price"].median().dropna()
+
+    assert exact
+    got = got.set_index(keys)["price"].sort_index()
+    pd.testing.assert_series_equal(got, expected, check_names=False, check_index_type=False)
+
+
+@pytest.mark.parametrize("alpha", [0.005, 0.02])
+def test_stream_group_medians_sketch_within_alpha(alpha):
+    df = listing_prices(np.random.default_rng(5))
+    keys = ["id", "room_type"]
+
+    # a tiny state limit forces the switch to the sketch after the first chunk
+    got, exact = stream_group_medians(
+        chunked(df, 3000), keys, "price", max_state=100, alpha=alpha
+    )
+    expected = df.groupby(keys)["price"].median().dropna()
+
+    assert not exact
+    got = got.set_index(keys)["price"].reindex(expected.index)
+    rel_error = np.abs(got - expected) / expected
+    assert rel_error.max() <= alpha * (1 + 1e-9)
+
+
+# ------------------------------------------------------------
+# boundary simplification
+# ------------------------------------------------------------
+def neighbours(rng, n=300):
+    """
+    Two polygons sharing a wiggly boundary, traversed in opposite directions
+    and starting at different points (like neighbouring districts).
+    """
+    lons = np.linspace(-74.00, -73.95, n)
+    lats = 40.70 + 5e-4 * np.sin(lons * 600) + rng.normal(0, 1e-4, n)
+    shared = np.round(np.column_stack([lons, lats]), 5).tolist()
+
+    north = shared + [[-73.95, 40.75], [-74.00, 40.75]]
+    south = shared[::-1] + [[-74.00, 40.65], [-73.95, 40.65]]
+    south = south[n // 3:] + south[:n // 3]
+
+    features = [
+        {"type": "Feature", "properties": {"id": name},
+         "geometry": {"type": "Polygon", "coordinates": [ring + ring[:1]]}}
+        for name, ring in [("north", north), ("south", south)]
+    ]
+    return {"type": "FeatureCollection", "features": features}, shared
+
+
+def test_simplify_geojson_shares_boundaries():
+    geojson, shared = neighbours(np.random.default_rng(6))
+    shared = {tuple(p) for p in shared}
+    tolerances = [0.0, 1e-5, 1e-4, 5e-4, 2e-3]
+
+    sizes = []
+    for version in simplify_geojson(geojson, "id", tolerances):
+        north, south = (
+            [tuple(p) for p in f["geometry"]["coordinates"][0][:-1]]
+            for f in version["features"]
+        )
+        # the shared vertices kept, in boundary order, are the same for both
+        on_north = [p for p in north if p in shared]
+        on_south = [p for p in south if p in shared]
+        start = on_south.index(on_north[0])
+        assert on_south[start::-1] + on_south[:start:-1] == on_north
+        # and neither polygon gained a vertex off the original boundary
+        assert len(north) - len(on_north) == 2 and len(south) - len(on_south) == 2
+        sizes.append(len(on_north))
+
+    assert sizes[0] == len(shared) and sizes[-1] < sizes[2] < sizes[0]
+
+
+# ------------------------------------------------------------
+# proximity index (meters)
+# ------------------------------------------------------------
+def nyc_points(rng, n, missing=0):
+    lons = rng.uniform(-74.05, -73.75, n)
+    lats = rng.uniform(40.55, 40.90, n)
+    lons[:missing] = np.nan
+    return lons, lats
+
+
+def brute_distances(index, lons, lats):
+    # query x layer haversine matrix, inf for rows without coordinates
+    d = haversine_m(lons[:, None], lats[:, None], index.lons[None, :], index.lats[None, :])
+    return np.where(np.isnan(d), np.inf, d)
+
+
+@pytest.mark.parametrize("n_layer, k", [(200, 1), (200, 3), (5, 8)])
+def test_proximity_nearest_matches_brute_force(n_layer, k):
+    rng = np.random.default_rng(7)
+    index = ProximityIndex(*nyc_points(rng, n_layer, missing=2))
+    lons, lats = nyc_points(rng, 400, missing=10)
+
+    dist, rows = index.nearest(lons, lats, k=k)
+    dist, rows = dist.reshape(len(lons), k), rows.reshape(len(lons), k)
+    # k can exceed the layer size: the missing neighbours are inf / -1
+    expected = np.sort(brute_distances(index, lons, lats), axis=1)[:, :k]
+    expected = np.pad(expected, ((0, 0), (0, k - expected.shape[1])), constant_values=np.inf)
+
+    assert np.allclose(dist, expected)
+    assert np.isinf(dist[np.isnan(lons)]).all()
+    found = rows >= 0
+    assert np.array_equal(found, np.isfinite(expected))
+    # the reported rows are the points at the reported distances
+    q = np.broadcast_to(np.arange(len(lons))[:, None], rows.shape)
+    assert np.allclose(
+        haversine_m(lons[q[found]], lats[q[found]], index.lons[rows[found]], index.lats[rows[found]]),
+        dist[found],
+    )
+
+
+def test_proximity_within_matches_brute_force():
+    rng = np.random.default_rng(8)
+    index = ProximityIndex(*nyc_points(rng, 300, missing=3))
+    lons, lats = nyc_points(rng, 300, missing=5)
+    radius = 1500
+
+    ptr, rows, dist = index.within(lons, lats, radius)
+    d = brute_distances(index, lons, lats)
+    for i in range(len(lons)):
+        expected = np.flatnonzero(d[i] <= radius)
+        assert sorted(rows[ptr[i]:ptr[i + 1]].tolist()) == expected.tolist()
+        # sorted by distance within each query
+        assert np.allclose(dist[ptr[i]:ptr[i + 1]], np.sort(d[i, expected]))
+
+    counts = index.count_within(lons, lats, radius)
+    assert np.array_equal(counts, (d <= radius).sum(axis=1))
+    assert counts.max() > 0 and counts[:5].sum() == 0
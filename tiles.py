@@ -0,0 +1,326 @@
+# this file builds and serves a zoom pyramid of pre-clustered point tiles
+#
+# every listing / housing point is clustered once per zoom level into
+# CLUSTER_GRID x CLUSTER_GRID cells per web-mercator tile; each tile is stored
+# as a gzipped GeoJSON FeatureCollection (one point feature per cell) in a
+# single SQLite file, so the /tiles/<layer>/<z>/<x>/<y>.json endpoint is a
+# primary key lookup and never touches pandas.
+#
+# the endpoint is for external clients (the wall display); the Dash maps
+# build their own figures. The store records the fingerprint of the data it
+# was built from; once the data changes (and is reloaded) tiles are answered
+# with 503 until the store is rebuilt.
+#
+# build / refresh the store (after the data changed) with:
+#     python tiles.py
+
+import gzip
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from flask import Response, abort, request
+
+from artifacts import ARTIFACT_DIR, fingerprint
+
+TILE_DB = os.path.join(ARTIFACT_DIR, "tiles.sqlite")
+
+MIN_ZOOM = 9
+MAX_ZOOM = 16
+CLUSTER_GRID = 16   # cluster cells per tile side
+
+# tiles only change when the store is rebuilt; the ETag catches that
+CACHE_CONTROL = "public, max-age=3600"
+
+# how long clients should wait before retrying an outdated store
+RETRY_AFTER = 300
+
+# layer -> how to read it from data_manager
+LAYERS = {
+    "airbnb": {
+        "table": "airbnb_df",
+        "lon": "longitude", "lat": "latitude",
+        "price": "price", "category": "room_type",
+    },
+    "affordable": {
+        "table": "aff_points",
+        "lon": "Longitude", "lat": "Latitude",
+        "units": "All Counted Units",
+    },
+}
+
+SCHEMA = """
+CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE tiles (
+    layer TEXT, z INTEGER, x INTEGER, y INTEGER,
+    count INTEGER,          -- points in the tile
+    median_price REAL,      -- airbnb only
+    room_type TEXT,         -- most common room type (airbnb only)
+    units REAL,             -- total housing units (affordable only)
+    body BLOB,              -- gzipped GeoJSON of the tile's clusters
+    etag TEXT,
+    PRIMARY KEY (layer, z, x, y)
+) WITHOUT ROWID;
+"""
+
+
+# ------------------------------------------------------------
+# build
+# ------------------------------------------------------------
+def data_fingerprint():
+    """
+    Fingerprint of the input files the tiles are built from.
+    """
+    import data_manager
+
+    return fingerprint(sorted(set(data_manager.AIRBNB_INPUTS + data_manager.AFF_POINTS_INPUTS)))
+
+
+def mercator_xy(lons, lats):
+    """
+    Web-mercator coordinates in [0, 1) x [0, 1) (y grows southwards).
+    """
+    lats = np.clip(lats, -85.0511, 85.0511)
+    x = (lons + 180.0) / 360.0
+    s = np.sin(np.radians(lats))
+    y = 0.5 - np.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return x, y
+
+
+def _dominant(keys, categories):
+    # most common category per key (ties -> first in category order)
+    counts = pd.crosstab(keys, categories)
+    return counts.idxmax(axis=1)
+
+
+def _cluster_features(columns, start, end):
+    # GeoJSON point features for clusters[start:end] (columns as plain lists)
+    features = []
+    for i in range(start, end):
+        props = {"count": columns["count"][i]}
+        if "median_price" in columns:
+            price = columns["median_price"][i]
+            props["median_price"] = None if price != price else round(price, 2)
+            props["room_type"] = columns["room_type"][i]
+        if "units" in columns:
+            props["units"] = columns["units"][i]
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [round(columns["lon"][i], 6), round(columns["lat"][i], 6)],
+            },
+            "properties": props,
+        })
+    return features
+
+
+def layer_tiles(df, spec):
+    """
+    Yield (z, x, y, summary dict, FeatureCollection) for every non-empty tile
+    of one layer, from MIN_ZOOM to MAX_ZOOM.
+    """
+    lons = pd.to_numeric(df[spec["lon"]], errors="coerce").to_numpy(dtype=np.float64)
+    lats = pd.to_numeric(df[spec["lat"]], errors="coerce").to_numpy(dtype=np.float64)
+    ok = np.isfinite(lons) & np.isfinite(lats)
+
+    points = pd.DataFrame({"lon": lons[ok], "lat": lats[ok]})
+    if "price" in spec:
+        points["price"] = pd.to_numeric(df[spec["price"]], errors="coerce").to_numpy()[ok]
+        points["category"] = df[spec["category"]].astype(str).to_numpy()[ok]
+    if "units" in spec:
+        points["units"] = pd.to_numeric(df[spec["units"]], errors="coerce").fillna(0).to_numpy()[ok]
+
+    # cluster cell of every point at the finest level; coarser levels shift
+    mx, my = mercator_xy(points["lon"].to_numpy(), points["lat"].to_numpy())
+    finest = 2 ** MAX_ZOOM * CLUSTER_GRID
+    gx = np.minimum((mx * finest).astype(np.int64), finest - 1)
+    gy = np.minimum((my * finest).astype(np.int64), finest - 1)
+    shift_tile = int(math.log2(CLUSTER_GRID))
+
+    for z in range(MIN_ZOOM, MAX_ZOOM + 1):
+        cx = gx >> (MAX_ZOOM - z)
+        cy = gy >> (MAX_ZOOM - z)
+        points["tx"] = cx >> shift_tile
+        points["ty"] = cy >> shift_tile
+        points["cell"] = (cy << 32) | cx
+
+        clusters = points.groupby(["tx", "ty", "cell"], sort=True).agg(
+            count=("lon", "size"), lon=("lon", "mean"), lat=("lat", "mean"),
+        )
+        tiles = points.groupby(["tx", "ty"], sort=True).agg(count=("lon", "size"))
+
+        if "price" in spec:
+            clusters["median_price"] = points.groupby(["tx", "ty", "cell"])["price"].median()
+            clusters["room_type"] = _dominant(
+                [points["tx"], points["ty"], points["cell"]], points["category"]
+            ).reindex(clusters.index)
+            tiles["median_price"] = points.groupby(["tx", "ty"])["price"].median()
+            tiles["room_type"] = _dominant(
+                [points["tx"], points["ty"]], points["category"]
+            ).reindex(tiles.index)
+        if "units" in spec:
+            clusters["units"] = points.groupby(["tx", "ty", "cell"])["units"].sum()
+            tiles["units"] = points.groupby(["tx", "ty"])["units"].sum()
+
+        # walk the (tile-sorted) clusters as plain lists, one slice per tile
+        columns = {col: clusters[col].tolist() for col in clusters.columns}
+        summaries = tiles.reset_index().to_dict("records")
+        tile_keys = clusters.index.droplevel("cell")
+        bounds = np.flatnonzero(~tile_keys.duplicated()).tolist() + [len(clusters)]
+
+        for summary, start, end in zip(summaries, bounds[:-1], bounds[1:]):
+            collection = {
+                "type": "FeatureCollection",
+                "features": _cluster_features(columns, start, end),
+            }
+            yield z, int(summary["tx"]), int(summary["ty"]), summary, collection
+
+
+def build_tiles(path=TILE_DB):
+    """
+    Rebuild the whole tile store from data_manager's tables (atomically).
+    """
+    import data_manager
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    db = sqlite3.connect(tmp)
+    db.executescript(SCHEMA)
+
+    stamp = data_fingerprint()
+    counts = {}
+    for layer, spec in LAYERS.items():
+        rows = []
+        for z, x, y, summary, collection in layer_tiles(data_manager.get(spec["table"]), spec):
+            body = json.dumps(collection, separators=(",", ":")).encode()
+            etag = hashlib.sha256(stamp.encode() + body).hexdigest()[:16]
+            rows.append((
+                layer, z, x, y, int(summary["count"]),
+                summary.get("median_price"), summary.get("room_type"), summary.get("units"),
+                gzip.compress(body, compresslevel=6), etag,
+            ))
+        db.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        counts[layer] = len(rows)
+
+    metadata = {
+        "fingerprint": stamp,
+        "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "min_zoom": MIN_ZOOM,
+        "max_zoom": MAX_ZOOM,
+        "layers": json.dumps(list(LAYERS)),
+    }
+    db.executemany("INSERT INTO metadata VALUES (?, ?)", [(k, str(v)) for k, v in metadata.items()])
+    db.commit()
+    db.close()
+
+    os.replace(tmp, path)
+    return counts
+
+
+# ------------------------------------------------------------
+# serve
+# ------------------------------------------------------------
+_local = threading.local()
+
+# (store file stamp, data snapshot version) -> store matches the data
+_fresh = {}
+_fresh_lock = threading.Lock()
+
+
+def _connection():
+    # one read-only connection per thread, reopened when the file is replaced
+    try:
+        st = os.stat(TILE_DB)
+    except OSError:
+        return None
+    stamp = (st.st_ino, st.st_mtime_ns)
+    if getattr(_local, "stamp", None) != stamp:
+        _local.db = sqlite3.connect(f"file:{TILE_DB}?mode=ro", uri=True)
+        _local.stamp = stamp
+    return _local.db
+
+
+def store_is_current(db):
+    """
+    True if the open store was built from the data currently on disk.
+    Checked once per store file and data snapshot (a reload bumps it).
+    """
+    import data_manager
+
+    key = (_local.stamp, data_manager.current().version)
+    with _fresh_lock:
+        if key not in _fresh:
+            row = db.execute("SELECT value FROM metadata WHERE name = 'fingerprint'").fetchone()
+            _fresh[key] = row is not None and row[0] == data_fingerprint()
+            if not _fresh[key]:
+                print(
+                    f"tiles: {TILE_DB} is outdated, rebuild it with `python tiles.py`",
+                    file=sys.stderr,
+                )
+        return _fresh[key]
+
+
+def serve_tile(layer, z, x, y):
+    db = _connection()
+    if db is None or layer not in LAYERS:
+        abort(404)
+    if not store_is_current(db):
+        # don't let clients cache tiles of data that is no longer served
+        response = Response("tile store is outdated", status=503)
+        response.headers["Retry-After"] = str(RETRY_AFTER)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    row = db.execute(
+        "SELECT body, etag FROM tiles WHERE layer = ? AND z = ? AND x = ? AND y = ?",
+        (layer, z, x, y),
+    ).fetchone()
+    if row is None:
+        # no points there (or outside the pyramid): nothing to draw
+        response = Response(status=204)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        return response
+
+    body, etag = row
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif "gzip" in request.headers.get("Accept-Encoding", ""):
+        response = Response(body, mimetype="application/geo+json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(gzip.decompress(body), mimetype="application/geo+json")
+
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def register_tile_routes(app):
+    """
+    Add the /tiles/<layer>/<z>/<x>/<y>.json route to the app's Flask server.
+    """
+    prefix = app.config.routes_pathname_prefix
+    app.server.add_url_rule(
+        f"{prefix}tiles/<layer>/<int:z>/<int:x>/<int:y>.json",
+        "tiles", serve_tile, methods=["GET"],
+    )
+
+
+if __name__ == "__main__":
+    started = time.time()
+    counts = build_tiles()
+    for layer, n in counts.items():
+        print(f"{layer:12s} {n:8d} tiles")
+    print(f"{TILE_DB}: {os.path.getsize(TILE_DB) / 1e6:.2f} MB in {time.time() - started:.1f}s", file=sys.stderr)
@@ -1,5 +1,10 @@
 # this file will contain any helper code
 
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
 def point_in_ring(lon, lat, ring):
     """
     Return True if (lon, lat) is inside a polygon ring (list of [lon, lat] points).
@@ -36,4 +41,979 @@ def point_in_district(lon, lat, rings):
     for ring in rings:
         if point_in_ring(lon, lat, ring):
             return True
-    return False
\ No newline at end of file
+    return False
+
+
+# -------------------------------------------------------------
+# VECTORIZED POINT-IN-POLYGON
+# -------------------------------------------------------------
+
+# max number of point x edge pairs evaluated at once (bounds memory use)
+_PIP_CHUNK = 1 << 22
+
+
+def expand_ranges(starts, counts):
+    """
+    Return the concatenation of range(s, s + c) for every (s, c) pair,
+    e.g. expand_ranges([0, 10], [2, 3]) -> [0, 1, 10, 11, 12].
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+def points_in_ring(lons, lats, ring):
+    """
+    Vectorized version of point_in_ring.
+    Return a boolean array, True where (lons[i], lats[i]) is inside the ring.
+    Uses the same ray casting rule, so results match point_in_ring exactly.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    inside = np.zeros(lons.shape, dtype=bool)
+
+    ring = np.asarray(ring, dtype=float)
+    if len(ring) < 3:
+        return inside
+    ring = ring[:, :2]
+
+    # Points outside the ring's bounding box can never be inside
+    x_min, y_min = ring.min(axis=0)
+    x_max, y_max = ring.max(axis=0)
+    candidates = np.flatnonzero(
+        (lons >= x_min) & (lons <= x_max) & (lats >= y_min) & (lats <= y_max)
+    )
+    if len(candidates) == 0:
+        return inside
+
+    # Edges (x1, y1) -> (x2, y2), including the closing edge
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+
+    # Horizontal edges never cross the ray; dropping them also avoids 0 / 0
+    keep = y1 != y2
+    x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+
+    # An edge can only cross the ray of points with min(y1, y2) <= y < max(y1, y2),
+    # which is a contiguous range once the candidates are sorted by latitude
+    order = np.argsort(lats[candidates], kind="stable")
+    cand = candidates[order]
+    ys = lats[cand]
+    lo = np.searchsorted(ys, np.minimum(y1, y2), side="left")
+    hi = np.searchsorted(ys, np.maximum(y1, y2), side="left")
+    span = hi - lo
+
+    crossings = np.zeros(len(cand), dtype=np.int64)
+    cum = np.cumsum(span)
+    edge_start = 0
+    while edge_start < len(span):
+        # Take as many edges as fit in one chunk of (edge, point) pairs
+        base = cum[edge_start] - span[edge_start]
+        edge_end = max(
+            edge_start + 1,
+            int(np.searchsorted(cum, base + _PIP_CHUNK, side="right")),
+        )
+        counts = span[edge_start:edge_end]
+        if counts.sum():
+            edge = np.repeat(np.arange(edge_start, edge_end), counts)
+            pos = expand_ranges(lo[edge_start:edge_end], counts)
+            x = lons[cand[pos]]
+            y = ys[pos]
+
+            # Same expression as point_in_ring so the rounding is identical
+            x_int = x1[edge] + (y - y1[edge]) * (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+            crossings += np.bincount(pos[x_int > x], minlength=len(cand))
+        edge_start = edge_end
+
+    inside[cand] = crossings % 2 == 1
+    return inside
+
+
+def points_in_polygon(lons, lats, polygon):
+    """
+    Return a boolean array, True where the point is inside a GeoJSON polygon
+    (first ring is the exterior, any further rings are holes).
+    """
+    if not polygon:
+        return np.zeros(np.shape(lons), dtype=bool)
+
+    inside = points_in_ring(lons, lats, polygon[0])
+    for hole in polygon[1:]:
+        if not inside.any():
+            break
+        inside &= ~points_in_ring(lons, lats, hole)
+    return inside
+
+
+def points_in_geometry(lons, lats, geometry):
+    """
+    Return a boolean array, True where the point is inside a GeoJSON
+    Polygon or MultiPolygon geometry (holes included).
+    """
+    inside = np.zeros(np.shape(lons), dtype=bool)
+    if not geometry:
+        return inside
+
+    gtype = geometry.get("type")
+    coords = geometry.get("coordinates") or []
+
+    if gtype == "Polygon":
+        polygons = [coords]
+    elif gtype == "MultiPolygon":
+        polygons = coords
+    else:
+        return inside
+
+    for polygon in polygons:
+        inside |= points_in_polygon(lons, lats, polygon)
+    return inside
+
+
+def assign_regions(lons, lats, geometries, missing=-1):
+    """
+    Return an integer region code per point: the position of the first
+    geometry in `geometries` that contains the point, or `missing` if none
+    does (points with NaN coordinates are always `missing`).
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    codes = np.full(lons.shape, missing, dtype=np.int32)
+
+    # Only test points that have not been claimed yet (first match wins)
+    todo = np.flatnonzero(~(np.isnan(lons) | np.isnan(lats)))
+
+    for code, geometry in enumerate(geometries):
+        if len(todo) == 0:
+            break
+        hit = points_in_geometry(lons[todo], lats[todo], geometry)
+        codes[todo[hit]] = code
+        todo = todo[~hit]
+
+    return codes
+
+
+# -------------------------------------------------------------
+# SPATIAL INDEX FOR REGION LOOKUP
+# -------------------------------------------------------------
+
+def geometry_bounds(geometry):
+    """
+    Return (lon_min, lat_min, lon_max, lat_max) of a GeoJSON Polygon or
+    MultiPolygon geometry, or None if it has no coordinates.
+    """
+    if not geometry:
+        return None
+
+    gtype = geometry.get("type")
+    coords = geometry.get("coordinates") or []
+    if gtype == "Polygon":
+        rings = coords
+    elif gtype == "MultiPolygon":
+        rings = [ring for polygon in coords for ring in polygon]
+    else:
+        return None
+
+    rings = [np.asarray(ring, dtype=float)[:, :2] for ring in rings if len(ring)]
+    if not rings:
+        return None
+
+    points = np.concatenate(rings)
+    lon_min, lat_min = points.min(axis=0)
+    lon_max, lat_max = points.max(axis=0)
+    return lon_min, lat_min, lon_max, lat_max
+
+
+class RegionIndex:
+    """
+    Spatial index over the polygons of a FeatureCollection.
+
+    Each polygon's bounding box is registered in the cells of a uniform grid
+    it overlaps, so a point is only tested against the few polygons whose
+    boxes contain it. locate() returns, per point, the position of the first
+    containing feature (same rule as assign_regions) or -1.
+    """
+
+    def __init__(self, geometries, keys=None, grid_size=64):
+        self.geometries = list(geometries)
+        n = len(self.geometries)
+        self.keys = list(keys) if keys is not None else list(range(n))
+
+        # Per-polygon bounding boxes (empty geometries get an empty box)
+        bounds = [geometry_bounds(g) for g in self.geometries]
+        self.bboxes = np.array(
+            [b if b is not None else (np.inf, np.inf, -np.inf, -np.inf) for b in bounds],
+            dtype=float,
+        ).reshape(n, 4)
+
+        valid = np.isfinite(self.bboxes).all(axis=1)
+        if valid.any():
+            self.extent = (
+                self.bboxes[valid, 0].min(),
+                self.bboxes[valid, 1].min(),
+                self.bboxes[valid, 2].max(),
+                self.bboxes[valid, 3].max(),
+            )
+        else:
+            self.extent = (0.0, 0.0, 0.0, 0.0)
+
+        self.grid_size = grid_size
+        lon_min, lat_min, lon_max, lat_max = self.extent
+        self.cell_w = max(lon_max - lon_min, 1e-12) / grid_size
+        self.cell_h = max(lat_max - lat_min, 1e-12) / grid_size
+
+        # Grid cell -> polygons whose bbox overlaps it, stored CSR style
+        # (cell_ptr[c]:cell_ptr[c + 1] slices cell_polys), polygons in order
+        cells, polys = [], []
+        for code in np.flatnonzero(valid):
+            ix0, iy0 = self._cell_xy(self.bboxes[code, 0], self.bboxes[code, 1])
+            ix1, iy1 = self._cell_xy(self.bboxes[code, 2], self.bboxes[code, 3])
+            gx, gy = np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1))
+            covered = (gy * grid_size + gx).ravel()
+            cells.append(covered)
+            polys.append(np.full(len(covered), code))
+
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=int)
+        polys = np.concatenate(polys) if polys else np.empty(0, dtype=int)
+        order = np.lexsort((polys, cells))
+        self.cell_polys = polys[order].astype(np.int32)
+        self.cell_ptr = np.zeros(grid_size * grid_size + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(cells, minlength=grid_size * grid_size),
+            out=self.cell_ptr[1:],
+        )
+
+    @classmethod
+    def from_geojson(cls, geojson, key=None, grid_size=64):
+        """
+        Build an index from a GeoJSON FeatureCollection dict. If `key` is
+        given, index.keys holds that property of each feature.
+        """
+        features = geojson.get("features", [])
+        geometries = [feat.get("geometry") for feat in features]
+        keys = None
+        if key is not None:
+            keys = [feat.get("properties", {}).get(key) for feat in features]
+        return cls(geometries, keys=keys, grid_size=grid_size)
+
+    def _cell_xy(self, lons, lats):
+        ix = np.floor((np.asarray(lons) - self.extent[0]) / self.cell_w)
+        iy = np.floor((np.asarray(lats) - self.extent[1]) / self.cell_h)
+        last = self.grid_size - 1
+        return (
+            np.clip(ix, 0, last).astype(np.int64),
+            np.clip(iy, 0, last).astype(np.int64),
+        )
+
+    def __len__(self):
+        return len(self.geometries)
+
+    @property
+    def nbytes(self):
+        # the index arrays; the geometries are shared with their GeoJSON
+        return self.bboxes.nbytes + self.cell_polys.nbytes + self.cell_ptr.nbytes
+
+    def locate(self, lons, lats, missing=-1):
+        """
+        Return an int32 array with the feature position containing each point,
+        or `missing` for points outside every feature (or with NaN coordinates).
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        codes = np.full(lons.shape, missing, dtype=np.int32)
+
+        lon_min, lat_min, lon_max, lat_max = self.extent
+        pts = np.flatnonzero(
+            (lons >= lon_min) & (lons <= lon_max)
+            & (lats >= lat_min) & (lats <= lat_max)
+        )
+        if len(pts) == 0:
+            return codes
+
+        # Expand every point into (point, candidate polygon) pairs via its cell
+        ix, iy = self._cell_xy(lons[pts], lats[pts])
+        cell = iy * self.grid_size + ix
+        starts = self.cell_ptr[cell]
+        counts = self.cell_ptr[cell + 1] - starts
+        if counts.sum() == 0:
+            return codes
+
+        pair_pts = np.repeat(pts, counts)
+        pair_polys = self.cell_polys[expand_ranges(starts, counts)]
+
+        # Drop pairs whose point falls outside the polygon's own bbox
+        box = self.bboxes[pair_polys]
+        px, py = lons[pair_pts], lats[pair_pts]
+        keep = (px >= box[:, 0]) & (px <= box[:, 2]) & (py >= box[:, 1]) & (py <= box[:, 3])
+        pair_pts, pair_polys = pair_pts[keep], pair_polys[keep]
+
+        # Test polygons in feature order so the first match wins
+        order = np.argsort(pair_polys, kind="stable")
+        pair_pts, pair_polys = pair_pts[order], pair_polys[order]
+        poly_ids, poly_starts = np.unique(pair_polys, return_index=True)
+        poly_ends = np.append(poly_starts[1:], len(pair_polys))
+
+        for code, start, end in zip(poly_ids, poly_starts, poly_ends):
+            cand = pair_pts[start:end]
+            cand = cand[codes[cand] == missing]
+            if len(cand) == 0:
+                continue
+            hit = points_in_geometry(lons[cand], lats[cand], self.geometries[code])
+            codes[cand[hit]] = code
+
+        return codes
+
+
+# -------------------------------------------------------------
+# SORTED-GRID INDEX FOR VIEWPORT QUERIES
+# -------------------------------------------------------------
+
+class PointGrid:
+    """
+    Spatial index over point coordinates for rectangle (viewport) queries.
+
+    Points are sorted by the cell of a uniform grid they fall in (row-major),
+    with cell_ptr[c]:cell_ptr[c + 1] the sorted positions of cell c. The cells
+    of one grid row inside a rectangle are contiguous, so a query is one slice
+    per row plus an exact bounds check on the points in those slices.
+    """
+
+    def __init__(self, lons, lats, cell_size=0.005):
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        rows = np.flatnonzero(np.isfinite(lons) & np.isfinite(lats))
+
+        self.cell_size = cell_size
+        if len(rows):
+            self.lon0 = lons[rows].min()
+            self.lat0 = lats[rows].min()
+            self.nx = int((lons[rows].max() - self.lon0) // cell_size) + 1
+            self.ny = int((lats[rows].max() - self.lat0) // cell_size) + 1
+        else:
+            self.lon0 = self.lat0 = 0.0
+            self.nx = self.ny = 1
+
+        ix = ((lons[rows] - self.lon0) // cell_size).astype(np.int64)
+        iy = ((lats[rows] - self.lat0) // cell_size).astype(np.int64)
+        cell = iy * self.nx + ix
+        order = np.argsort(cell, kind="stable")
+
+        # original row of each sorted point, and the sorted coordinates
+        self.rows = rows[order]
+        self.lons = lons[self.rows]
+        self.lats = lats[self.rows]
+        self.cell_ptr = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.nx * self.ny), out=self.cell_ptr[1:])
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.lons.nbytes + self.lats.nbytes + self.cell_ptr.nbytes
+
+    def query(self, lon_min, lat_min, lon_max, lat_max):
+        """
+        Return the (sorted) original row positions of the points inside the
+        rectangle, bounds included.
+        """
+        c0 = max(int((lon_min - self.lon0) // self.cell_size), 0)
+        c1 = min(int((lon_max - self.lon0) // self.cell_size), self.nx - 1)
+        r0 = max(int((lat_min - self.lat0) // self.cell_size), 0)
+        r1 = min(int((lat_max - self.lat0) // self.cell_size), self.ny - 1)
+        if c0 > c1 or r0 > r1:
+            return np.empty(0, dtype=np.int64)
+
+        row_cells = np.arange(r0, r1 + 1) * self.nx
+        starts = self.cell_ptr[row_cells + c0]
+        ends = self.cell_ptr[row_cells + c1 + 1]
+        pos = expand_ranges(starts, ends - starts)
+
+        lons, lats = self.lons[pos], self.lats[pos]
+        inside = (lons >= lon_min) & (lons <= lon_max) & (lats >= lat_min) & (lats <= lat_max)
+        return np.sort(self.rows[pos[inside]])
+
+
+# -------------------------------------------------------------
+# FILTER INDEX (ROW POSITIONS PER CATEGORY VALUE)
+# -------------------------------------------------------------
+
+class FilterIndex:
+    """
+    Sorted row positions of every value of some categorical columns, so a
+    selection like boroughs in [...] AND room_type in [...] is answered from
+    the position arrays (cost ~ the selected rows) instead of scanning and
+    copying the whole frame.
+    """
+
+    def __init__(self, df, columns):
+        self.n = len(df)
+        self.positions = {}
+        for col in columns:
+            values = df[col]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype("category")
+            categories = values.cat.categories
+            codes = values.cat.codes.to_numpy()
+
+            # group row numbers by code; missing values (code -1) sort first
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+            self.positions[col] = {
+                value: order[bounds[i]:bounds[i + 1]]
+                for i, value in enumerate(categories)
+            }
+
+    @property
+    def nbytes(self):
+        return sum(
+            rows.nbytes for positions in self.positions.values() for rows in positions.values()
+        )
+
+    def rows(self, column, values):
+        """
+        Positions of the rows whose `column` is any of `values` (OR).
+        """
+        if isinstance(values, str):
+            values = [values]
+        index = self.positions[column]
+        parts = [index[v] for v in dict.fromkeys(values) if v in index]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        # rows of different values of one column never overlap
+        return np.sort(np.concatenate(parts))
+
+    def select(self, within=None, **criteria):
+        """
+        Positions of the rows matching every criterion (AND), each criterion
+        being column=values (OR within a column). Empty or None values don't
+        filter. `within` restricts the result to those (sorted) positions.
+        """
+        selected = [self.rows(col, values) for col, values in criteria.items() if values]
+        if within is not None:
+            selected.append(np.asarray(within))
+        if not selected:
+            return np.arange(self.n)
+
+        selected.sort(key=len)
+        result = selected[0]
+        for rows in selected[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, rows, assume_unique=True)
+        return result
+
+
+# -------------------------------------------------------------
+# PROXIMITY QUERIES IN METERS
+# -------------------------------------------------------------
+# Points are projected onto a local plane (equirectangular around the layer's
+# mean latitude, so 1 unit = 1 m in both directions) and indexed with a
+# KD-tree; the distances returned are great-circle (haversine) distances of
+# the pairs found. Over NYC the plane is within ~0.5% of the true distance,
+# unlike raw degrees, where a degree of longitude is only ~0.76 of a degree
+# of latitude.
+
+EARTH_RADIUS_M = 6_371_008.8
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    """
+    Great-circle distance in meters (vectorized).
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(v, dtype=float)) for v in (lon1, lat1, lon2, lat2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class ProximityIndex:
+    """
+    k-nearest and within-radius queries (in meters) against a point layer,
+    e.g. subway stations or affordable housing projects.
+    """
+
+    def __init__(self, lons, lats, lat0=None):
+        self.lons = np.asarray(lons, dtype=float)
+        self.lats = np.asarray(lats, dtype=float)
+        valid = np.isfinite(self.lons) & np.isfinite(self.lats)
+        self.lat0 = float(np.mean(self.lats[valid])) if lat0 is None else lat0
+
+        # rows of the layer with coordinates; the tree is built over those
+        self.rows = np.flatnonzero(valid)
+        self.tree = cKDTree(self.project(self.lons[valid], self.lats[valid]))
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        # layer coordinates plus the tree's copy of the points and its order
+        return (
+            self.lons.nbytes + self.lats.nbytes + self.rows.nbytes
+            + self.tree.data.nbytes + self.tree.indices.nbytes
+        )
+
+    def project(self, lons, lats):
+        """
+        (n, 2) plane coordinates in meters.
+        """
+        scale = np.radians(1.0) * EARTH_RADIUS_M
+        x = np.asarray(lons, dtype=float) * scale * np.cos(np.radians(self.lat0))
+        y = np.asarray(lats, dtype=float) * scale
+        return np.column_stack([x, y])
+
+    def nearest(self, lons, lats, k=1):
+        """
+        Distances (m) to and layer rows of the k nearest points of every query
+        point, shaped (n,) for k=1 and (n, k) otherwise. Query points without
+        coordinates (or missing neighbours) get inf and -1.
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        n = len(lons)
+        dist = np.full((n, k), np.inf)
+        idx = np.full((n, k), -1, dtype=np.int64)
+
+        ok = np.flatnonzero(np.isfinite(lons) & np.isfinite(lats))
+        if len(ok) and len(self.rows):
+            # a couple of extra candidates from the plane, ranked by the
+            # exact distance, so near-ties resolve like the sphere would
+            kq = k + 2
+            _, found = self.tree.query(self.project(lons[ok], lats[ok]), k=kq)
+            found = found.reshape(len(ok), kq)
+            hit = found < len(self.rows)
+            rows = self.rows[np.minimum(found, len(self.rows) - 1)]
+
+            q = np.repeat(ok, kq).reshape(len(ok), kq)
+            d = haversine_m(lons[q], lats[q], self.lons[rows], self.lats[rows])
+            d = np.where(hit, d, np.inf)
+            best = np.argsort(d, axis=1, kind="stable")[:, :k]
+            d = np.take_along_axis(d, best, axis=1)
+            rows = np.take_along_axis(rows, best, axis=1)
+            dist[ok] = d
+            idx[ok] = np.where(np.isfinite(d), rows, -1)
+
+        if k == 1:
+            return dist[:, 0], idx[:, 0]
+        return dist, idx
+
+    def within(self, lons, lats, radius):
+        """
+        Every layer point within `radius` meters of each query point, as CSR:
+        (ptr, rows, distances), the neighbours of query i being
+        rows[ptr[i]:ptr[i + 1]] (sorted by distance).
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        n = len(lons)
+
+        ok = np.flatnonzero(np.isfinite(lons) & np.isfinite(lats))
+        if len(ok) and len(self.rows):
+            query = cKDTree(self.project(lons[ok], lats[ok]))
+            # small margin for the plane approximation, exact check below
+            pairs = query.sparse_distance_matrix(
+                self.tree, radius * 1.01, output_type="ndarray"
+            )
+            q = ok[pairs["i"]]
+            rows = self.rows[pairs["j"]]
+        else:
+            q = rows = np.empty(0, dtype=np.int64)
+
+        dist = haversine_m(lons[q], lats[q], self.lons[rows], self.lats[rows])
+        keep = dist <= radius
+        q, rows, dist = q[keep], rows[keep], dist[keep]
+
+        order = np.lexsort((dist, q))
+        ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(q, minlength=n), out=ptr[1:])
+        return ptr, rows[order].astype(np.int64), dist[order]
+
+    def count_within(self, lons, lats, radius):
+        """
+        Number of layer points within `radius` meters of each query point.
+        """
+        ptr, _, _ = self.within(lons, lats, radius)
+        return np.diff(ptr)
+
+
+def sorted_segment_quantile(values, ptr, q):
+    """
+    Quantile q of every CSR segment values[ptr[i]:ptr[i + 1]], the values of
+    each segment already sorted; linear interpolation like Series.quantile.
+    Empty segments give NaN.
+    """
+    starts = ptr[:-1]
+    counts = np.diff(ptr)
+    out = np.full(len(counts), np.nan)
+    has = counts > 0
+
+    pos = (counts[has] - 1) * q
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    v_lo = values[starts[has] + lo]
+    v_hi = values[starts[has] + hi]
+    out[has] = v_lo + (v_hi - v_lo) * (pos - lo)
+    return out
+
+
+# -------------------------------------------------------------
+# SCATTER DOWNSAMPLING AND TRENDLINES
+# -------------------------------------------------------------
+
+def stratified_sample(x, y, budget, strata=None, bins=None, seed=0):
+    """
+    Sorted positions of ~budget points of (x, y), drawn per cell of a
+    bins x bins grid over the data (and per `strata` code, if given) in
+    proportion to the cell's count, so the sample keeps the shape of the point
+    density. Every non-empty cell keeps at least one point, so sparse areas
+    and outliers stay visible; by default the grid is sized so those extra
+    points stay within a quarter of the budget.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= budget:
+        return np.arange(n)
+    if bins is None:
+        n_strata = 1 if strata is None else len(np.unique(strata))
+        bins = max(4, int(np.sqrt(budget / (4 * n_strata))))
+
+    def cell(v):
+        lo, hi = v.min(), v.max()
+        width = (hi - lo) / bins or 1.0
+        return np.minimum(((v - lo) / width).astype(np.int64), bins - 1)
+
+    key = cell(y) * bins + cell(x)
+    if strata is not None:
+        key = key + np.asarray(strata, dtype=np.int64) * bins * bins
+    cells, inverse, counts = np.unique(key, return_inverse=True, return_counts=True)
+
+    # quota per cell: its share of the budget, at least 1
+    quota = np.maximum(1, np.floor(counts * (budget / n))).astype(np.int64)
+
+    # random order within each cell, keep the first `quota` of it
+    rank_key = np.random.default_rng(seed).random(n)
+    order = np.lexsort((rank_key, inverse))
+    starts = np.cumsum(counts) - counts
+    rank = np.arange(n) - np.repeat(starts, counts)
+    return np.sort(order[rank < np.repeat(quota, counts)])
+
+
+def group_moments(x, y, groups, n_groups):
+    """
+    Sufficient statistics of a least-squares line per group: a dict of arrays
+    n, sx, sy, sxx, sxy, xmin, xmax (one entry per group code).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    moments = {
+        "n": np.bincount(groups, minlength=n_groups).astype(np.float64),
+        "sx": np.bincount(groups, weights=x, minlength=n_groups),
+        "sy": np.bincount(groups, weights=y, minlength=n_groups),
+        "sxx": np.bincount(groups, weights=x * x, minlength=n_groups),
+        "sxy": np.bincount(groups, weights=x * y, minlength=n_groups),
+        "xmin": np.full(n_groups, np.inf),
+        "xmax": np.full(n_groups, -np.inf),
+    }
+    np.minimum.at(moments["xmin"], groups, x)
+    np.maximum.at(moments["xmax"], groups, x)
+    return moments
+
+
+def fit_line(moments, i):
+    """
+    (slope, intercept) of group i's least-squares line (same as
+    np.polyfit(x, y, 1)), or None with fewer than 2 distinct x values.
+    """
+    n, sx, sy = moments["n"][i], moments["sx"][i], moments["sy"][i]
+    denom = n * moments["sxx"][i] - sx * sx
+    if n < 2 or denom <= 1e-9 * n * moments["sxx"][i]:
+        return None
+    slope = (n * moments["sxy"][i] - sx * sy) / denom
+    return slope, (sy - slope * sx) / n
+
+
+# -------------------------------------------------------------
+# BOUNDARY SIMPLIFICATION (SHARED-ARC, TOPOLOGY PRESERVING)
+# -------------------------------------------------------------
+# Coordinates are first snapped to a 10^-decimals degree grid, so a border
+# shared by two regions has exactly the same vertices on both sides. Rings are
+# then cut into arcs wherever the set of rings using an edge changes, and
+# every distinct arc is simplified once (Douglas-Peucker, endpoints fixed).
+# Both neighbours reuse the same simplified arc, so no gaps or overlaps
+# open up between adjacent regions.
+
+def douglas_peucker(points, tolerance):
+    """
+    Boolean mask of the points of an (n, 2) polyline kept by Douglas-Peucker
+    at `tolerance` (same units as the points). The endpoints are always kept.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n < 3 or tolerance <= 0:
+        keep[:] = True
+        return keep
+
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+
+        a = points[i]
+        seg = points[i + 1:j] - a
+        d = points[j] - a
+        length = np.hypot(d[0], d[1])
+        if length == 0:
+            dist = np.hypot(seg[:, 0], seg[:, 1])
+        else:
+            dist = np.abs(d[0] * seg[:, 1] - d[1] * seg[:, 0]) / length
+
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return keep
+
+
+def _polygons(geometry):
+    if not geometry:
+        return []
+    if geometry.get("type") == "Polygon":
+        return [geometry.get("coordinates") or []]
+    if geometry.get("type") == "MultiPolygon":
+        return geometry.get("coordinates") or []
+    return []
+
+
+def _quantize_ring(ring, scale):
+    # open ring of integer grid points without repeated consecutive points
+    pts = np.rint(np.asarray(ring, dtype=float)[:, :2] * scale).astype(np.int64)
+    if len(pts) > 1:
+        pts = pts[np.any(pts != np.roll(pts, 1, axis=0), axis=1)]
+    return pts
+
+
+def _ring_arcs(rings):
+    """
+    Split rings (open integer arrays) into arcs. Returns the distinct arcs
+    and, per ring, a list of (arc index, reversed) making it up.
+    """
+    # which rings use each (undirected) edge
+    edge_rings = {}
+    ring_edges = []
+    for r, pts in enumerate(rings):
+        tup = list(map(tuple, pts.tolist()))
+        nxt = tup[1:] + tup[:1]
+        edges = [(p, q) if p < q else (q, p) for p, q in zip(tup, nxt)]
+        for e in edges:
+            edge_rings.setdefault(e, set()).add(r)
+        ring_edges.append((tup, edges))
+
+    arcs = []
+    arc_ids = {}
+    ring_parts = []
+    for tup, edges in ring_edges:
+        n = len(tup)
+        if n < 3:
+            ring_parts.append([])
+            continue
+
+        sig = [frozenset(edge_rings[e]) for e in edges]
+        # vertex i is a junction if its incoming and outgoing edges differ
+        junctions = [i for i in range(n) if sig[i - 1] != sig[i]]
+        if not junctions:
+            junctions = [min(range(n), key=tup.__getitem__)]
+
+        parts = []
+        for s, start in enumerate(junctions):
+            end = junctions[(s + 1) % len(junctions)]
+            if end <= start:
+                end += n
+            arc = tuple(tup[i % n] for i in range(start, end + 1))
+            rev = arc[::-1]
+            canon, flipped = (arc, False) if arc <= rev else (rev, True)
+            if canon not in arc_ids:
+                arc_ids[canon] = len(arcs)
+                arcs.append(canon)
+            parts.append((arc_ids[canon], flipped))
+        ring_parts.append(parts)
+
+    return arcs, ring_parts
+
+
+def simplify_geojson(geojson, key, tolerances, decimals=5):
+    """
+    Return one simplified copy of a FeatureCollection per tolerance (degrees;
+    0 = quantize only). Coordinates are rounded to `decimals` and each feature
+    keeps only its `key` property. Rings that collapse are dropped, except that
+    a feature never loses all of its polygons.
+    """
+    scale = 10 ** decimals
+    step = 1.0 / scale
+
+    # flatten every ring once: (feature, polygon, ring) -> open int array
+    layout = []
+    rings = []
+    for f, feature in enumerate(geojson.get("features", [])):
+        for p, polygon in enumerate(_polygons(feature.get("geometry"))):
+            for ring in polygon:
+                if len(ring):
+                    layout.append((f, p))
+                    rings.append(_quantize_ring(ring, scale))
+
+    arcs, ring_parts = _ring_arcs(rings)
+    arc_points = [np.array(arc, dtype=np.int64) for arc in arcs]
+
+    results = []
+    for tolerance in tolerances:
+        kept = [
+            pts[douglas_peucker(pts, tolerance * scale)] for pts in arc_points
+        ]
+
+        polygons = {}
+        for (f, p), parts, original in zip(layout, ring_parts, rings):
+            if parts:
+                pieces = [kept[a][::-1] if flipped else kept[a] for a, flipped in parts]
+                ring = np.concatenate([piece[:-1] for piece in pieces])
+            else:
+                ring = original
+            polygons.setdefault(f, {}).setdefault(p, []).append(
+                (ring, len(np.unique(ring, axis=0)) >= 3, original)
+            )
+
+        features = []
+        for f, feature in enumerate(geojson.get("features", [])):
+            coords = []
+            for p, poly_rings in sorted(polygons.get(f, {}).items()):
+                exterior, ok, _ = poly_rings[0]
+                if not ok:
+                    continue
+                coords.append([r for r, ok, _ in poly_rings if ok])
+            if not coords and f in polygons:
+                # everything collapsed: keep the (quantized) original shape
+                coords = [[orig for _, _, orig in poly_rings]
+                          for _, poly_rings in sorted(polygons[f].items())]
+
+            coords = [
+                [np.round(np.vstack([r, r[:1]]) * step, decimals).tolist() for r in polygon]
+                for polygon in coords
+            ]
+            features.append({
+                "type": "Feature",
+                "properties": {key: feature.get("properties", {}).get(key)},
+                "geometry": {"type": "MultiPolygon", "coordinates": coords}
+                if len(coords) != 1 else {"type": "Polygon", "coordinates": coords[0]},
+            })
+
+        results.append({"type": "FeatureCollection", "features": features})
+    return results
+
+
+# -------------------------------------------------------------
+# STREAMING PER-GROUP MEDIANS
+# -------------------------------------------------------------
+# The running state is a count per (group keys..., value). Medians are exact
+# while that state stays under max_state rows; past that every value is folded
+# into a log-spaced bucket (a DDSketch-style quantile sketch: mergeable by
+# adding counts, relative error <= alpha), which bounds the state by
+# groups x distinct buckets instead of groups x distinct values.
+
+def sketch_bucket(values, alpha):
+    """
+    Log-spaced bucket index of each value (values <= 0 share bucket 0).
+    """
+    gamma = (1 + alpha) / (1 - alpha)
+    values = np.asarray(values, dtype=float)
+    buckets = np.zeros(values.shape, dtype=np.int64)
+    pos = values > 0
+    buckets[pos] = np.ceil(np.log(values[pos]) / np.log(gamma)).astype(np.int64) + 1
+    return buckets
+
+
+def sketch_value(buckets, alpha):
+    """
+    Representative value of each bucket (within alpha of every value in it).
+    """
+    gamma = (1 + alpha) / (1 - alpha)
+    buckets = np.asarray(buckets, dtype=float)
+    return np.where(
+        buckets > 0, 2 * gamma ** (buckets - 1) / (gamma + 1), 0.0
+    )
+
+
+def weighted_group_medians(counts):
+    """
+    Median per group from a Series of counts indexed by (keys..., value):
+    the same result as Series.median() over the expanded values (the mean of
+    the two middle values when a group has an even count).
+    """
+    counts = counts[counts > 0].sort_index()
+    group_levels = list(range(counts.index.nlevels - 1))
+    values = counts.index.get_level_values(-1).to_numpy(dtype=float)
+    n = counts.to_numpy()
+
+    cum_end = counts.groupby(level=group_levels, sort=False).cumsum().to_numpy()
+    cum_start = cum_end - n
+    total = counts.groupby(level=group_levels, sort=False).transform("sum").to_numpy()
+
+    lo = (total - 1) // 2
+    hi = total // 2
+    lo_rows = (cum_start <= lo) & (lo < cum_end)
+    hi_rows = (cum_start <= hi) & (hi < cum_end)
+
+    medians = (values[lo_rows] + values[hi_rows]) / 2
+    keys = counts.index[lo_rows].droplevel(-1)
+    return pd.Series(medians, index=keys)
+
+
+def stream_group_medians(chunks, keys, value, max_state=5_000_000, alpha=0.005):
+    """
+    Median of `value` per group of `keys`, consuming an iterable of DataFrame
+    chunks (e.g. pd.read_csv(..., chunksize=...)) without holding the whole
+    file. Returns (DataFrame of keys + median column, exact) where exact is
+    False if the state outgrew max_state rows and medians come from the sketch.
+    """
+    state = None
+    exact = True
+
+    for chunk in chunks:
+        chunk = chunk.dropna(subset=[value])
+        if not exact:
+            chunk = chunk.assign(**{value: sketch_bucket(chunk[value], alpha)})
+
+        part = chunk.groupby(keys + [value], sort=False).size()
+        if state is None:
+            state = part
+        else:
+            levels = list(range(len(keys) + 1))
+            state = pd.concat([state, part]).groupby(level=levels, sort=False).sum()
+
+        if exact and len(state) > max_state:
+            # fold the exact state into sketch buckets and keep going
+            exact = False
+            frame = state.rename("n").reset_index()
+            frame[value] = sketch_bucket(frame[value], alpha)
+            state = frame.groupby(keys + [value], sort=False)["n"].sum()
+
+    if state is None:
+        return pd.DataFrame(columns=keys + [value]), exact
+
+    if not exact:
+        # bucket indices -> representative values (monotonic, so the order
+        # inside every group is unchanged)
+        frame = state.rename("n").reset_index()
+        frame[value] = sketch_value(frame[value], alpha)
+        state = frame.set_index(keys + [value])["n"]
+
+    medians = weighted_group_medians(state)
+    return medians.rename(value).reset_index(), exact
@@ -0,0 +1,145 @@
+# this file decides what the Airbnb listing layers show for the current view
+#
+# the maps report their view through relayoutData; we turn that into a padded
+# "window" snapped to a coarse grid (so small pans don't trigger new figures)
+# and look up the listings inside it with the PointGrid index. If more than
+# POINT_BUDGET listings are visible they are aggregated into grid cells
+# (~BIN_PX screen pixels wide), otherwise the raw points are sent.
+
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+import figures
+
+# max number of raw points sent for one window
+POINT_BUDGET = int(os.environ.get("AIRBNB_POINT_BUDGET", 20_000))
+
+BIN_PX = 16           # aggregation cell size on screen
+TILE_PX = 512         # mapbox tile size (zoom z = 2^z tiles around the world)
+VIEW_PX = (1600, 900) # assumed map size when the browser gives no bounds
+NYC_CENTER = {"lat": 40.7128, "lon": -74.0060}
+
+
+def degrees_per_px(zoom):
+    # longitude degrees per screen pixel (latitude: times cos(lat))
+    return 360.0 / (TILE_PX * 2 ** zoom)
+
+
+def _window(lon_min, lat_min, lon_max, lat_max, zoom):
+    # pad by half a tile on each side and snap outward to half-tile steps
+    zoom = max(0.0, min(22.0, math.floor(zoom * 2) / 2))
+    step = degrees_per_px(zoom) * TILE_PX / 2
+    bounds = [
+        math.floor(lon_min / step - 1) * step,
+        math.floor(lat_min / step - 1) * step,
+        math.ceil(lon_max / step + 1) * step,
+        math.ceil(lat_max / step + 1) * step,
+    ]
+    return {"zoom": zoom, "bounds": [round(b, 6) for b in bounds]}
+
+
+def default_window(zoom, center=NYC_CENTER):
+    """
+    Window of a map at `zoom` around `center`, assuming a VIEW_PX sized map.
+    """
+    half_w = VIEW_PX[0] / 2 * degrees_per_px(zoom)
+    half_h = VIEW_PX[1] / 2 * degrees_per_px(zoom) * math.cos(math.radians(center["lat"]))
+    return _window(
+        center["lon"] - half_w, center["lat"] - half_h,
+        center["lon"] + half_w, center["lat"] + half_h,
+        zoom,
+    )
+
+
+def view_window(relayout_data):
+    """
+    Window for a map's relayoutData, or None if it carries no mapbox view.
+    """
+    relayout_data = relayout_data or {}
+    zoom = relayout_data.get("mapbox.zoom")
+    if zoom is None:
+        return None
+
+    corners = (relayout_data.get("mapbox._derived") or {}).get("coordinates")
+    if corners:
+        lons = [c[0] for c in corners]
+        lats = [c[1] for c in corners]
+        return _window(min(lons), min(lats), max(lons), max(lats), zoom)
+
+    return default_window(zoom, relayout_data.get("mapbox.center") or NYC_CENTER)
+
+
+def window_key(window):
+    return (window["zoom"], tuple(window["bounds"]))
+
+
+def visible_listings(grid, window, index=None, boroughs=None):
+    """
+    Sorted row positions of the listings inside the window, optionally only
+    those in the given boroughs (looked up in the FilterIndex `index`).
+    """
+    rows = grid.query(*window["bounds"])
+    if boroughs:
+        rows = index.select(within=rows, neighborhood_group_cleansed=boroughs)
+    return rows
+
+
+def aggregate_cells(lons, lats, window):
+    """
+    Bin points into square screen cells of BIN_PX at the window's zoom.
+    Returns a DataFrame with the cell centroid (longitude, latitude) and count.
+    """
+    lon_min, lat_min = window["bounds"][:2]
+    size = degrees_per_px(window["zoom"]) * BIN_PX
+    lat_size = size * math.cos(math.radians(NYC_CENTER["lat"]))
+
+    ix = ((lons - lon_min) // size).astype(np.int64)
+    iy = ((lats - lat_min) // lat_size).astype(np.int64)
+    cells, inverse, counts = np.unique(
+        iy * (1 << 32) + ix, return_inverse=True, return_counts=True
+    )
+    return pd.DataFrame({
+        "longitude": np.bincount(inverse, weights=lons) / counts,
+        "latitude": np.bincount(inverse, weights=lats) / counts,
+        "count": counts,
+    })
+
+
+def listing_layer(df, grid, window, index=None, boroughs=None, budget=POINT_BUDGET):
+    """
+    ("points", rows of df) if the visible listings fit the budget, otherwise
+    ("cells", aggregate_cells(...)).
+    """
+    rows = visible_listings(grid, window, index, boroughs)
+    if len(rows) <= budget:
+        return "points", df.iloc[rows]
+
+    lons = df["longitude"].to_numpy(dtype=np.float64)[rows]
+    lats = df["latitude"].to_numpy(dtype=np.float64)[rows]
+    return "cells", aggregate_cells(lons, lats, window)
+
+
+def cells_trace(cells, name=None, showlegend=False):
+    """
+    Scattermapbox trace (plain dict) of aggregated cells: marker area and
+    colour follow the count.
+    """
+    counts = cells["count"].to_numpy()
+    scale = np.sqrt(counts / counts.max()) if len(counts) else counts
+    return figures.scatter_mapbox(
+        cells["latitude"],
+        cells["longitude"],
+        marker=dict(
+            size=4 + 16 * scale,
+            color=np.log10(counts) if len(counts) else counts,
+            colorscale=figures.named_colorscale("Viridis"),
+            opacity=0.7,
+        ),
+        name=name,
+        showlegend=showlegend,
+        text=counts,
+        hovertemplate="%{text:,} listings<extra></extra>",
+    )